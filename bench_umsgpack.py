@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+# Run bench_umsgpack.py with your Python interpreter of choice to benchmark
+# u-msgpack-python, optionally saving results to, or comparing results
+# against, a baseline file to catch regressions.
+#
+#   $ python3 bench_umsgpack.py
+#   $ python3 bench_umsgpack.py --save baseline.json
+#   $ python3 bench_umsgpack.py --compare baseline.json
+#   $ python3 bench_umsgpack.py parallel
+#   $ python3 bench_umsgpack.py --memory --save baseline.json
+#   $ python3 bench_umsgpack.py --profile records
+#
+
+import argparse
+import compileall
+import datetime
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import umsgpack
+
+##########################################################################
+
+records_payload = [
+    {u"ts": datetime.datetime(2023, 5, 18, 10, 5, 2, i % 1000000, umsgpack._utc_tzinfo),
+     u"host": u"host-{:d}".format(i % 16), u"value": i * 0.5, u"ok": i % 3 == 0,
+     u"tags": [u"a", u"b", u"c"]}
+    for i in range(1000)
+]
+
+payloads = [
+    ["integers", list(range(-5000, 5000)) + [2**32 + i for i in range(1000)]],
+    ["floats", [i * 1.1 for i in range(10000)]],
+    ["short strings", [u"string {:d}".format(i) for i in range(10000)]],
+    ["binary", [b"\x80" * (i % 512) for i in range(2000)]],
+    ["large binary", [b"\x80" * (8 * 2**20)] * 4],
+    ["large string", [u"\u00e9" * (4 * 2**20)] * 4],
+    ["timestamps", [datetime.datetime(2023, 5, 18, 10, 5, 2, (i % 2) * i, umsgpack._utc_tzinfo) for i in range(5000)] +
+                   [datetime.datetime(2023, 5, 18, 10, 5, 2, (i % 2) * i) for i in range(5000)]],
+    ["records", records_payload],
+    ["nested", [[[[i, [i]], {u"k": [i]}]] for i in range(2000)]],
+]
+
+
+def bench_packb(obj):
+    return lambda directory: lambda: umsgpack.packb(obj)
+
+
+def bench_unpackb(obj):
+    def setup(directory):
+        data = umsgpack.packb(obj)
+        return lambda: umsgpack.unpackb(data)
+    return setup
+
+
+def write_records_file(directory):
+    path = os.path.join(directory, "records.msgpack")
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            for _ in range(50):
+                for record in records_payload:
+                    umsgpack.pack(record, f)
+    return path
+
+
+def bench_unpack_file(directory):
+    path = write_records_file(directory)
+
+    def fn():
+        with open(path, "rb") as f:
+            unpacker = umsgpack.Unpacker(f)
+            for _ in range(50 * len(records_payload)):
+                unpacker.unpack()
+    return fn
+
+
+def bench_unpack_large_file(directory):
+    path = os.path.join(directory, "large.msgpack")
+    with open(path, "wb") as f:
+        umsgpack.pack([b"\x80" * (8 * 2**20)] * 4, f)
+
+    def fn():
+        with open(path, "rb") as f:
+            umsgpack.unpack(f)
+    return fn
+
+
+def bench_gzip_unpack(directory):
+    path = os.path.join(directory, "records.msgpack.gz")
+    with gzip.open(path, "wb") as f:
+        for record in records_payload:
+            umsgpack.pack(record, f)
+
+    def fn():
+        with gzip.open(path, "rb") as f:
+            unpacker = umsgpack.Unpacker(f)
+            for _ in range(len(records_payload)):
+                unpacker.unpack()
+    return fn
+
+
+def bench_compressed_unpack(directory):
+    import umsgpack.compressed
+    path = os.path.join(directory, "records.umpz")
+    with open(path, "wb") as f:
+        with umsgpack.compressed.CompressedWriter(f) as writer:
+            for record in records_payload:
+                writer.pack(record)
+
+    def fn():
+        with open(path, "rb") as f:
+            for _ in umsgpack.compressed.CompressedReader(f):
+                pass
+    return fn
+
+
+def bench_parallel_unpack_file(workers):
+    def setup(directory):
+        import umsgpack.parallel
+        path = write_records_file(directory)
+        return lambda: sum(1 for _ in umsgpack.parallel.unpack_file(path, workers=workers, shard_size=2**18))
+    return setup
+
+
+def bench_packb_parallel(workers, use_processes):
+    def setup(directory):
+        import umsgpack.parallel
+        obj = records_payload * 20
+        return lambda: umsgpack.parallel.packb_parallel(obj, workers=workers, use_processes=use_processes)
+    return setup
+
+
+def bench_import(statement):
+    # Run a fresh interpreter without site initialization, from the directory
+    # of the umsgpack package under test, with bytecode compiled up front
+    def setup(directory):
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(umsgpack.__file__)))
+        compileall.compile_dir(os.path.join(cwd, "umsgpack"), quiet=1)
+        return lambda: subprocess.check_call([sys.executable, "-S", "-c", statement], cwd=cwd)
+    return setup
+
+
+# List of (name, setup), where setup accepts a temporary directory and returns
+# the function to benchmark
+benchmarks = []
+for (name, obj) in payloads:
+    benchmarks.append(["packb " + name, bench_packb(obj)])
+    benchmarks.append(["unpackb " + name, bench_unpackb(obj)])
+
+benchmarks.append(["import interpreter startup", bench_import("pass")])
+benchmarks.append(["import umsgpack", bench_import("import umsgpack")])
+benchmarks.append(["unpack large binary file", bench_unpack_large_file])
+benchmarks.append(["compressed unpack gzip.open", bench_gzip_unpack])
+benchmarks.append(["compressed unpack zlib blocks", bench_compressed_unpack])
+benchmarks.append(["packed_size records",
+                   lambda directory: lambda: umsgpack.packed_size(records_payload)])
+benchmarks.append(["packb records canonical",
+                   lambda directory: lambda: umsgpack.packb(records_payload, canonical=True)])
+benchmarks.append(["packb records string_cache",
+                   lambda directory: lambda: umsgpack.packb(records_payload, string_cache=umsgpack.StringCache())])
+
+if sys.version_info[0] == 3:
+    benchmarks.append(["parallel unpack_file serial", bench_unpack_file])
+    workers = 1
+    while workers <= (os.cpu_count() or 1) * 2:
+        benchmarks.append(["parallel unpack_file workers={:d}".format(workers),
+                           bench_parallel_unpack_file(workers)])
+        benchmarks.append(["parallel packb threads={:d}".format(workers),
+                           bench_packb_parallel(workers, False)])
+        benchmarks.append(["parallel packb processes={:d}".format(workers),
+                           bench_packb_parallel(workers, True)])
+        workers *= 2
+
+##########################################################################
+
+
+# Suffix of peak memory results, in bytes
+PEAK_SUFFIX = " [peak]"
+
+
+def format_result(name, value):
+    if name.endswith(PEAK_SUFFIX):
+        return "{:>9.1f} KiB".format(value / 1024.0)
+    return "{:>9.3f} ms".format(value * 1e3)
+
+
+def measure_peak(fn):
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(benchmarks, directory, repeat, number, memory):
+    results = {}
+    for (name, setup) in benchmarks:
+        fn = setup(directory)
+        best = min(timeit.repeat(fn, repeat=repeat, number=number)) / number
+        results[name] = best
+        print("{:<40s} {:s}".format(name, format_result(name, best)))
+        if memory:
+            results[name + PEAK_SUFFIX] = measure_peak(fn)
+            print("{:<40s} {:s}".format(name + PEAK_SUFFIX, format_result(name + PEAK_SUFFIX, results[name + PEAK_SUFFIX])))
+    return results
+
+
+def profile(filters):
+    import umsgpack.profiling
+    for (name, obj) in payloads:
+        if filters and not any(f in name for f in filters):
+            continue
+        print(umsgpack.profiling.profile_pack(obj))
+        print("")
+        print(umsgpack.profiling.profile_unpack(umsgpack.packb(obj)))
+        print("")
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print("")
+    print("{:<40s} {:>12s} {:>12s} {:>9s}".format("benchmark", "baseline", "current", "change"))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        change = results[name] / baseline[name] - 1 if baseline[name] else 0
+        flag = " REGRESSION" if change > threshold else ""
+        print("{:<40s} {:s} {:s} {:>+8.1f}%{:s}".format(
+              name, format_result(name, baseline[name]), format_result(name, results[name]), change * 100, flag))
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark u-msgpack-python.")
+    parser.add_argument("filters", nargs="*", help="only run benchmarks containing these substrings")
+    parser.add_argument("--repeat", type=int, default=5, help="number of repetitions (default 5)")
+    parser.add_argument("--number", type=int, default=3, help="calls per repetition (default 3)")
+    parser.add_argument("--save", metavar="FILE", help="save results to baseline file")
+    parser.add_argument("--compare", metavar="FILE", help="compare results against baseline file")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown or memory growth reported as regression (default 0.10)")
+    parser.add_argument("--memory", action="store_true",
+                        help="also measure peak memory of each benchmark with tracemalloc (Python 3)")
+    parser.add_argument("--profile", action="store_true",
+                        help="print allocation profiles of packing and unpacking payloads (Python 3)")
+    args = parser.parse_args()
+
+    if args.profile:
+        profile(args.filters)
+        return 0
+
+    selected = [b for b in benchmarks if not args.filters or any(f in b[0] for f in args.filters)]
+
+    directory = tempfile.mkdtemp()
+    try:
+        results = run(selected, directory, args.repeat, args.number, args.memory)
+    finally:
+        shutil.rmtree(directory)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+# Run fuzz_umsgpack.py with your Python interpreter of choice to fuzz
+# u-msgpack-python with random valid and malformed MessagePack, starting from
+# the seed corpus in fuzz_corpus/. Failing and slow inputs can be recorded to a
+# directory, and replayed later as regression cases. Runs offline, and is
+# reproducible with a fixed seed.
+#
+#   $ python3 fuzz_umsgpack.py
+#   $ python3 fuzz_umsgpack.py --iterations 100000 --seed 1234
+#   $ python3 fuzz_umsgpack.py --record findings/
+#   $ python3 fuzz_umsgpack.py --replay findings/
+#
+# Valid objects are checked for:
+#   * round trip through packb() and unpackb()
+#   * identical results from recursive and iterative packing, packed_size(),
+#     and streaming unpacking with short reads
+#   * InsufficientDataException on every truncation of the serialized bytes
+#
+# Arbitrary inputs, from the corpus and from mutations of valid data, are
+# checked for:
+#   * rejection with an UnpackException (or RecursionError, for deeply nested
+#     input), and no other exception
+#   * stable packing of the unpacked object
+#   * decode time under the slow input threshold
+#   * peak memory allocated while decoding from a buffered stream bounded by
+#     the input size, not by declared lengths (Python 3 only)
+#
+
+import argparse
+import datetime
+import hashlib
+import io
+import os
+import random
+import struct
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import umsgpack
+
+if sys.version_info[0] == 3:
+    unichr = chr
+else:
+    RecursionError = RuntimeError
+
+timer = getattr(time, "perf_counter", time.time)
+
+corpus_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fuzz_corpus")
+
+##########################################################################
+# Random objects
+##########################################################################
+
+boundary_integers = [
+    0, 1, 127, 128, 255, 256, 2**15 - 1, 2**15, 2**16 - 1, 2**16, 2**31 - 1,
+    2**31, 2**32 - 1, 2**32, 2**63 - 1, 2**63, 2**64 - 1,
+    -1, -32, -33, -128, -129, -2**15, -2**15 - 1, -2**31, -2**31 - 1, -2**63,
+]
+
+boundary_lengths = [0, 1, 15, 16, 31, 32, 255, 256, 2**16 - 1, 2**16]
+
+
+def random_length(rng):
+    if rng.random() < 0.02:
+        return rng.choice(boundary_lengths)
+    return rng.randint(0, 40)
+
+
+def random_bytes(rng, length):
+    return bytes(bytearray(rng.getrandbits(8) for _ in range(length)))
+
+
+def random_string(rng):
+    length = random_length(rng)
+    if length > 40:
+        return unichr(rng.randint(0x20, 0xd7ff)) * length
+    elif rng.random() < 0.8:
+        return u"".join(unichr(rng.randint(0x20, 0x7e)) for _ in range(length))
+    # Code points outside of the surrogate range
+    return u"".join(unichr(rng.choice([rng.randint(0x80, 0xd7ff), rng.randint(0xe000, 0xffff)]))
+                    for _ in range(length))
+
+
+def random_float(rng):
+    while True:
+        f = struct.unpack(">d", random_bytes(rng, 8))[0]
+        if f == f:
+            return rng.choice([f, rng.uniform(-1e6, 1e6), float(rng.randint(-100, 100)), 0.5, -0.0])
+
+
+def random_datetime(rng):
+    seconds = rng.randint(-2**34, 2**34)
+    microseconds = rng.choice([0, rng.randint(0, 999999)])
+    return umsgpack._epoch + datetime.timedelta(0, seconds, microseconds)
+
+
+def random_scalar(rng):
+    kind = rng.randint(0, 9)
+    if kind == 0:
+        return rng.choice([None, True, False])
+    elif kind == 1:
+        return rng.choice(boundary_integers)
+    elif kind == 2:
+        return rng.randint(-2**63, 2**64 - 1) >> rng.randint(0, 63)
+    elif kind == 3:
+        return random_float(rng)
+    elif kind in (4, 5):
+        return random_string(rng)
+    elif kind == 6:
+        return random_bytes(rng, random_length(rng))
+    elif kind == 7:
+        # Ext type -1 is reserved for timestamps
+        return umsgpack.Ext(rng.choice([rng.randint(0, 127), rng.randint(-128, -2)]),
+                            random_bytes(rng, rng.choice([1, 2, 4, 8, 16, random_length(rng)])))
+    elif kind == 8:
+        return random_datetime(rng)
+    return rng.randint(-32, 127)
+
+
+def random_key(rng):
+    return rng.choice([random_string, lambda rng: rng.choice(boundary_integers), lambda rng: random_bytes(rng, 4)])(rng)
+
+
+def random_object(rng, depth=0):
+    """
+    Generate a random object of packable types, which round trips through
+    packb() and unpackb() with default options.
+    """
+    kind = rng.randint(0, 5) if depth < 3 else 0
+    if kind == 4:
+        return [random_object(rng, depth + 1) for _ in range(rng.randint(0, rng.choice([4, 20])))]
+    elif kind == 5:
+        return dict((random_key(rng), random_object(rng, depth + 1)) for _ in range(rng.randint(0, rng.choice([4, 20]))))
+    return random_scalar(rng)
+
+
+##########################################################################
+# Mutations
+##########################################################################
+
+# Headers with the maximum declared length of str32, bin32, array32, map32,
+# and ext32
+inflated_headers = [b"\xdb\xff\xff\xff\xff", b"\xc6\xff\xff\xff\xff", b"\xdd\xff\xff\xff\xff",
+                    b"\xdf\xff\xff\xff\xff", b"\xc9\xff\xff\xff\xff\x05"]
+
+
+def mutate(rng, data, pool):
+    """
+    Return a malformed variant of serialized bytes.
+    """
+    data = bytearray(data)
+    for _ in range(rng.randint(1, 4)):
+        kind = rng.randint(0, 6)
+        position = rng.randint(0, len(data))
+        if kind == 0 and data:
+            # Flip bits of a byte
+            position = min(position, len(data) - 1)
+            data[position] ^= 1 << rng.randint(0, 7)
+        elif kind == 1:
+            # Insert a random byte
+            data[position:position] = bytearray([rng.getrandbits(8)])
+        elif kind == 2:
+            # Delete a range
+            del data[position:position + rng.randint(1, 8)]
+        elif kind == 3:
+            # Truncate
+            del data[position:]
+        elif kind == 4:
+            # Insert a header with a huge declared length
+            data[position:position] = rng.choice(inflated_headers)
+        elif kind == 5:
+            # Splice in another input
+            other = rng.choice(pool)
+            data[position:position] = other[:rng.randint(0, len(other))]
+        else:
+            # Duplicate a range
+            data[position:position] = data[position:position + rng.randint(1, 16)]
+    return bytes(data)
+
+
+##########################################################################
+# Checks
+##########################################################################
+
+
+class ShortReadFile(object):
+    # File-like object that returns at most one byte per read
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def read(self, n=-1):
+        return self._data.read(1 if n != 0 else 0)
+
+
+def memory_limit(data):
+    # Allocations proportional to the input, plus up to two maximum size reads
+    return 64 * len(data) + 2 * umsgpack._read_chunk_size + 2**16
+
+
+def measure_unpack(data):
+    """
+    Unpack bytes, and return (object, exception, elapsed time, peak memory).
+    Peak memory is measured while unpacking from a buffered stream, which
+    allocates up front for a requested read size, and is None without
+    tracemalloc.
+    """
+    obj, exc = None, None
+    start = timer()
+    try:
+        obj = umsgpack.unpackb(data)
+    except Exception as e:
+        exc = e
+    elapsed = timer() - start
+
+    peak = None
+    if tracemalloc is not None:
+        fp = io.BufferedReader(io.BytesIO(data))
+        tracemalloc.start()
+        try:
+            umsgpack.unpack(fp)
+            peak = tracemalloc.get_traced_memory()[1]
+        except MemoryError:
+            # Allocation for a declared length failed outright
+            peak = sys.maxsize
+        except Exception:
+            peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return (obj, exc, elapsed, peak)
+
+
+def check_input(data, slow):
+    """
+    Check arbitrary bytes, and return a list of (kind, message) failures.
+    """
+    failures = []
+
+    obj, exc, elapsed, peak = measure_unpack(data)
+    if exc is not None and not isinstance(exc, (umsgpack.UnpackException, RecursionError)):
+        failures.append(("crash", "unexpected {:s}: {:s}".format(type(exc).__name__, str(exc))))
+    if elapsed > slow:
+        failures.append(("slow", "unpacking took {:.3f} s".format(elapsed)))
+    if peak is not None and peak > memory_limit(data):
+        failures.append(("memory", "unpacking allocated {:d} bytes".format(peak)))
+
+    if exc is None:
+        # Canonical packing is independent of dict ordering
+        try:
+            packed = umsgpack.packb(obj, canonical=True)
+            repacked = umsgpack.packb(umsgpack.unpackb(packed), canonical=True)
+        except Exception as e:
+            failures.append(("repack", "unexpected {:s}: {:s}".format(type(e).__name__, str(e))))
+        else:
+            if packed != repacked:
+                failures.append(("repack", "packing of unpacked object is not stable"))
+
+    return failures
+
+
+def check_object(obj, slow):
+    """
+    Check a valid object, and return a list of (kind, message, data)
+    failures.
+    """
+    data = umsgpack.packb(obj)
+    failures = []
+
+    def fail(kind, message, failed_data=data):
+        failures.append((kind, message, failed_data))
+
+    try:
+        if umsgpack.unpackb(data) != obj:
+            fail("roundtrip", "unpacked object differs")
+        if umsgpack.unpack(ShortReadFile(data)) != obj:
+            fail("roundtrip", "unpacked object with short reads differs")
+    except Exception as e:
+        fail("roundtrip", "unexpected {:s}: {:s}".format(type(e).__name__, str(e)))
+        return failures
+
+    if umsgpack.packb(obj, iterative=True) != data:
+        fail("differential", "iterative packing differs")
+    if umsgpack.packed_size(obj) != len(data):
+        fail("differential", "packed_size() differs")
+    fp = io.BytesIO()
+    umsgpack.Packer(fp).pack(obj)
+    if fp.getvalue() != data:
+        fail("differential", "Packer packing differs")
+
+    # Every truncation, or a sample of truncations of long data
+    if len(data) <= 256:
+        lengths = range(len(data))
+    else:
+        lengths = sorted(random.Random(len(data)).sample(range(len(data)), 32))
+
+    for length in lengths:
+        truncated = data[:length]
+        _, exc, elapsed, peak = measure_unpack(truncated)
+        if not isinstance(exc, umsgpack.InsufficientDataException):
+            fail("truncation", "truncation to {:d} bytes raised {:s}".format(length, type(exc).__name__), truncated)
+        elif elapsed > slow:
+            fail("slow", "truncation to {:d} bytes took {:.3f} s".format(length, elapsed), truncated)
+        elif peak is not None and peak > memory_limit(truncated):
+            fail("memory", "truncation to {:d} bytes allocated {:d} bytes".format(length, peak), truncated)
+
+    return failures
+
+
+##########################################################################
+
+
+def load_corpus(paths):
+    corpus = []
+    for path in paths:
+        names = sorted(os.listdir(path)) if os.path.isdir(path) else [None]
+        for name in names:
+            filename = os.path.join(path, name) if name is not None else path
+            with open(filename, "rb") as f:
+                corpus.append((filename, f.read()))
+    return corpus
+
+
+def record(directory, kind, data):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    filename = os.path.join(directory, "{:s}-{:s}.msgpack".format(kind, hashlib.sha1(data).hexdigest()[:16]))
+    with open(filename, "wb") as f:
+        f.write(data)
+    return filename
+
+
+def report(kind, message, data, args):
+    print("{:<12s} {:s} ({:d} bytes: {:s}{:s})".format(
+          kind, message, len(data), repr(data[:32]), "..." if len(data) > 32 else ""))
+    if args.record:
+        print("{:<12s} recorded {:s}".format("", record(args.record, kind, data)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzz u-msgpack-python.")
+    parser.add_argument("--iterations", type=int, default=2000, help="number of fuzzing iterations (default 2000)")
+    parser.add_argument("--seed", type=int, help="random seed (default random)")
+    parser.add_argument("--corpus", metavar="PATH", action="append",
+                        help="seed corpus file or directory (default fuzz_corpus/)")
+    parser.add_argument("--record", metavar="DIR", help="record failing and slow inputs to directory")
+    parser.add_argument("--replay", metavar="PATH", nargs="+",
+                        help="only check inputs from files or directories, e.g. recorded findings")
+    parser.add_argument("--slow", type=float, default=0.1,
+                        help="decode time in seconds reported as slow (default 0.1)")
+    args = parser.parse_args()
+
+    failures = 0
+
+    # Check corpus inputs
+    corpus = load_corpus(args.replay or args.corpus or [corpus_directory])
+    for (filename, data) in corpus:
+        for (kind, message) in check_input(data, args.slow):
+            report(kind, "{:s}: {:s}".format(filename, message), data, args)
+            failures += 1
+
+    if args.replay:
+        print("{:d} inputs replayed, {:d} failures".format(len(corpus), failures))
+        return 1 if failures else 0
+
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+    rng = random.Random(seed)
+    pool = [data for (_, data) in corpus] or [b"\xc0"]
+
+    for i in range(args.iterations):
+        if i % 2 == 0:
+            obj = random_object(rng)
+            for (kind, message, data) in check_object(obj, args.slow):
+                report(kind, message, data, args)
+                failures += 1
+
+            # Keep a bounded pool of valid inputs to mutate
+            data = umsgpack.packb(obj)
+            if len(pool) < 256:
+                pool.append(data)
+            else:
+                pool[rng.randrange(len(pool))] = data
+        else:
+            data = mutate(rng, rng.choice(pool), pool)
+            for (kind, message) in check_input(data, args.slow):
+                report(kind, message, data, args)
+                failures += 1
+
+    print("{:d} corpus inputs, {:d} iterations with seed {:d}, {:d} failures".format(
+          len(corpus), args.iterations, seed, failures))
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,9 +13,17 @@ import struct
 import unittest
 import datetime
 import io
+import os
+import shutil
+import tempfile
+import pickle
+import mmap
+import socket
 from collections import OrderedDict, namedtuple
 
 import umsgpack
+import umsgpack.framed
+import umsgpack.compressed
 
 single_test_vectors = [
     # None
@@ -287,6 +295,9 @@ unpack_exception_test_vectors = [
     # Unsupported timestamp (unsupported data length)
     ["unsupported timestamp", b"\xc7\x02\xff\xaa\xbb",
         umsgpack.UnsupportedTimestampException],
+    # Unsupported timestamp (out of range of datetime)
+    ["unsupported timestamp", b"\xc7\x0c\xff\x00\x00\x00\x00\x7f\xff\xff\xff\xff\xff\xff\xff",
+        umsgpack.UnsupportedTimestampException],
     # Invalid string (non utf-8)
     ["invalid string", b"\xa1\x80",
         umsgpack.InvalidStringException],
@@ -319,6 +330,32 @@ float_precision_test_vectors = [
     ["float precision double", 2.5, b"\xcb\x40\x04\x00\x00\x00\x00\x00\x00"],
 ]
 
+float_auto_precision_test_vectors = [
+    ["float auto precision single", 2.5, b"\xca\x40\x20\x00\x00"],
+    ["float auto precision double", 0.1, b"\xcb\x3f\xb9\x99\x99\x99\x99\x99\x9a"],
+    ["float auto precision out of single range", 1e300, b"\xcb\x7e\x37\xe4\x3c\x88\x00\x75\x9c"],
+    ["float auto precision negative zero", -0.0, b"\xca\x80\x00\x00\x00"],
+    ["float auto precision infinity", float("-inf"), b"\xca\xff\x80\x00\x00"],
+    ["float auto precision nan", struct.unpack(">d", b"\x7f\xf8\x00\x00\x00\x00\x00\x00")[0],
+        b"\xca\x7f\xc0\x00\x00"],
+    ["float auto precision negative nan", struct.unpack(">d", b"\xff\xf8\x00\x00\x00\x00\x00\x00")[0],
+        b"\xca\xff\xc0\x00\x00"],
+    ["float auto precision nan single payload", struct.unpack(">d", b"\x7f\xf8\x00\x00\x20\x00\x00\x00")[0],
+        b"\xca\x7f\xc0\x00\x01"],
+    ["float auto precision nan double payload", struct.unpack(">d", b"\x7f\xf8\x00\x00\x00\x00\x00\x01")[0],
+        b"\xcb\x7f\xf8\x00\x00\x00\x00\x00\x01"],
+]
+
+integral_float_test_vectors = [
+    ["integral float positive fixint", 5.0, b"\x05"],
+    ["integral float negative int", -1000.0, b"\xd1\xfc\x18"],
+    ["integral float 64-bit uint", 2.0**63, b"\xcf\x80\x00\x00\x00\x00\x00\x00\x00"],
+    ["integral float out of int range", 2.0**64, b"\xcb\x43\xf0\x00\x00\x00\x00\x00\x00"],
+    ["integral float negative zero", -0.0, b"\xcb\x80\x00\x00\x00\x00\x00\x00\x00"],
+    ["non-integral float", 2.5, b"\xcb\x40\x04\x00\x00\x00\x00\x00\x00"],
+    ["integral float infinity", float("inf"), b"\xcb\x7f\xf0\x00\x00\x00\x00\x00\x00"],
+]
+
 tuple_test_vectors = [
     ["nested array", [0x01, [b"\x80", [[u"a", u"b", u"c"], True]]],
         b"\x92\x01\x92\xc4\x01\x80\x92\x93\xa1a\xa1b\xa1c\xc3",
@@ -337,6 +374,15 @@ naive_timestamp_test_vectors = [
         datetime.datetime(3000, 1, 1, 10, 5, 2, 1234, umsgpack._utc_tzinfo)],
 ]
 
+timestamp_format_test_vectors = [
+    ["32-bit timestamp", b"\xd6\xff\x38\x6d\xd1\x4e",
+        (946721102, 0), 946721102000000000],
+    ["64-bit timestamp", b"\xd7\xff\x1d\x6f\x34\x54\x64\x65\xf8\x4e",
+        (1684404302, 123456789), 1684404302123456789],
+    ["96-bit timestamp", b"\xc7\x0c\xff\x00\x00\x00\x01\xff\xff\xff\xff\xff\xff\xff\xff",
+        (-1, 1), -999999999],
+]
+
 CustomType = namedtuple('CustomType', ['x', 'y', 'z'])
 
 ext_handlers = {
@@ -371,25 +417,39 @@ override_ext_handlers_test_vectors = [
 # These are the only global variables that should be exported by umsgpack
 exported_vars_test_vector = [
     "Ext",
+    "ExtRegistry",
     "InvalidString",
+    "Timestamp",
     "PackException",
     "UnpackException",
     "UnsupportedTypeException",
+    "CircularReferenceException",
+    "InsufficientSpaceException",
     "InsufficientDataException",
     "InvalidStringException",
     "UnsupportedTimestampException",
     "ReservedCodeException",
     "UnhashableKeyException",
     "DuplicateKeyException",
+    "UnexpectedTypeException",
     "KeyNotPrimitiveException",
     "KeyDuplicateException",
     "ext_serializable",
+    "StringCache",
+    "SegmentWriter",
+    "Packer",
+    "Unpacker",
+    "iter_array",
+    "iter_map_items",
     "pack",
     "packb",
     "unpack",
     "unpackb",
     "dump",
     "dumps",
+    "packed_size",
+    "packb_chunks",
+    "pack_into",
     "load",
     "loads",
     "version",
@@ -426,6 +486,144 @@ class TestUmsgpack(unittest.TestCase):
             with self.assertRaises(exception):
                 umsgpack.packb(obj)
 
+    def test_packed_size(self):
+        for (name, obj, data) in single_test_vectors + composite_test_vectors:
+            obj_repr = repr(obj)
+            print("\tTesting {:s}: object {:s}".format(
+                  name, obj_repr if len(obj_repr) < 24 else obj_repr[0:24] + "..."))
+
+            self.assertEqual(umsgpack.packed_size(obj), len(umsgpack.packb(obj)))
+
+        for (name, obj, data, _) in naive_timestamp_test_vectors:
+            self.assertEqual(umsgpack.packed_size(obj), len(data))
+
+        # Packing options
+        for (name, obj, data) in compatibility_test_vectors:
+            self.assertEqual(umsgpack.packed_size(obj, compatibility=True), len(data))
+        for (name, obj, data) in ext_handlers_test_vectors:
+            self.assertEqual(umsgpack.packed_size(obj, ext_handlers=ext_handlers), len(data))
+        for (name, obj, data) in float_auto_precision_test_vectors:
+            self.assertEqual(umsgpack.packed_size(obj, force_float_precision="auto"), len(data))
+        for (name, obj, data) in integral_float_test_vectors:
+            self.assertEqual(umsgpack.packed_size(obj, integral_float_as_int=True), len(data))
+        self.assertEqual(umsgpack.packed_size(2.5, force_float_precision="single"), 5)
+
+        # Exceptions
+        for (name, obj, exception) in pack_exception_test_vectors:
+            with self.assertRaises(exception):
+                umsgpack.packed_size(obj)
+
+        obj = [1, 2]
+        obj.append({u"a": obj})
+        with self.assertRaises(umsgpack.CircularReferenceException):
+            umsgpack.packed_size(obj)
+
+        # Packer
+        packer = umsgpack.Packer(io.BytesIO(), compatibility=True)
+        self.assertEqual(packer.packed_size([u"abc", b"abc"]), 9)
+
+    def test_packb_chunks(self):
+        records = [{u"id": i, u"data": u"x" * (i % 100)} for i in range(1000)]
+
+        for max_size in [120, 1000, 70000, 2**20]:
+            chunks = list(umsgpack.packb_chunks(records, max_size))
+            self.assertTrue(all(len(chunk) <= max_size for chunk in chunks))
+
+            unpacked = [umsgpack.unpackb(chunk) for chunk in chunks]
+            self.assertEqual(sum(unpacked, []), records)
+
+            # Chunks are filled up to the next element
+            for chunk, next_chunk in zip(chunks, unpacked[1:]):
+                self.assertTrue(len(chunk) + len(umsgpack.packb(next_chunk[0])) > max_size - 2)
+
+        # Single chunk, generator input, and packing options
+        self.assertEqual(list(umsgpack.packb_chunks((x for x in [u"a", 1.5]), 100, force_float_precision="single")),
+                         [umsgpack.packb([u"a", 1.5], force_float_precision="single")])
+
+        # Empty
+        self.assertEqual(list(umsgpack.packb_chunks([], 100)), [])
+
+        # Element too large
+        with self.assertRaises(umsgpack.InsufficientSpaceException):
+            list(umsgpack.packb_chunks([1, b"x" * 100], 100))
+
+    def test_pack_into(self):
+        obj = {u"compact": True, u"schema": 0, u"blob": b"\x80" * 2**15}
+        data = umsgpack.packb(obj)
+
+        buf = bytearray(len(data) + 8)
+        self.assertEqual(umsgpack.pack_into(obj, buf, 8), len(buf))
+        self.assertEqual(bytes(buf[8:]), data)
+        self.assertEqual(bytes(buf[:8]), b"\x00" * 8)
+
+        # Consecutive records, and packing options
+        buf = bytearray(16)
+        offset = umsgpack.pack_into(1.5, buf, force_float_precision="single")
+        offset = umsgpack.pack_into([u"a"], buf, offset)
+        self.assertEqual(offset, 8)
+        self.assertEqual(bytes(buf[:offset]), b"\xca\x3f\xc0\x00\x00\x91\xa1a")
+
+        # Memory map, closable after packing
+        m = mmap.mmap(-1, 4096)
+        self.assertEqual(umsgpack.pack_into([1, 2, 3], m, 100), 104)
+        self.assertEqual(m[100:104], b"\x93\x01\x02\x03")
+        m.close()
+
+        # Insufficient space, with required size reported
+        with self.assertRaises(umsgpack.InsufficientSpaceException) as cm:
+            umsgpack.pack_into(obj, bytearray(len(data) + 3), 4)
+        self.assertEqual(str(cm.exception), "serialized object of {:d} bytes exceeds remaining space of {:d} bytes".format(
+                         len(data), len(data) - 1))
+
+        with self.assertRaises(umsgpack.InsufficientSpaceException):
+            umsgpack.pack_into(None, bytearray(4), 4)
+
+        # Buffer is not resized
+        buf = bytearray(2)
+        with self.assertRaises(umsgpack.InsufficientSpaceException):
+            umsgpack.pack_into(u"abc", buf)
+        self.assertEqual(len(buf), 2)
+
+        # Invalid buffer and offset
+        with self.assertRaises(TypeError):
+            umsgpack.pack_into(None, b"\x00" * 4)
+        with self.assertRaises(ValueError):
+            umsgpack.pack_into(None, bytearray(4), 5)
+        with self.assertRaises(ValueError):
+            umsgpack.pack_into(None, bytearray(4), -1)
+
+    def test_pack_iterative(self):
+        for (name, obj, data) in single_test_vectors + composite_test_vectors:
+            obj_repr = repr(obj)
+            print("\tTesting {:s}: object {:s}".format(
+                  name, obj_repr if len(obj_repr) < 24 else obj_repr[0:24] + "..."))
+
+            self.assertEqual(umsgpack.packb(obj, iterative=True), data)
+
+        # Test nesting deeper than the recursion limit
+        depth = sys.getrecursionlimit() * 4
+        obj = []
+        for _ in range(depth):
+            obj = [{u"a": obj}]
+        packed = umsgpack.packb(obj, iterative=True)
+        self.assertEqual(packed, b"\x91\x81\xa1a" * depth + b"\x90")
+
+        # Test shared, non-circular references
+        shared = [1, 2]
+        packed = umsgpack.packb([shared, {u"a": shared}], iterative=True)
+        self.assertEqual(packed, b"\x92\x92\x01\x02\x81\xa1a\x92\x01\x02")
+
+    def test_pack_iterative_circular_reference(self):
+        obj = [1, 2]
+        obj.append(obj)
+        with self.assertRaises(umsgpack.CircularReferenceException):
+            umsgpack.packb(obj, iterative=True)
+
+        obj = {u"a": [1, 2]}
+        obj[u"a"].append(obj)
+        with self.assertRaises(umsgpack.CircularReferenceException):
+            umsgpack.packb(obj, iterative=True)
+
     def test_unpack_single(self):
         for (name, obj, data) in single_test_vectors:
             obj_repr = repr(obj)
@@ -500,6 +698,40 @@ class TestUmsgpack(unittest.TestCase):
 
         umsgpack.compatibility = False
 
+    def test_compatibility_option(self):
+        for (name, obj, data) in compatibility_test_vectors:
+            obj_repr = repr(obj)
+            print("\tTesting {:s}: object {:s}".format(
+                  name, obj_repr if len(obj_repr) < 24 else obj_repr[0:24] + "..."))
+
+            self.assertEqual(umsgpack.packb(obj, compatibility=True), data)
+
+            if sys.version_info[0] == 3 and isinstance(obj, str):
+                _obj = obj.encode('utf-8')
+            elif sys.version_info[0] == 2 and isinstance(obj, unicode):
+                _obj = bytes(obj)
+            else:
+                _obj = obj
+
+            unpacked = umsgpack.unpackb(data, compatibility=True)
+            self.assertTrue(isinstance(unpacked, type(_obj)))
+            self.assertEqual(unpacked, _obj)
+
+        # Per-call option overrides module-wide compatibility mode
+        umsgpack.compatibility = True
+        try:
+            self.assertEqual(umsgpack.packb([u"abc", b"abc"], compatibility=False), b"\x92\xa3abc\xc4\x03abc")
+            self.assertEqual(umsgpack.unpackb(b"\xa3abc", compatibility=False), u"abc")
+        finally:
+            umsgpack.compatibility = False
+
+        # Packer and Unpacker options
+        f = io.BytesIO()
+        umsgpack.Packer(f, compatibility=True).pack([u"abc", b"abc"])
+        self.assertEqual(f.getvalue(), b"\x92\xa3abc\xa3abc")
+        f.seek(0)
+        self.assertEqual(umsgpack.Unpacker(f, compatibility=True).unpack(), [b"abc", b"abc"])
+
     def test_unpack_invalid_string(self):
         # Use last unpack exception test vector (an invalid string)
         (_, data, _) = unpack_exception_test_vectors[-1]
@@ -538,6 +770,105 @@ class TestUmsgpack(unittest.TestCase):
         # Unpack with use_tuple=True (tuple)
         self.assertEqual(umsgpack.unpackb(data, use_tuple=True), obj_tuple)
 
+    def test_unpack_hooks(self):
+        # {u"a": [1, {u"b": 2}], u"c": [3, 4]}
+        data = b"\x82\xa1a\x92\x01\x81\xa1b\x02\xa1c\x92\x03\x04"
+
+        # Object hook, called on inner maps first
+        calls = []
+
+        def object_hook(d):
+            calls.append(d)
+            return sorted(d.items())
+
+        unpacked = umsgpack.unpackb(data, object_hook=object_hook)
+        self.assertEqual(unpacked, [(u"a", [1, [(u"b", 2)]]), (u"c", [3, 4])])
+        self.assertEqual(calls[0], {u"b": 2})
+
+        # Object hook with ordered dict
+        unpacked = umsgpack.unpackb(data, use_ordered_dict=True, object_hook=lambda d: d.__class__)
+        self.assertEqual(unpacked, OrderedDict)
+
+        # Object pairs hook, in serialized order
+        unpacked = umsgpack.unpackb(data, object_pairs_hook=list)
+        self.assertEqual(unpacked, [(u"a", [1, [(u"b", 2)]]), (u"c", [3, 4])])
+
+        # Object pairs hook takes precedence over object hook
+        unpacked = umsgpack.unpackb(data, object_pairs_hook=len, object_hook=lambda d: None)
+        self.assertEqual(unpacked, 2)
+
+        # Object pairs hook is passed duplicate keys
+        unpacked = umsgpack.unpackb(b"\x82\xa1a\x01\xa1a\x02", object_pairs_hook=list)
+        self.assertEqual(unpacked, [(u"a", 1), (u"a", 2)])
+        unpacked = umsgpack.unpackb(b"\x81\x92\x01\x02\x03", object_pairs_hook=list)
+        self.assertEqual(unpacked, [((1, 2), 3)])
+
+        # List hook
+        unpacked = umsgpack.unpackb(data, list_hook=tuple)
+        self.assertEqual(unpacked, {u"a": (1, {u"b": 2}), u"c": (3, 4)})
+        unpacked = umsgpack.unpackb(data, use_tuple=True, list_hook=sum, object_hook=len)
+        self.assertEqual(unpacked, 2)
+        unpacked = umsgpack.unpackb(b"\x92\x93\x01\x02\x03\x90", list_hook=len)
+        self.assertEqual(unpacked, 2)
+
+        # Streaming
+        f = io.BytesIO(data * 2)
+        unpacker = umsgpack.Unpacker(f, object_pairs_hook=dict, list_hook=tuple)
+        self.assertEqual(unpacker.unpack(), {u"a": (1, {u"b": 2}), u"c": (3, 4)})
+        self.assertEqual(umsgpack.unpack(f, object_pairs_hook=len), 2)
+
+    def test_unpack_strict_map_keys(self):
+        # Duplicate string, bytes, integer, float, and tuple keys
+        for data in [b"\x82\xa1a\xc3\xa1a\xc2", b"\x82\xc4\x01a\xc3\xc4\x01a\xc2",
+                     b"\x82\x01\xc3\x01\xc2", b"\x82\xcb\x3f\xf8\x00\x00\x00\x00\x00\x00\xc3\xcb\x3f\xf8\x00\x00\x00\x00\x00\x00\xc2",
+                     b"\x82\xc3\xc3\xc3\xc2"]:
+            with self.assertRaises(umsgpack.DuplicateKeyException):
+                umsgpack.unpackb(data)
+            with self.assertRaises(umsgpack.DuplicateKeyException):
+                umsgpack.unpackb(data, strict_map_keys=True)
+
+            # Last value wins without strict map keys
+            unpacked = umsgpack.unpackb(data, strict_map_keys=False)
+            self.assertEqual(list(unpacked.values()), [False])
+
+        # Mixed keys without strict map keys
+        unpacked = umsgpack.unpackb(b"\x84\xa1a\x01\xc4\x01b\x02\x03\x03\x92\x01\x02\x04",
+                                    strict_map_keys=False)
+        self.assertEqual(unpacked, {u"a": 1, b"b": 2, 3: 3, (1, 2): 4})
+
+        # Unhashable keys are still rejected without strict map keys
+        with self.assertRaises(umsgpack.UnhashableKeyException):
+            umsgpack.unpackb(b"\x82\x01\xc3\x81\x01\x01\xc2", strict_map_keys=False)
+        with self.assertRaises(umsgpack.UnhashableKeyException):
+            umsgpack.unpackb(b"\x81\x93\x01\x02\x80\xc3", strict_map_keys=False)
+
+    def test_unpack_raw_keys(self):
+        # { u"a": u"b", u"c": { u"d": [u"e"] }, 1: u"f", u"\x80" * 32: u"g" }
+        data = b"\x84\xa1a\xa1b\xa1c\x81\xa1d\x91\xa1e\x01\xa1f\xd9\x40" + b"\xc2\x80" * 32 + b"\xa1g"
+
+        unpacked = umsgpack.unpackb(data, raw_keys=True)
+        self.assertEqual(unpacked, {b"a": u"b", b"c": {b"d": [u"e"]}, 1: u"f", b"\xc2\x80" * 32: u"g"})
+        for k in unpacked:
+            self.assertTrue(isinstance(k, (bytes, int)))
+
+        unpacked = umsgpack.unpackb(data, raw_keys=True, object_pairs_hook=list)
+        self.assertEqual(unpacked[0], (b"a", u"b"))
+
+        unpacked = umsgpack.unpackb(data, raw_keys=False)
+        self.assertEqual(unpacked[u"c"], {u"d": [u"e"]})
+
+        # Streaming map items
+        items = list(umsgpack.iter_map_items(io.BytesIO(data), raw_keys=True))
+        self.assertEqual(items[:3], [(b"a", u"b"), (b"c", {b"d": [u"e"]}), (1, u"f")])
+
+        # Strings within array keys are decoded
+        self.assertEqual(umsgpack.unpackb(b"\x81\x92\xa1a\xa1b\x01", raw_keys=True), {(u"a", u"b"): 1})
+
+        # Invalid UTF-8 keys
+        self.assertEqual(umsgpack.unpackb(b"\x81\xa1\x80\x01", raw_keys=True), {b"\x80": 1})
+        with self.assertRaises(umsgpack.InvalidStringException):
+            umsgpack.unpackb(b"\x81\xa1\x80\x01")
+
     def test_ext_exceptions(self):
         # Test invalid Ext type type
         with self.assertRaises(TypeError):
@@ -553,6 +884,63 @@ class TestUmsgpack(unittest.TestCase):
         with self.assertRaises(ValueError):
             _ = umsgpack.Ext(128, b"data")
 
+    def test_ext_slots(self):
+        obj = umsgpack.unpackb(b"\xd5\x05\x01\x02")
+        self.assertEqual(obj, umsgpack.Ext(5, b"\x01\x02"))
+        self.assertFalse(hasattr(obj, "__dict__"))
+
+        self.assertEqual(pickle.loads(pickle.dumps(obj, 0)), obj)
+        self.assertEqual(pickle.loads(pickle.dumps(obj, 2)), obj)
+
+    def test_unpack_timestamp_format(self):
+        for (name, data, timestamp_tuple, nanoseconds) in timestamp_format_test_vectors:
+            print("\tTesting {:s}".format(name))
+
+            self.assertEqual(umsgpack.unpackb(data, timestamp_format="tuple"), timestamp_tuple)
+            self.assertEqual(umsgpack.unpackb(data, timestamp_format="nanoseconds"), nanoseconds)
+            self.assertEqual(umsgpack.unpackb(data, timestamp_format="datetime"),
+                             umsgpack._epoch + datetime.timedelta(seconds=timestamp_tuple[0],
+                                                                  microseconds=timestamp_tuple[1] // 1000))
+
+        with self.assertRaises(ValueError):
+            umsgpack.unpackb(timestamp_format_test_vectors[0][1], timestamp_format="foo")
+
+    def test_timestamp(self):
+        for (name, data, timestamp_tuple, nanoseconds) in timestamp_format_test_vectors:
+            print("\tTesting {:s}".format(name))
+
+            obj = umsgpack.Timestamp(*timestamp_tuple)
+            self.assertEqual(umsgpack.packb(obj), data)
+            self.assertEqual(umsgpack.packed_size(obj), len(data))
+            self.assertEqual(umsgpack.unpackb(data, timestamp_format="timestamp"), obj)
+
+            self.assertEqual(obj.to_nanoseconds(), nanoseconds)
+            self.assertEqual(umsgpack.Timestamp.from_nanoseconds(nanoseconds), obj)
+            self.assertEqual(obj.to_datetime(), umsgpack.unpackb(data))
+
+        # Conversion from naive and aware datetimes
+        for (name, obj, data, _) in naive_timestamp_test_vectors:
+            self.assertEqual(umsgpack.packb(umsgpack.Timestamp.from_datetime(obj)), data)
+            self.assertEqual(umsgpack.packb(umsgpack.Timestamp.from_datetime(obj.replace(tzinfo=None))), data)
+
+        # Equality, hashing, and pickling
+        obj = umsgpack.Timestamp(1, 2)
+        self.assertNotEqual(obj, umsgpack.Timestamp(1, 3))
+        self.assertEqual(len(set([obj, umsgpack.Timestamp(1, 2)])), 1)
+        self.assertEqual(pickle.loads(pickle.dumps(obj, 0)), obj)
+        self.assertEqual(pickle.loads(pickle.dumps(obj, 2)), obj)
+        self.assertFalse(hasattr(obj, "__dict__"))
+
+        with self.assertRaises(ValueError):
+            umsgpack.Timestamp(0, 10**9)
+
+        # Out of range nanoseconds
+        for data in [b"\xd7\xff\xff\xff\xff\xfc\x00\x00\x00\x00",
+                     b"\xc7\x0c\xff\x3b\x9a\xca\x00\x00\x00\x00\x00\x00\x00\x00\x00"]:
+            for timestamp_format in ["timestamp", "tuple", "nanoseconds"]:
+                with self.assertRaises(umsgpack.UnsupportedTimestampException):
+                    umsgpack.unpackb(data, timestamp_format=timestamp_format)
+
     def test_pack_ext_handler(self):
         for (name, obj, data) in ext_handlers_test_vectors:
             obj_repr = repr(obj)
@@ -580,6 +968,27 @@ class TestUmsgpack(unittest.TestCase):
             packed = umsgpack.packb(obj, force_float_precision=precision)
             self.assertEqual(packed, data)
 
+    def test_pack_float_auto_precision(self):
+        for (name, obj, data) in float_auto_precision_test_vectors:
+            obj_repr = repr(obj)
+            print("\tTesting {:s}: object {:s}".format(
+                  name, obj_repr if len(obj_repr) < 24 else obj_repr[0:24] + "..."))
+
+            packed = umsgpack.packb(obj, force_float_precision="auto")
+            self.assertEqual(packed, data)
+
+    def test_pack_integral_float_as_int(self):
+        for (name, obj, data) in integral_float_test_vectors:
+            obj_repr = repr(obj)
+            print("\tTesting {:s}: object {:s}".format(
+                  name, obj_repr if len(obj_repr) < 24 else obj_repr[0:24] + "..."))
+
+            packed = umsgpack.packb(obj, integral_float_as_int=True, force_float_precision="double")
+            self.assertEqual(packed, data)
+
+        self.assertEqual(umsgpack.packb([1.0, 1.5], integral_float_as_int=True, force_float_precision="auto"),
+                         b"\x92\x01\xca\x3f\xc0\x00\x00")
+
     def test_pack_naive_timestamp(self):
         for (name, obj, data, _) in naive_timestamp_test_vectors:
             obj_repr = repr(obj)
@@ -714,8 +1123,7 @@ class TestUmsgpack(unittest.TestCase):
 
         # Unregister Ext serializable classes to prevent interference with
         # subsequent tests
-        umsgpack._ext_classes_to_code = {}
-        umsgpack._ext_code_to_classes = {}
+        umsgpack._ext_registry = umsgpack.ExtRegistry()
 
     def test_ext_serializable_subclass(self):
         @umsgpack.ext_serializable(0x10)
@@ -748,8 +1156,93 @@ class TestUmsgpack(unittest.TestCase):
 
         # Unregister Ext serializable classes to prevent interference with
         # subsequent tests
-        umsgpack._ext_classes_to_code = {}
-        umsgpack._ext_code_to_classes = {}
+        umsgpack._ext_registry = umsgpack.ExtRegistry()
+
+    def test_ext_registry(self):
+        registry_a = umsgpack.ExtRegistry()
+        registry_b = umsgpack.ExtRegistry()
+
+        @registry_a.register(0x10)
+        class Point(object):
+            def __init__(self, x, y):
+                self.x = x
+                self.y = y
+
+            def __eq__(self, other):
+                return self.__class__ is other.__class__ and self.x == other.x and self.y == other.y
+
+            def packb(self):
+                return umsgpack.packb([self.x, self.y])
+
+            @classmethod
+            def unpackb(cls, data):
+                return cls(*umsgpack.unpackb(data))
+
+        class Point3(Point):
+            pass
+
+        class Name(object):
+            def __init__(self, name):
+                self.name = name
+
+            def packb(self):
+                return self.name.encode("latin-1")
+
+            @staticmethod
+            def unpackb(data):
+                return data.decode("latin-1")
+
+        # Same Ext type code in another registry does not collide
+        registry_b.register(0x10, Name)
+
+        packed = umsgpack.packb(Point(1, 2), ext_registry=registry_a)
+        self.assertEqual(packed, b"\xc7\x03\x10\x92\x01\x02")
+        self.assertEqual(umsgpack.unpackb(packed, ext_registry=registry_a), Point(1, 2))
+        self.assertEqual(umsgpack.unpackb(packed, ext_registry=registry_b), b"\x92\x01\x02".decode("latin-1"))
+        self.assertEqual(umsgpack.unpackb(packed), umsgpack.Ext(0x10, b"\x92\x01\x02"))
+
+        # Not registered in default registry or other registry
+        with self.assertRaises(umsgpack.UnsupportedTypeException):
+            umsgpack.packb(Point(1, 2))
+        with self.assertRaises(umsgpack.UnsupportedTypeException):
+            umsgpack.packb(Point(1, 2), ext_registry=registry_b)
+
+        # Subclass packs as registered class, and resolution is cached
+        self.assertEqual(umsgpack.packb(Point3(1, 2), ext_registry=registry_a), packed)
+        self.assertEqual(umsgpack.packed_size(Point3(1, 2), ext_registry=registry_a), len(packed))
+        self.assertIs(registry_a._resolved[Point3], Point)
+        self.assertIsNone(umsgpack.ExtRegistry()._resolve(Point3))
+
+        # Registration invalidates resolution cache
+        registry_a.register(0x11, Point3)
+        self.assertNotIn(Point3, registry_a._resolved)
+        self.assertEqual(umsgpack.packb(Point3(1, 2), ext_registry=registry_a), b"\xc7\x03\x11\x92\x01\x02")
+
+        # Packer and Unpacker
+        f = io.BytesIO()
+        umsgpack.Packer(f, ext_registry=registry_a).pack(Point(3, 4))
+        f.seek(0)
+        self.assertEqual(umsgpack.Unpacker(f, ext_registry=registry_a).unpack(), Point(3, 4))
+
+        # Invalid registrations
+        with self.assertRaises(ValueError):
+            registry_a.register(0x10, Name)
+        with self.assertRaises(ValueError):
+            registry_a.register(0x12, Point)
+        with self.assertRaises(ValueError):
+            registry_a.register(0x80, Name)
+        with self.assertRaises(TypeError):
+            registry_a.register("0x12", Name)
+
+        # Missing packb() and unpackb()
+        class Empty(object):
+            pass
+
+        registry_b.register(0x20, Empty)
+        with self.assertRaises(NotImplementedError):
+            umsgpack.packb(Empty(), ext_registry=registry_b)
+        with self.assertRaises(NotImplementedError):
+            umsgpack.unpackb(b"\xd4\x20\x00", ext_registry=registry_b)
 
     def test_streaming_writer(self):
         # Try first composite test vector
@@ -764,12 +1257,495 @@ class TestUmsgpack(unittest.TestCase):
         reader = io.BytesIO(data)
         self.assertEqual(umsgpack.unpack(reader), obj)
 
+    def test_pack_canonical(self):
+        # Equal maps with different insertion orders
+        a = {u"b": 1, u"a": [1.5, {2: u"x", 1: u"y"}], 3: None, (1, 2): 0.1}
+        b = dict(reversed(list(a.items())))
+        b[u"a"] = [1.5, {1: u"y", 2: u"x"}]
+        self.assertEqual(umsgpack.packb(a, canonical=True), umsgpack.packb(b, canonical=True))
+
+        # Keys sorted by serialized bytes
+        self.assertEqual(umsgpack.packb(OrderedDict([(u"b", 1), (u"a", 2), (3, 3), (-1, 4)]), canonical=True),
+                         b"\x84\x03\x03\xa1a\x02\xa1b\x01\xff\x04")
+
+        # Floats narrowed when lossless
+        self.assertEqual(umsgpack.packb(1.5, canonical=True), b"\xca\x3f\xc0\x00\x00")
+        self.assertEqual(umsgpack.packb(0.1, canonical=True), b"\xcb\x3f\xb9\x99\x99\x99\x99\x99\x9a")
+        self.assertEqual(umsgpack.packb(1e300, canonical=True), b"\xcb" + struct.pack(">d", 1e300))
+        self.assertEqual(umsgpack.packb(float("inf"), canonical=True), b"\xca\x7f\x80\x00\x00")
+        self.assertEqual(umsgpack.packb(-0.0, canonical=True), b"\xca\x80\x00\x00\x00")
+        self.assertEqual(umsgpack.packb(float("nan"), canonical=True), b"\xca\x7f\xc0\x00\x00")
+        for nan in [b"\xff\xf8\x00\x00\x00\x00\x00\x00", b"\x7f\xf8\x00\x00\x00\x00\x00\x01"]:
+            self.assertEqual(umsgpack.packb(struct.unpack(">d", nan)[0], canonical=True), b"\xca\x7f\xc0\x00\x00")
+            self.assertEqual(umsgpack.packed_size(struct.unpack(">d", nan)[0], canonical=True), 5)
+        self.assertEqual(umsgpack.packb(1.5, canonical=True, force_float_precision="double"),
+                         umsgpack.packb(1.5, force_float_precision="double"))
+
+        # Iterative packing
+        obj = {u"z": {u"y": [{u"x": 1, u"w": 2}]}, u"a": 1}
+        self.assertEqual(umsgpack.packb(obj, canonical=True, iterative=True), umsgpack.packb(obj, canonical=True))
+
+        # Round trip
+        self.assertEqual(umsgpack.unpackb(umsgpack.packb(a, canonical=True)), a)
+
+    def test_string_cache(self):
+        cache = umsgpack.StringCache(maxsize=3, max_length=8, strings=[u"ts", u"long string key"])
+        self.assertEqual(len(cache), 1)
+
+        records = [{u"ts": i, u"host": u"h", u"long string key": i} for i in range(10)]
+        for record in records:
+            self.assertEqual(umsgpack.packb(record, string_cache=cache), umsgpack.packb(record))
+
+        # u"ts" precomputed, u"host" and u"h" cached, long key not cacheable
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.hits, 28)
+        self.assertEqual(cache.hit_rate, 28.0 / 30)
+
+        # Full cache packs other strings without caching
+        self.assertEqual(umsgpack.packb(u"other", string_cache=cache), umsgpack.packb(u"other"))
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.misses, 3)
+
+        # Packer option
+        f = io.BytesIO()
+        umsgpack.Packer(f, string_cache=cache).pack([u"ts", u"ts"])
+        self.assertEqual(f.getvalue(), b"\x92\xa2ts\xa2ts")
+        self.assertEqual(cache.hits, 30)
+
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits, cache.misses, cache.hit_rate), (0, 0, 0, 0.0))
+
+    def test_segment_writer(self):
+        blob, text = b"\x80" * 2**15, u"c" * 2**15
+        obj = [{u"id": i, u"blob": blob} for i in range(3)] + [text, umsgpack.Ext(0x05, blob), b"small"]
+        data = umsgpack.packb(obj)
+
+        writer = umsgpack.SegmentWriter()
+        umsgpack.pack(obj, writer)
+        self.assertEqual(len(writer), len(data))
+        self.assertEqual(writer.getvalue(), data)
+
+        # Large payloads kept by reference, headers and small objects coalesced
+        segments = writer.getsegments()
+        self.assertEqual(len(segments), 11)
+        self.assertEqual(sum(1 for s in segments if s is blob), 4)
+        self.assertEqual(segments[-1], bytearray(b"\xc4\x05small"))
+
+        # Everything coalesced below threshold
+        writer = umsgpack.SegmentWriter(threshold=2**16)
+        umsgpack.Packer(writer).pack(obj)
+        self.assertEqual(len(writer.getsegments()), 1)
+        self.assertEqual(writer.getvalue(), data)
+
+        # Write to file-like object
+        writer = umsgpack.SegmentWriter()
+        umsgpack.pack(obj, writer)
+        f = io.BytesIO()
+        writer.writeto(f)
+        self.assertEqual(f.getvalue(), data)
+
+        # Write to file descriptor
+        fd, path = tempfile.mkstemp()
+        try:
+            writer.writeto(fd)
+            os.close(fd)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+        finally:
+            os.remove(path)
+
+        # Partial scatter-gather writes are resumed
+        class PartialSocket(object):
+            def __init__(self):
+                self.data = b""
+
+            def sendmsg(self, segments):
+                data = b"".join(s.tobytes() for s in segments)[:1000]
+                self.data += data
+                return len(data)
+
+        sock = PartialSocket()
+        writer.writeto(sock)
+        self.assertEqual(sock.data, data)
+
+        # Scatter-gather write without progress
+        class FullSocket(object):
+            def sendmsg(self, segments):
+                return 0
+
+        with self.assertRaises(IOError):
+            writer.writeto(FullSocket())
+
+        # Write to socket
+        a, b = socket.socketpair()
+        try:
+            writer = umsgpack.SegmentWriter()
+            umsgpack.pack(obj[3:], writer)
+            writer.writeto(a)
+            a.close()
+            received = b""
+            while len(received) < len(writer):
+                received += b.recv(2**16)
+            self.assertEqual(umsgpack.unpackb(received), obj[3:])
+        finally:
+            b.close()
+
+    def test_streaming_packer(self):
+        # Use complex array and map composite test vectors
+        (_, obj_array, data_array) = composite_test_vectors[10]
+        (_, obj_map, data_map) = composite_test_vectors[11]
+
+        # Incremental array and map
+        writer = io.BytesIO()
+        packer = umsgpack.Packer(writer)
+        packer.begin_array(len(obj_array))
+        for e in obj_array:
+            packer.pack(e)
+        packer.begin_map(len(obj_map))
+        for k, v in obj_map.items():
+            packer.pack(k)
+            packer.pack(v)
+        self.assertEqual(writer.getvalue(), data_array + data_map)
+
+        # Array and map from iterables
+        writer = io.BytesIO()
+        packer = umsgpack.Packer(writer)
+        packer.pack_array_from(iter(obj_array), len(obj_array))
+        packer.pack_map_from(iter(obj_map.items()), len(obj_map))
+        self.assertEqual(writer.getvalue(), data_array + data_map)
+
+        # Iterable length mismatch
+        with self.assertRaises(ValueError):
+            umsgpack.Packer(io.BytesIO()).pack_array_from(iter(range(3)), 2)
+        with self.assertRaises(ValueError):
+            umsgpack.Packer(io.BytesIO()).pack_array_from(iter(range(3)), 4)
+        with self.assertRaises(ValueError):
+            umsgpack.Packer(io.BytesIO()).pack_map_from(iter([(1, 2)]), 2)
+
+    def test_streaming_unpacker(self):
+        # Use complex array and map composite test vectors
+        (_, obj_array, data_array) = composite_test_vectors[10]
+        (_, obj_map, data_map) = composite_test_vectors[11]
+
+        unpacker = umsgpack.Unpacker(io.BytesIO(data_array + data_map))
+        length = unpacker.read_array_header()
+        self.assertEqual(length, len(obj_array))
+        self.assertEqual([unpacker.unpack() for _ in range(length)], obj_array)
+        length = unpacker.read_map_header()
+        self.assertEqual(length, len(obj_map))
+        self.assertEqual([(unpacker.unpack(), unpacker.unpack()) for _ in range(length)],
+                         list(obj_map.items()))
+
+        # Large array header
+        unpacker = umsgpack.Unpacker(io.BytesIO(composite_test_vectors[3][2]))
+        self.assertEqual(unpacker.read_array_header(), 65536)
+
+        # Unexpected type
+        with self.assertRaises(umsgpack.UnexpectedTypeException):
+            umsgpack.Unpacker(io.BytesIO(data_map)).read_array_header()
+        with self.assertRaises(umsgpack.UnexpectedTypeException):
+            umsgpack.Unpacker(io.BytesIO(data_array)).read_map_header()
+
+        # Insufficient data
+        with self.assertRaises(umsgpack.InsufficientDataException):
+            umsgpack.Unpacker(io.BytesIO(b"\xdc\x00")).read_array_header()
+
+    def test_iter_array(self):
+        for (name, obj, data) in composite_test_vectors:
+            if not isinstance(obj, list):
+                continue
+            print("\tTesting {:s}".format(name))
+
+            reader = io.BytesIO(data)
+            iterator = umsgpack.iter_array(reader)
+            # Nothing is read until the first element is requested
+            self.assertEqual(reader.tell(), 0)
+            self.assertEqual(list(iterator), obj)
+            self.assertEqual(reader.tell(), len(data))
+
+        # Use tuple test vector with unpacking options
+        (_, obj, data, obj_tuple) = tuple_test_vectors[0]
+        self.assertEqual(list(umsgpack.iter_array(io.BytesIO(data), use_tuple=True)), list(obj_tuple))
+
+        with self.assertRaises(umsgpack.UnexpectedTypeException):
+            next(umsgpack.iter_array(io.BytesIO(b"\x80")))
+        with self.assertRaises(umsgpack.InsufficientDataException):
+            list(umsgpack.iter_array(io.BytesIO(b"\x92\xc2")))
+
+    def test_iter_map_items(self):
+        for (name, obj, data) in composite_test_vectors:
+            if not isinstance(obj, dict):
+                continue
+            print("\tTesting {:s}".format(name))
+
+            items = list(umsgpack.iter_map_items(io.BytesIO(data)))
+            self.assertEqual(items, list(obj.items()))
+
+        with self.assertRaises(umsgpack.UnexpectedTypeException):
+            next(umsgpack.iter_map_items(io.BytesIO(b"\x90")))
+        with self.assertRaises(umsgpack.InsufficientDataException):
+            list(umsgpack.iter_map_items(io.BytesIO(b"\x82\xc2\xc3")))
+
+    def test_framed(self):
+        records = [obj for (_, obj, _) in composite_test_vectors]
+
+        writer = io.BytesIO()
+        with umsgpack.framed.FramedWriter(writer) as framed_writer:
+            for obj in records:
+                framed_writer.pack(obj)
+        with self.assertRaises(ValueError):
+            framed_writer.pack(None)
+
+        reader = umsgpack.framed.FramedReader(io.BytesIO(writer.getvalue()))
+        self.assertEqual(len(reader), len(records))
+        self.assertEqual(list(reader), records)
+
+        # Random access
+        for i in reversed(range(len(records))):
+            self.assertEqual(reader[i], records[i])
+            self.assertEqual(reader.read_packed(i), composite_test_vectors[i][2])
+        self.assertEqual(reader[-1], records[-1])
+        self.assertEqual(list(reader.iter_records(3, 5)), records[3:5])
+
+        # Split
+        for n in [1, 2, 3, len(records), len(records) + 5]:
+            ranges = reader.split(n)
+            self.assertTrue(len(ranges) <= n)
+            self.assertEqual([i for (start, stop) in ranges for i in range(start, stop)],
+                             list(range(len(records))))
+
+        # Missing index with truncated last record
+        data = writer.getvalue()
+        data = data[:reader.offsets[-1] + 7]
+        reader = umsgpack.framed.FramedReader(io.BytesIO(data))
+        self.assertEqual(list(reader), records[:-1])
+
+        # Invalid header
+        with self.assertRaises(umsgpack.framed.InvalidFrameException):
+            umsgpack.framed.FramedReader(io.BytesIO(b"\x00" * 32))
+
+    def test_framed_scan(self):
+        vectors = [data for (_, _, data) in single_test_vectors + composite_test_vectors]
+        stream = b"".join(vectors)
+        boundaries = list(umsgpack.framed.scan_records(stream))
+        self.assertEqual([stream[start:end] for (start, end) in boundaries], vectors)
+
+        # Frame a stream of concatenated objects
+        writer = io.BytesIO()
+        self.assertEqual(umsgpack.framed.frame_stream(io.BytesIO(stream), writer), len(vectors))
+        reader = umsgpack.framed.FramedReader(io.BytesIO(writer.getvalue()))
+        self.assertEqual([reader.read_packed(i) for i in range(len(reader))], vectors)
+
+        for (name, data, exception) in unpack_exception_test_vectors:
+            if exception not in (umsgpack.InsufficientDataException, umsgpack.ReservedCodeException):
+                continue
+            print("\tTesting {:s}".format(name))
+
+            with self.assertRaises(exception):
+                list(umsgpack.framed.scan_records(data))
+
+    def test_compressed(self):
+        records = [{u"id": i, u"data": [i, u"x" * (i % 40), None]} for i in range(2000)]
+
+        for compression in sorted(umsgpack.compressed._codecs):
+            print("\tTesting {:s}".format(compression))
+
+            f = io.BytesIO()
+            with umsgpack.compressed.CompressedWriter(f, compression=compression, block_size=4096) as writer:
+                for record in records:
+                    writer.pack(record)
+            self.assertTrue(writer.closed)
+            self.assertTrue(len(f.getvalue()) < sum(len(umsgpack.packb(r)) for r in records))
+
+            f.seek(0)
+            reader = umsgpack.compressed.CompressedReader(f)
+            self.assertTrue(reader.block_count > 1)
+            self.assertEqual(list(reader), records)
+
+            # Random access by block
+            reader.seek_block(reader.block_count - 1)
+            last_block = list(reader)
+            self.assertEqual(last_block, records[-len(last_block):])
+
+            # File-like reading with Unpacker
+            reader.seek_block(0)
+            unpacker = umsgpack.Unpacker(reader)
+            self.assertEqual([unpacker.unpack() for _ in range(len(records))], records)
+            self.assertEqual(reader.read(1), b"")
+
+        # Incremental array across explicit flushes, and unpacking options
+        f = io.BytesIO()
+        with umsgpack.compressed.CompressedWriter(f) as writer:
+            packer = umsgpack.Packer(writer)
+            packer.begin_array(3)
+            packer.pack(1)
+            writer.flush()
+            packer.pack([2])
+            writer.flush()
+            packer.pack(3)
+
+        f.seek(0)
+        reader = umsgpack.compressed.CompressedReader(f, use_tuple=True)
+        self.assertEqual(reader.block_count, 3)
+        self.assertEqual(reader.unpack(), (1, (2,), 3))
+
+        # Unsupported compression
+        with self.assertRaises(ValueError):
+            umsgpack.compressed.CompressedWriter(io.BytesIO(), compression="foo")
+
+        # Corrupt block
+        f = io.BytesIO()
+        writer = umsgpack.compressed.CompressedWriter(f)
+        writer.pack(u"abc")
+        writer.flush()
+        writer._framed.write_packed(umsgpack.packb([u"zlib", 3, b"corrupt"]))
+        writer.close()
+
+        f.seek(0)
+        reader = umsgpack.compressed.CompressedReader(f)
+        self.assertEqual(reader.unpack(), u"abc")
+        with self.assertRaises(umsgpack.framed.InvalidFrameException):
+            reader.unpack()
+
+        # Container format independent of module-wide compatibility mode
+        umsgpack.compatibility = True
+        try:
+            f = io.BytesIO()
+            with umsgpack.compressed.CompressedWriter(f) as writer:
+                writer.pack(b"abc")
+            f.seek(0)
+            self.assertEqual(list(umsgpack.compressed.CompressedReader(f)), [b"abc"])
+        finally:
+            umsgpack.compatibility = False
+
+    @unittest.skipIf(sys.version_info[0] < 3, "requires Python 3")
+    def test_parallel_unpack_file(self):
+        import umsgpack.parallel
+
+        records = [{u"id": i, u"data": [i, u"x" * (i % 40), None]} for i in range(2000)]
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "records.msgpack")
+            with open(path, "wb") as f:
+                for record in records:
+                    umsgpack.pack(record, f)
+
+            framed_path = os.path.join(directory, "records.umpf")
+            with open(framed_path, "wb") as f:
+                with umsgpack.framed.FramedWriter(f) as writer:
+                    for record in records:
+                        writer.pack(record)
+
+            for p in [path, framed_path]:
+                unpacked = list(umsgpack.parallel.unpack_file(p, workers=2, shard_size=1024))
+                self.assertEqual(unpacked, records)
+
+                unpacked = list(umsgpack.parallel.unpack_file(p, workers=2, ordered=False, shard_size=1024))
+                self.assertEqual(sorted(unpacked, key=lambda r: r[u"id"]), records)
+
+            # Unpacking options
+            unpacked = list(umsgpack.parallel.unpack_file(path, workers=2, use_tuple=True))
+            self.assertEqual(unpacked[1][u"data"], (1, u"x", None))
+
+            # Plain stream beginning with the bytes of the container header
+            header_path = os.path.join(directory, "header.msgpack")
+            header_records = [85, 77, 80, 70, 1, u"abc", [1, 2], {u"a": 1}]
+            with open(header_path, "wb") as f:
+                for record in header_records:
+                    umsgpack.pack(record, f)
+            self.assertEqual(list(umsgpack.parallel.unpack_file(header_path, workers=2)), header_records)
+
+            # Empty file
+            empty_path = os.path.join(directory, "empty.msgpack")
+            open(empty_path, "wb").close()
+            self.assertEqual(list(umsgpack.parallel.unpack_file(empty_path)), [])
+
+            # Truncated file
+            with open(path, "ab") as f:
+                f.write(b"\x92\x01")
+            with self.assertRaises(umsgpack.InsufficientDataException):
+                list(umsgpack.parallel.unpack_file(path, workers=2))
+        finally:
+            shutil.rmtree(directory)
+
+    @unittest.skipIf(sys.version_info[0] < 3, "requires Python 3")
+    def test_parallel_packb(self):
+        import umsgpack.parallel
+
+        objs = [
+            [{u"id": i, u"data": [i, u"x" * (i % 40), None]} for i in range(2000)],
+            tuple(range(-1000, 1000)),
+            dict((u"key {:d}".format(i), [i, float(i)]) for i in range(2000)),
+            list(range(70000)),
+            [],
+            {},
+            5,
+        ]
+
+        for obj in objs:
+            packed = umsgpack.packb(obj)
+            self.assertEqual(umsgpack.parallel.packb_parallel(obj, workers=3), packed)
+            self.assertEqual(umsgpack.parallel.packb_parallel(obj, workers=2, chunk_size=7), packed)
+
+        self.assertEqual(umsgpack.parallel.packb_parallel(objs[0], workers=2, use_processes=True),
+                         umsgpack.packb(objs[0]))
+
+        # Packing options
+        obj = [1.5] * 100
+        self.assertEqual(umsgpack.parallel.packb_parallel(obj, workers=2, force_float_precision="single"),
+                         umsgpack.packb(obj, force_float_precision="single"))
+
+        # Unsupported type
+        with self.assertRaises(umsgpack.UnsupportedTypeException):
+            umsgpack.parallel.packb_parallel([1, 2, object()], workers=2)
+
+    @unittest.skipIf(sys.version_info[0] < 3, "requires Python 3")
+    def test_profiling(self):
+        import tracemalloc
+        import umsgpack.profiling
+
+        obj = [{u"name": u"x" * (i % 40), u"value": i * 0.5, u"data": b"\x80" * i} for i in range(100)]
+        data = umsgpack.packb(obj)
+
+        # Pack profile, with writes counted by type
+        p = umsgpack.profiling.profile_pack(obj)
+        self.assertEqual(p.result, data)
+        self.assertEqual(sum(n for (_, n) in p.io.values()), len(data))
+        self.assertEqual(p.io[u"float"], [100, 900])
+        self.assertTrue(p.peak >= p.retained > 0)
+
+        # Unpack profile, with reads and retained allocations counted by type
+        p = umsgpack.profiling.profile_unpack(data)
+        self.assertEqual(p.result, obj)
+        self.assertEqual(sum(n for (_, n) in p.io.values()), len(data))
+        self.assertEqual(p.io[u"type code"][0], 1 + 100 + 600)
+        self.assertTrue(p.allocations[u"string"][1] > 0)
+        self.assertTrue(p.allocations[u"binary"][1] >= sum(range(100)))
+        self.assertIn(u"binary", p.report())
+
+        # Generic profile
+        p = umsgpack.profiling.profile(umsgpack.unpackb, data, use_tuple=True)
+        self.assertEqual(p.name, umsgpack.unpackb.__name__)
+        self.assertEqual(p.result, tuple(obj))
+        self.assertEqual(p.io, {})
+        self.assertTrue(p.allocations[u"map"][0] >= 100)
+
+        # Already tracing
+        tracemalloc.start()
+        try:
+            with self.assertRaises(RuntimeError):
+                umsgpack.profiling.profile(umsgpack.packb, obj)
+        finally:
+            tracemalloc.stop()
+
     def test_namespacing(self):
         # Get a list of global variables from umsgpack module
         exported_vars = list([x for x in dir(umsgpack) if not x.startswith("_")])
         # Ignore imports
-        exported_vars = list([x for x in exported_vars if x != "struct" and x != "collections" and x != "datetime" and x !=
-                                    "sys" and x != "io" and x != "xrange" and x != "Hashable"])
+        exported_vars = list([x for x in exported_vars if x != "struct" and x != "math" and x !=
+                                    "sys" and x != "io" and x != "itertools" and x != "xrange" and x != "framed" and x != "compressed" and x != "parallel" and x != "profiling"])
 
         self.assertTrue(len(exported_vars) == len(exported_vars_test_vector))
         for var in exported_vars_test_vector:
@@ -799,6 +1775,61 @@ class TestUmsgpack(unittest.TestCase):
 
         self.assertEqual(unpacked, obj)
 
+    def test_load_large_length(self):
+        # Large declared lengths are read in bounded chunks, so that a corrupt
+        # or malicious length does not request, and allocate, more than is
+        # available. Simulate this with a file-like object that records the
+        # requested sizes.
+
+        class RecordingFile(object):
+            def __init__(self, data):
+                self._data = io.BytesIO(data)
+                self.sizes = []
+
+            def read(self, n=-1):
+                self.sizes.append(n)
+                return self._data.read(n)
+
+        for header in [b"\xdb\xff\xff\xff\xff", b"\xc6\xff\xff\xff\xff", b"\xc9\xff\xff\xff\xff\x05"]:
+            f = RecordingFile(header + b"\x00" * 1000)
+            with self.assertRaises(umsgpack.InsufficientDataException):
+                umsgpack.load(f)
+            self.assertTrue(max(f.sizes) <= umsgpack._read_chunk_size)
+
+        # Data larger than the chunk size
+        obj = b"\x80" * (umsgpack._read_chunk_size * 2 + 1)
+        f = RecordingFile(umsgpack.dumps(obj))
+        self.assertEqual(umsgpack.load(f), obj)
+        self.assertTrue(max(f.sizes) <= umsgpack._read_chunk_size)
+
+        # Streams of known length are read in a single read
+        class RecordingBytesIO(io.BytesIO):
+            def __init__(self, data):
+                io.BytesIO.__init__(self, data)
+                self.sizes = []
+
+            def read(self, n=-1):
+                self.sizes.append(n)
+                return io.BytesIO.read(self, n)
+
+        f = RecordingBytesIO(umsgpack.dumps(obj))
+        self.assertEqual(umsgpack.load(f), obj)
+        self.assertEqual(max(f.sizes), len(obj))
+
+        f = RecordingBytesIO(b"\xc6\xff\xff\xff\xff" + b"\x00" * 1000)
+        with self.assertRaises(umsgpack.InsufficientDataException):
+            umsgpack.load(f)
+        self.assertEqual(f.sizes, [1, 4])
+
+        with tempfile.TemporaryFile() as f:
+            umsgpack.dump([obj, obj], f)
+            f.seek(0)
+            self.assertEqual(umsgpack.load(f), [obj, obj])
+            f.seek(0)
+            f.truncate(len(obj))
+            with self.assertRaises(umsgpack.InsufficientDataException):
+                umsgpack.load(f)
+
 
 if __name__ == '__main__':
     unittest.main()
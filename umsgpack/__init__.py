@@ -44,16 +44,11 @@ types.
 License: MIT
 """
 import struct
-import collections
-import datetime
+import itertools
+import math
 import sys
 import io
 
-if sys.version_info[0:2] >= (3, 3):
-    from collections.abc import Hashable
-else:
-    from collections import Hashable
-
 __version__ = "2.8.0"
 "Module version string"
 
@@ -72,6 +67,8 @@ class Ext(object):
     an application-defined type and data byte array.
     """
 
+    __slots__ = ("type", "data")
+
     def __init__(self, type, data):
         """
         Construct a new Ext object.
@@ -101,15 +98,21 @@ class Ext(object):
             raise TypeError("ext type is not type integer")
         elif not (-2**7 <= type <= 2**7 - 1):
             raise ValueError("ext type value {:d} is out of range (-128 to 127)".format(type))
-        # Check data is type bytes or str
-        elif sys.version_info[0] == 3 and not isinstance(data, bytes):
-            raise TypeError("ext data is not type \'bytes\'")
-        elif sys.version_info[0] == 2 and not isinstance(data, str):
-            raise TypeError("ext data is not type \'str\'")
+        # Check data is type bytes (Python 3) or str (Python 2)
+        elif not isinstance(data, bytes):
+            raise TypeError("ext data is not type \'{:s}\'".format(bytes.__name__))
 
         self.type = type
         self.data = data
 
+    @classmethod
+    def _from_unpacked(cls, type, data):
+        # Construct without validation, for type and data from the decoder
+        obj = object.__new__(cls)
+        obj.type = type
+        obj.data = data
+        return obj
+
     def __eq__(self, other):
         """
         Compare this Ext object with another for equality.
@@ -141,26 +144,245 @@ class Ext(object):
         """
         return hash((self.type, self.data))
 
+    def __reduce__(self):
+        return (self.__class__, (self.type, self.data))
+
 
 class InvalidString(bytes):
     """Subclass of bytes to hold invalid UTF-8 strings."""
 
 
+##############################################################################
+# Timestamp Class
+##############################################################################
+
+
+class Timestamp(object):
+    """
+    The Timestamp class holds a MessagePack timestamp with nanosecond
+    resolution, as seconds and nanoseconds since the Unix epoch. It packs into,
+    and unpacks from with the "timestamp" `timestamp_format`, the MessagePack
+    timestamp format without loss of precision.
+    """
+
+    __slots__ = ("seconds", "nanoseconds")
+
+    def __init__(self, seconds, nanoseconds=0):
+        """
+        Construct a new Timestamp object.
+
+        Args:
+            seconds (int): seconds since the Unix epoch
+            nanoseconds (int): nanoseconds, 0 to 999999999 (default 0)
+
+        Raises:
+            ValueError:
+                Nanoseconds is out of range of 0 to 999999999.
+
+        Example:
+            >>> umsgpack.packb(umsgpack.Timestamp(1684404302, 123456789))
+            b'\\xd7\\xff\\x1do4Tde\\xf8N'
+            >>> umsgpack.unpackb(_, timestamp_format="timestamp")
+            Timestamp(seconds=1684404302, nanoseconds=123456789)
+        """
+        if not 0 <= nanoseconds <= 999999999:
+            raise ValueError("timestamp nanoseconds {:d} is out of range (0 to 999999999)".format(nanoseconds))
+
+        self.seconds = seconds
+        self.nanoseconds = nanoseconds
+
+    @classmethod
+    def from_datetime(cls, dt):
+        """
+        Construct a Timestamp from a datetime. Naive datetimes are assumed to
+        be in the UTC timezone.
+
+        Args:
+            dt (datetime.datetime): datetime
+
+        Returns:
+            Timestamp
+        """
+        seconds, microseconds = _datetime_to_timestamp(dt)
+        return cls(seconds, microseconds * 1000)
+
+    @classmethod
+    def from_nanoseconds(cls, nanoseconds):
+        """
+        Construct a Timestamp from integer nanoseconds since the Unix epoch.
+
+        Args:
+            nanoseconds (int): nanoseconds since the Unix epoch
+
+        Returns:
+            Timestamp
+        """
+        seconds, nanoseconds = divmod(nanoseconds, 1000000000)
+        return cls(seconds, nanoseconds)
+
+    def to_datetime(self):
+        """
+        Convert this Timestamp to an aware datetime in the UTC timezone,
+        truncated to microsecond resolution.
+
+        Returns:
+            datetime.datetime
+        """
+        return _timestamp_to_datetime(self.seconds, self.nanoseconds // 1000)
+
+    def to_nanoseconds(self):
+        """
+        Convert this Timestamp to integer nanoseconds since the Unix epoch.
+
+        Returns:
+            int
+        """
+        return self.seconds * 1000000000 + self.nanoseconds
+
+    def __eq__(self, other):
+        """
+        Compare this Timestamp object with another for equality.
+        """
+        return isinstance(other, self.__class__) \
+            and self.seconds == other.seconds and self.nanoseconds == other.nanoseconds
+
+    def __ne__(self, other):
+        """
+        Compare this Timestamp object with another for inequality.
+        """
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        """
+        Provide a hash of this Timestamp object.
+        """
+        return hash((self.seconds, self.nanoseconds))
+
+    def __repr__(self):
+        """
+        String representation of this Timestamp object.
+        """
+        return "Timestamp(seconds={:d}, nanoseconds={:d})".format(self.seconds, self.nanoseconds)
+
+    def __reduce__(self):
+        return (self.__class__, (self.seconds, self.nanoseconds))
+
+
 ##############################################################################
 # Ext Serializable Decorator
 ##############################################################################
 
-_ext_class_to_type = {}
-_ext_type_to_class = {}
+class ExtRegistry(object):
+    """
+    The ExtRegistry class holds a set of classes registered for automatic
+    packing and unpacking with Ext type codes. A registry is passed to the
+    packing and unpacking functions, or to a Packer or Unpacker, with the
+    `ext_registry` option, so that independent libraries can register Ext
+    types without colliding. Classes registered with :func:`ext_serializable`
+    are held in the default registry.
+
+    The application class should implement a `packb()` method that returns
+    serialized bytes, and an `unpackb()` class method or static method that
+    accepts serialized bytes and returns an instance of the application class.
+    """
+
+    def __init__(self):
+        """
+        Construct a new, empty ExtRegistry object.
+
+        Example:
+            >>> registry = umsgpack.ExtRegistry()
+            >>> @registry.register(0x10)
+            ... class Point(object):
+            ...     ...
+            ...
+            >>> umsgpack.packb(Point(1, 2), ext_registry=registry)
+        """
+        self._class_to_type = {}
+        self._type_to_class = {}
+        # Ext type to unpacking function, built at registration
+        self._type_to_unpackb = {}
+        # Class to registered class resolution cache, for subclasses
+        self._resolved = {}
+
+    def register(self, ext_type, cls=None):
+        """
+        Register a class with the specified Ext type code, or return a
+        decorator to register a class if no class is specified.
+
+        Args:
+            ext_type (int): application-defined Ext type code
+            cls (type): application class
+
+        Returns:
+            type: the registered class, or a decorator
+
+        Raises:
+            TypeError:
+                Ext type is not an integer.
+            ValueError:
+                Ext type is out of range of -128 to 127.
+            ValueError:
+                Ext type or class already registered.
+        """
+        def wrapper(cls):
+            if not isinstance(ext_type, int):
+                raise TypeError("Ext type is not type integer")
+            elif not (-2**7 <= ext_type <= 2**7 - 1):
+                raise ValueError("Ext type value {:d} is out of range of -128 to 127".format(ext_type))
+            elif ext_type in self._type_to_class:
+                raise ValueError("Ext type {:d} already registered with class {:s}".format(ext_type, repr(self._type_to_class[ext_type])))
+            elif cls in self._class_to_type:
+                raise ValueError("Class {:s} already registered with Ext type {:d}".format(repr(cls), ext_type))
+
+            self._type_to_class[ext_type] = cls
+            self._class_to_type[cls] = ext_type
+            self._type_to_unpackb[ext_type] = _ext_unpackb_function(cls)
+            self._resolved.clear()
+
+            return cls
+
+        return wrapper if cls is None else wrapper(cls)
+
+    def _resolve(self, cls):
+        # Registered class that cls is a subclass of, or None
+        try:
+            return self._resolved[cls]
+        except KeyError:
+            pass
+
+        t = next((t for t in self._class_to_type if issubclass(cls, t)), None)
+        self._resolved[cls] = t
+        return t
+
+    def _pack(self, obj, cls):
+        # Ext of obj, packed as registered class cls
+        try:
+            return Ext(self._class_to_type[cls], obj.packb())
+        except AttributeError:
+            raise NotImplementedError("Ext serializable class {:s} is missing implementation of packb()".format(repr(cls)))
+
+
+def _ext_unpackb_function(cls):
+    try:
+        return cls.unpackb
+    except AttributeError:
+        def unpackb(data):
+            raise NotImplementedError("Ext serializable class {:s} is missing implementation of unpackb()".format(repr(cls)))
+        return unpackb
+
+
+# Default registry of ext_serializable() classes
+_ext_registry = ExtRegistry()
 
 
 def ext_serializable(ext_type):
     """
     Return a decorator to register a class for automatic packing and unpacking
-    with the specified Ext type code. The application class should implement a
-    `packb()` method that returns serialized bytes, and an `unpackb()` class
-    method or static method that accepts serialized bytes and returns an
-    instance of the application class.
+    with the specified Ext type code, in the default :class:`ExtRegistry`. The
+    application class should implement a `packb()` method that returns
+    serialized bytes, and an `unpackb()` class method or static method that
+    accepts serialized bytes and returns an instance of the application class.
 
     Args:
         ext_type (int): application-defined Ext type code
@@ -173,22 +395,7 @@ def ext_serializable(ext_type):
         ValueError:
             Ext type or class already registered.
     """
-    def wrapper(cls):
-        if not isinstance(ext_type, int):
-            raise TypeError("Ext type is not type integer")
-        elif not (-2**7 <= ext_type <= 2**7 - 1):
-            raise ValueError("Ext type value {:d} is out of range of -128 to 127".format(ext_type))
-        elif ext_type in _ext_type_to_class:
-            raise ValueError("Ext type {:d} already registered with class {:s}".format(ext_type, repr(_ext_type_to_class[ext_type])))
-        elif cls in _ext_class_to_type:
-            raise ValueError("Class {:s} already registered with Ext type {:d}".format(repr(cls), ext_type))
-
-        _ext_type_to_class[ext_type] = cls
-        _ext_class_to_type[cls] = ext_type
-
-        return cls
-
-    return wrapper
+    return _ext_registry.register(ext_type)
 
 
 ##############################################################################
@@ -210,6 +417,14 @@ class UnsupportedTypeException(PackException):
     "Object type not supported for packing."
 
 
+class CircularReferenceException(PackException):
+    "Circular reference encountered during packing."
+
+
+class InsufficientSpaceException(PackException):
+    "Insufficient space for the serialized object."
+
+
 # Unpacking error
 class InsufficientDataException(UnpackException):
     "Insufficient data to unpack the serialized object."
@@ -238,6 +453,10 @@ class DuplicateKeyException(UnpackException):
     "Duplicate key encountered during map unpacking."
 
 
+class UnexpectedTypeException(UnpackException):
+    "Unexpected MessagePack type encountered during unpacking."
+
+
 # Backwards compatibility
 KeyNotPrimitiveException = UnhashableKeyException
 KeyDuplicateException = DuplicateKeyException
@@ -271,6 +490,9 @@ Example:
     b'\\x92\\xabsome string\\xaasome bytes'
     >>> umsgpack.unpackb(_)
     [b'some string', b'some bytes']
+
+The mode may also be selected per call, or per Packer and Unpacker, with the
+`compatibility` option, which takes precedence over this attribute.
 """
 
 ##############################################################################
@@ -282,6 +504,10 @@ Example:
 # chr(obj) has a str return type instead of bytes in Python 3, and
 # struct.pack(...) has the right return type in both versions.
 
+# Minimum length of a string, binary, or ext payload that is written
+# separately from its header
+_payload_write_size = 2**14
+
 
 def _pack_integer(obj, fp, options):
     if obj < 0:
@@ -321,17 +547,71 @@ def _pack_boolean(obj, fp, options):
 
 
 def _pack_float(obj, fp, options):
-    float_precision = options.get('force_float_precision', _float_precision)
+    if options.get("integral_float_as_int") and obj.is_integer() and -2**63 <= obj < 2**64 \
+            and (obj != 0 or math.copysign(1.0, obj) > 0):
+        _pack_integer(int(obj), fp, options)
+        return
+
+    float_precision = options.get('force_float_precision', "auto" if options.get("canonical") else _float_precision)
 
     if float_precision == "double":
         fp.write(b"\xcb" + struct.pack(">d", obj))
     elif float_precision == "single":
         fp.write(b"\xca" + struct.pack(">f", obj))
+    elif float_precision == "auto":
+        _pack_float_auto(obj, fp, options)
     else:
         raise ValueError("invalid float precision")
 
 
+def _pack_float_auto(obj, fp, options):
+    # Single precision if the value round-trips through it, and a single
+    # quiet NaN encoding when canonical
+    if obj != obj and options.get("canonical"):
+        fp.write(b"\xca\x7f\xc0\x00\x00")
+        return
+
+    data = _pack_single_lossless(obj)
+    if data is not None:
+        fp.write(b"\xca" + data)
+    else:
+        fp.write(b"\xcb" + struct.pack(">d", obj))
+
+
+def _pack_single_lossless(obj):
+    # Single precision bytes of a float, or None if it doesn't round-trip
+    try:
+        data = struct.pack(">f", obj)
+    except OverflowError:
+        return None
+
+    value = struct.unpack(">f", data)[0]
+    if value == obj:
+        return data
+
+    # NaNs compare unequal, so compare their bits, including sign and payload
+    if obj != obj and struct.pack(">d", value) == struct.pack(">d", obj):
+        return data
+
+    return None
+
+
 def _pack_string(obj, fp, options):
+    string_cache = options.get("string_cache")
+    if string_cache is not None and len(obj) <= string_cache.max_length:
+        data = string_cache._packed.get(obj)
+        if data is not None:
+            string_cache.hits += 1
+            fp.write(data)
+            return
+
+        string_cache.misses += 1
+        data = _encode_string(obj)
+        if len(string_cache._packed) < string_cache.maxsize:
+            string_cache._packed[obj] = data
+        fp.write(data)
+        return
+
     obj = obj.encode('utf-8')
     obj_len = len(obj)
     if obj_len < 32:
@@ -339,9 +619,24 @@ def _pack_string(obj, fp, options):
     elif obj_len < 2**8:
         fp.write(b"\xd9" + struct.pack("B", obj_len) + obj)
     elif obj_len < 2**16:
-        fp.write(b"\xda" + struct.pack(">H", obj_len) + obj)
+        _write_payload(b"\xda" + struct.pack(">H", obj_len), obj, fp)
+    elif obj_len < 2**32:
+        _write_payload(b"\xdb" + struct.pack(">I", obj_len), obj, fp)
+    else:
+        raise UnsupportedTypeException("huge string")
+
+
+def _encode_string(obj):
+    obj = obj.encode('utf-8')
+    obj_len = len(obj)
+    if obj_len < 32:
+        return struct.pack("B", 0xa0 | obj_len) + obj
+    elif obj_len < 2**8:
+        return b"\xd9" + struct.pack("B", obj_len) + obj
+    elif obj_len < 2**16:
+        return b"\xda" + struct.pack(">H", obj_len) + obj
     elif obj_len < 2**32:
-        fp.write(b"\xdb" + struct.pack(">I", obj_len) + obj)
+        return b"\xdb" + struct.pack(">I", obj_len) + obj
     else:
         raise UnsupportedTypeException("huge string")
 
@@ -351,9 +646,9 @@ def _pack_binary(obj, fp, options):
     if obj_len < 2**8:
         fp.write(b"\xc4" + struct.pack("B", obj_len) + obj)
     elif obj_len < 2**16:
-        fp.write(b"\xc5" + struct.pack(">H", obj_len) + obj)
+        _write_payload(b"\xc5" + struct.pack(">H", obj_len), obj, fp)
     elif obj_len < 2**32:
-        fp.write(b"\xc6" + struct.pack(">I", obj_len) + obj)
+        _write_payload(b"\xc6" + struct.pack(">I", obj_len), obj, fp)
     else:
         raise UnsupportedTypeException("huge binary string")
 
@@ -363,9 +658,9 @@ def _pack_oldspec_raw(obj, fp, options):
     if obj_len < 32:
         fp.write(struct.pack("B", 0xa0 | obj_len) + obj)
     elif obj_len < 2**16:
-        fp.write(b"\xda" + struct.pack(">H", obj_len) + obj)
+        _write_payload(b"\xda" + struct.pack(">H", obj_len), obj, fp)
     elif obj_len < 2**32:
-        fp.write(b"\xdb" + struct.pack(">I", obj_len) + obj)
+        _write_payload(b"\xdb" + struct.pack(">I", obj_len), obj, fp)
     else:
         raise UnsupportedTypeException("huge raw string")
 
@@ -385,41 +680,62 @@ def _pack_ext(obj, fp, options):
     elif obj_len < 2**8:
         fp.write(b"\xc7" + struct.pack("BB", obj_len, obj.type & 0xff) + obj.data)
     elif obj_len < 2**16:
-        fp.write(b"\xc8" + struct.pack(">HB", obj_len, obj.type & 0xff) + obj.data)
+        _write_payload(b"\xc8" + struct.pack(">HB", obj_len, obj.type & 0xff), obj.data, fp)
     elif obj_len < 2**32:
-        fp.write(b"\xc9" + struct.pack(">IB", obj_len, obj.type & 0xff) + obj.data)
+        _write_payload(b"\xc9" + struct.pack(">IB", obj_len, obj.type & 0xff), obj.data, fp)
     else:
         raise UnsupportedTypeException("huge ext data")
 
 
+def _write_payload(header, payload, fp):
+    if len(payload) < _payload_write_size:
+        fp.write(header + payload)
+    else:
+        # Write a large payload separately, rather than copying it into a
+        # concatenation with its header
+        fp.write(header)
+        # Streams may accept a large payload without staging it
+        write_direct = getattr(fp, "write_direct", None)
+        if write_direct is not None:
+            write_direct(payload)
+        else:
+            fp.write(payload)
+
+
 def _pack_ext_timestamp(obj, fp, options):
+    seconds, microseconds = _datetime_to_timestamp(obj)
+    _pack_timestamp(seconds, microseconds * 1000, fp)
+
+
+def _datetime_to_timestamp(obj):
+    _datetime_module()
+
     if not obj.tzinfo:
-        # Object is naive datetime, convert to aware date time,
-        # assuming UTC timezone
-        delta = obj.replace(tzinfo=_utc_tzinfo) - _epoch
+        # Object is naive datetime, assume UTC timezone
+        delta = obj - _epoch_naive
     else:
         # Object is aware datetime
         delta = obj - _epoch
 
-    seconds = delta.seconds + delta.days * 86400
-    microseconds = delta.microseconds
+    return (delta.days * 86400 + delta.seconds, delta.microseconds)
+
 
-    if microseconds == 0 and 0 <= seconds <= 2**32 - 1:
+def _pack_timestamp(seconds, nanoseconds, fp):
+    if nanoseconds == 0 and 0 <= seconds <= 2**32 - 1:
         # 32-bit timestamp
         fp.write(b"\xd6\xff" + struct.pack(">I", seconds))
     elif 0 <= seconds <= 2**34 - 1:
         # 64-bit timestamp
-        value = ((microseconds * 1000) << 34) | seconds
+        value = (nanoseconds << 34) | seconds
         fp.write(b"\xd7\xff" + struct.pack(">Q", value))
     elif -2**63 <= abs(seconds) <= 2**63 - 1:
         # 96-bit timestamp
-        fp.write(b"\xc7\x0c\xff" + struct.pack(">Iq", microseconds * 1000, seconds))
+        fp.write(b"\xc7\x0c\xff" + struct.pack(">Iq", nanoseconds, seconds))
     else:
         raise UnsupportedTypeException("huge timestamp")
 
 
-def _pack_array(obj, fp, options):
-    obj_len = len(obj)
+def _pack_array_header(obj_len, fp, options):
     if obj_len < 16:
         fp.write(struct.pack("B", 0x90 | obj_len))
     elif obj_len < 2**16:
@@ -429,12 +745,8 @@ def _pack_array(obj, fp, options):
     else:
         raise UnsupportedTypeException("huge array")
 
-    for e in obj:
-        pack(e, fp, **options)
-
 
-def _pack_map(obj, fp, options):
-    obj_len = len(obj)
+def _pack_map_header(obj_len, fp, options):
     if obj_len < 16:
         fp.write(struct.pack("B", 0x80 | obj_len))
     elif obj_len < 2**16:
@@ -444,9 +756,98 @@ def _pack_map(obj, fp, options):
     else:
         raise UnsupportedTypeException("huge array")
 
+
+def _pack_array(obj, fp, options):
+    _pack_array_header(len(obj), fp, options)
+
+    stack = options.get("_pack_stack")
+    if stack is not None:
+        # Iterative packing, defer elements to the work stack
+        _pack_push(obj, iter(obj), stack, options)
+        return
+
+    for e in obj:
+        _pack_object(e, fp, options)
+
+
+def _pack_map(obj, fp, options):
+    _pack_map_header(len(obj), fp, options)
+
+    if options.get("canonical"):
+        _pack_map_canonical(obj, fp, options)
+        return
+
+    stack = options.get("_pack_stack")
+    if stack is not None:
+        # Iterative packing, defer keys and values to the work stack
+        _pack_push(obj, itertools.chain.from_iterable(obj.items()), stack, options)
+        return
+
+    for k, v in obj.items():
+        _pack_object(k, fp, options)
+        _pack_object(v, fp, options)
+
+
+def _first_item(item):
+    return item[0]
+
+
+def _pack_map_canonical(obj, fp, options):
+    # Pack keys once, and sort the pairs by the serialized keys. Keys are
+    # packed recursively, as hashable keys cannot be circular.
+    key_options = dict(options, _pack_stack=None)
+    items = []
     for k, v in obj.items():
-        pack(k, fp, **options)
-        pack(v, fp, **options)
+        key_fp = io.BytesIO()
+        _pack_object(k, key_fp, key_options)
+        items.append((key_fp.getvalue(), v))
+    items.sort(key=_first_item)
+
+    stack = options.get("_pack_stack")
+    if stack is not None:
+        # Iterative packing, defer values to the work stack, writing each
+        # serialized key before its value
+        _pack_push(obj, _iter_canonical_values(items, fp), stack, options)
+        return
+
+    for k, v in items:
+        fp.write(k)
+        _pack_object(v, fp, options)
+
+
+def _iter_canonical_values(items, fp):
+    for k, v in items:
+        fp.write(k)
+        yield v
+
+
+def _pack_push(obj, elements, stack, options):
+    active = options["_pack_active"]
+    if id(obj) in active:
+        raise CircularReferenceException(
+            "circular reference encountered: {:s}".format(str(type(obj))))
+
+    active.add(id(obj))
+    stack.append((id(obj), elements))
+
+
+def _pack_iterative(obj, fp, options):
+    # Work stack of (container id, element iterator) for containers being
+    # packed, and the set of container ids on the stack
+    stack = []
+    options = dict(options, _pack_stack=stack, _pack_active=set())
+
+    _pack_object(obj, fp, options)
+
+    while stack:
+        depth = len(stack)
+        for e in stack[-1][1]:
+            _pack_object(e, fp, options)
+            if len(stack) > depth:
+                # Descend into nested container
+                break
+        else:
+            options["_pack_active"].discard(stack.pop()[0])
 
 ########################################
 
@@ -464,10 +865,27 @@ def _pack2(obj, fp, **options):
         ext_handlers (dict): dictionary of Ext handlers, mapping a custom type
                              to a callable that packs an instance of the type
                              into an Ext object
+        ext_registry (ExtRegistry): registry of Ext serializable classes
+                                    (default registry of
+                                    :func:`ext_serializable`)
         force_float_precision (str): "single" to force packing floats as
                                      IEEE-754 single-precision floats,
                                      "double" to force packing floats as
-                                     IEEE-754 double-precision floats
+                                     IEEE-754 double-precision floats,
+                                     "auto" to pack floats as
+                                     single-precision floats when lossless
+        integral_float_as_int (bool): pack integral floats as integers
+                                      (default False)
+        iterative (bool): pack nested arrays and maps with an explicit work
+                          stack, instead of recursion, and detect circular
+                          references (default False)
+        compatibility (bool): pack strings and bytes into the old
+                              specification "raw" type (default
+                              :data:`umsgpack.compatibility`)
+        string_cache (StringCache): cache of serialized short strings
+        canonical (bool): pack deterministically, with map keys sorted by
+                          their serialized bytes and floats in "auto"
+                          precision (default False)
 
     Returns:
         None
@@ -475,46 +893,55 @@ def _pack2(obj, fp, **options):
     Raises:
         UnsupportedTypeException(PackException):
             Object type not supported for packing.
+        CircularReferenceException(PackException):
+            Circular reference encountered during iterative packing.
 
     Example:
         >>> f = open('test.bin', 'wb')
         >>> umsgpack.pack({u"compact": True, u"schema": 0}, f)
     """
-    global compatibility
+    if options.get("iterative"):
+        _pack_iterative(obj, fp, options)
+    else:
+        _pack_object2(obj, fp, options)
+
 
+def _pack_object2(obj, fp, options):
     ext_handlers = options.get("ext_handlers")
+    ext_registry = options.get("ext_registry", _ext_registry)
 
     if obj is None:
         _pack_nil(obj, fp, options)
     elif ext_handlers and obj.__class__ in ext_handlers:
         _pack_ext(ext_handlers[obj.__class__](obj), fp, options)
-    elif obj.__class__ in _ext_class_to_type:
-        try:
-            _pack_ext(Ext(_ext_class_to_type[obj.__class__], obj.packb()), fp, options)
-        except AttributeError:
-            raise NotImplementedError("Ext serializable class {:s} is missing implementation of packb()".format(repr(obj.__class__)))
+    elif obj.__class__ in ext_registry._class_to_type:
+        _pack_ext(ext_registry._pack(obj, obj.__class__), fp, options)
     elif isinstance(obj, bool):
         _pack_boolean(obj, fp, options)
     elif isinstance(obj, (int, long)):  # noqa: F821
         _pack_integer(obj, fp, options)
     elif isinstance(obj, float):
         _pack_float(obj, fp, options)
-    elif compatibility and isinstance(obj, unicode):  # noqa: F821
-        _pack_oldspec_raw(bytes(obj), fp, options)
-    elif compatibility and isinstance(obj, bytes):
-        _pack_oldspec_raw(obj, fp, options)
     elif isinstance(obj, unicode):  # noqa: F821
-        _pack_string(obj, fp, options)
+        if options.get("compatibility", compatibility):
+            _pack_oldspec_raw(bytes(obj), fp, options)
+        else:
+            _pack_string(obj, fp, options)
     elif isinstance(obj, str):
-        _pack_binary(obj, fp, options)
+        if options.get("compatibility", compatibility):
+            _pack_oldspec_raw(obj, fp, options)
+        else:
+            _pack_binary(obj, fp, options)
     elif isinstance(obj, (list, tuple)):
         _pack_array(obj, fp, options)
     elif isinstance(obj, dict):
         _pack_map(obj, fp, options)
-    elif isinstance(obj, datetime.datetime):
-        _pack_ext_timestamp(obj, fp, options)
+    elif isinstance(obj, Timestamp):
+        _pack_timestamp(obj.seconds, obj.nanoseconds, fp)
     elif isinstance(obj, Ext):
         _pack_ext(obj, fp, options)
+    elif isinstance(obj, _datetime_module().datetime):
+        _pack_ext_timestamp(obj, fp, options)
     elif ext_handlers:
         # Linear search for superclass
         t = next((t for t in ext_handlers.keys() if isinstance(obj, t)), None)
@@ -523,18 +950,12 @@ def _pack2(obj, fp, **options):
         else:
             raise UnsupportedTypeException(
                 "unsupported type: {:s}".format(str(type(obj))))
-    elif _ext_class_to_type:
-        # Linear search for superclass
-        t = next((t for t in _ext_class_to_type if isinstance(obj, t)), None)
-        if t:
-            try:
-                _pack_ext(Ext(_ext_class_to_type[t], obj.packb()), fp, options)
-            except AttributeError:
-                raise NotImplementedError("Ext serializable class {:s} is missing implementation of packb()".format(repr(t)))
-        else:
-            raise UnsupportedTypeException("unsupported type: {:s}".format(str(type(obj))))
     else:
-        raise UnsupportedTypeException("unsupported type: {:s}".format(str(type(obj))))
+        # Search for registered superclass, with cached resolution
+        t = ext_registry._resolve(obj.__class__)
+        if t is None:
+            raise UnsupportedTypeException("unsupported type: {:s}".format(str(type(obj))))
+        _pack_ext(ext_registry._pack(obj, t), fp, options)
 
 
 # Pack for Python 3, with unicode 'str' type, 'bytes' type, and no 'long' type
@@ -550,10 +971,27 @@ def _pack3(obj, fp, **options):
         ext_handlers (dict): dictionary of Ext handlers, mapping a custom type
                              to a callable that packs an instance of the type
                              into an Ext object
+        ext_registry (ExtRegistry): registry of Ext serializable classes
+                                    (default registry of
+                                    :func:`ext_serializable`)
         force_float_precision (str): "single" to force packing floats as
                                      IEEE-754 single-precision floats,
                                      "double" to force packing floats as
-                                     IEEE-754 double-precision floats
+                                     IEEE-754 double-precision floats,
+                                     "auto" to pack floats as
+                                     single-precision floats when lossless
+        integral_float_as_int (bool): pack integral floats as integers
+                                      (default False)
+        iterative (bool): pack nested arrays and maps with an explicit work
+                          stack, instead of recursion, and detect circular
+                          references (default False)
+        compatibility (bool): pack strings and bytes into the old
+                              specification "raw" type (default
+                              :data:`umsgpack.compatibility`)
+        string_cache (StringCache): cache of serialized short strings
+        canonical (bool): pack deterministically, with map keys sorted by
+                          their serialized bytes and floats in "auto"
+                          precision (default False)
 
     Returns:
         None
@@ -561,46 +999,55 @@ def _pack3(obj, fp, **options):
     Raises:
         UnsupportedTypeException(PackException):
             Object type not supported for packing.
+        CircularReferenceException(PackException):
+            Circular reference encountered during iterative packing.
 
     Example:
         >>> f = open('test.bin', 'wb')
         >>> umsgpack.pack({u"compact": True, u"schema": 0}, f)
     """
-    global compatibility
+    if options.get("iterative"):
+        _pack_iterative(obj, fp, options)
+    else:
+        _pack_object3(obj, fp, options)
 
+
+def _pack_object3(obj, fp, options):
     ext_handlers = options.get("ext_handlers")
+    ext_registry = options.get("ext_registry", _ext_registry)
 
     if obj is None:
         _pack_nil(obj, fp, options)
     elif ext_handlers and obj.__class__ in ext_handlers:
         _pack_ext(ext_handlers[obj.__class__](obj), fp, options)
-    elif obj.__class__ in _ext_class_to_type:
-        try:
-            _pack_ext(Ext(_ext_class_to_type[obj.__class__], obj.packb()), fp, options)
-        except AttributeError:
-            raise NotImplementedError("Ext serializable class {:s} is missing implementation of packb()".format(repr(obj.__class__)))
+    elif obj.__class__ in ext_registry._class_to_type:
+        _pack_ext(ext_registry._pack(obj, obj.__class__), fp, options)
     elif isinstance(obj, bool):
         _pack_boolean(obj, fp, options)
     elif isinstance(obj, int):
         _pack_integer(obj, fp, options)
     elif isinstance(obj, float):
         _pack_float(obj, fp, options)
-    elif compatibility and isinstance(obj, str):
-        _pack_oldspec_raw(obj.encode('utf-8'), fp, options)
-    elif compatibility and isinstance(obj, bytes):
-        _pack_oldspec_raw(obj, fp, options)
     elif isinstance(obj, str):
-        _pack_string(obj, fp, options)
+        if options.get("compatibility", compatibility):
+            _pack_oldspec_raw(obj.encode('utf-8'), fp, options)
+        else:
+            _pack_string(obj, fp, options)
     elif isinstance(obj, bytes):
-        _pack_binary(obj, fp, options)
+        if options.get("compatibility", compatibility):
+            _pack_oldspec_raw(obj, fp, options)
+        else:
+            _pack_binary(obj, fp, options)
     elif isinstance(obj, (list, tuple)):
         _pack_array(obj, fp, options)
     elif isinstance(obj, dict):
         _pack_map(obj, fp, options)
-    elif isinstance(obj, datetime.datetime):
-        _pack_ext_timestamp(obj, fp, options)
+    elif isinstance(obj, Timestamp):
+        _pack_timestamp(obj.seconds, obj.nanoseconds, fp)
     elif isinstance(obj, Ext):
         _pack_ext(obj, fp, options)
+    elif isinstance(obj, _datetime_module().datetime):
+        _pack_ext_timestamp(obj, fp, options)
     elif ext_handlers:
         # Linear search for superclass
         t = next((t for t in ext_handlers.keys() if isinstance(obj, t)), None)
@@ -609,19 +1056,12 @@ def _pack3(obj, fp, **options):
         else:
             raise UnsupportedTypeException(
                 "unsupported type: {:s}".format(str(type(obj))))
-    elif _ext_class_to_type:
-        # Linear search for superclass
-        t = next((t for t in _ext_class_to_type if isinstance(obj, t)), None)
-        if t:
-            try:
-                _pack_ext(Ext(_ext_class_to_type[t], obj.packb()), fp, options)
-            except AttributeError:
-                raise NotImplementedError("Ext serializable class {:s} is missing implementation of packb()".format(repr(t)))
-        else:
-            raise UnsupportedTypeException("unsupported type: {:s}".format(str(type(obj))))
     else:
-        raise UnsupportedTypeException(
-            "unsupported type: {:s}".format(str(type(obj))))
+        # Search for registered superclass, with cached resolution
+        t = ext_registry._resolve(obj.__class__)
+        if t is None:
+            raise UnsupportedTypeException("unsupported type: {:s}".format(str(type(obj))))
+        _pack_ext(ext_registry._pack(obj, t), fp, options)
 
 
 def _packb2(obj, **options):
@@ -635,10 +1075,27 @@ def _packb2(obj, **options):
         ext_handlers (dict): dictionary of Ext handlers, mapping a custom type
                              to a callable that packs an instance of the type
                              into an Ext object
+        ext_registry (ExtRegistry): registry of Ext serializable classes
+                                    (default registry of
+                                    :func:`ext_serializable`)
         force_float_precision (str): "single" to force packing floats as
                                      IEEE-754 single-precision floats,
                                      "double" to force packing floats as
-                                     IEEE-754 double-precision floats
+                                     IEEE-754 double-precision floats,
+                                     "auto" to pack floats as
+                                     single-precision floats when lossless
+        integral_float_as_int (bool): pack integral floats as integers
+                                      (default False)
+        iterative (bool): pack nested arrays and maps with an explicit work
+                          stack, instead of recursion, and detect circular
+                          references (default False)
+        compatibility (bool): pack strings and bytes into the old
+                              specification "raw" type (default
+                              :data:`umsgpack.compatibility`)
+        string_cache (StringCache): cache of serialized short strings
+        canonical (bool): pack deterministically, with map keys sorted by
+                          their serialized bytes and floats in "auto"
+                          precision (default False)
 
     Returns:
         str: Serialized MessagePack bytes
@@ -646,6 +1103,8 @@ def _packb2(obj, **options):
     Raises:
         UnsupportedTypeException(PackException):
             Object type not supported for packing.
+        CircularReferenceException(PackException):
+            Circular reference encountered during iterative packing.
 
     Example:
         >>> umsgpack.packb({u"compact": True, u"schema": 0})
@@ -667,10 +1126,27 @@ def _packb3(obj, **options):
         ext_handlers (dict): dictionary of Ext handlers, mapping a custom type
                              to a callable that packs an instance of the type
                              into an Ext object
+        ext_registry (ExtRegistry): registry of Ext serializable classes
+                                    (default registry of
+                                    :func:`ext_serializable`)
         force_float_precision (str): "single" to force packing floats as
                                      IEEE-754 single-precision floats,
                                      "double" to force packing floats as
-                                     IEEE-754 double-precision floats
+                                     IEEE-754 double-precision floats,
+                                     "auto" to pack floats as
+                                     single-precision floats when lossless
+        integral_float_as_int (bool): pack integral floats as integers
+                                      (default False)
+        iterative (bool): pack nested arrays and maps with an explicit work
+                          stack, instead of recursion, and detect circular
+                          references (default False)
+        compatibility (bool): pack strings and bytes into the old
+                              specification "raw" type (default
+                              :data:`umsgpack.compatibility`)
+        string_cache (StringCache): cache of serialized short strings
+        canonical (bool): pack deterministically, with map keys sorted by
+                          their serialized bytes and floats in "auto"
+                          precision (default False)
 
     Returns:
         bytes: Serialized MessagePack bytes
@@ -678,6 +1154,8 @@ def _packb3(obj, **options):
     Raises:
         UnsupportedTypeException(PackException):
             Object type not supported for packing.
+        CircularReferenceException(PackException):
+            Circular reference encountered during iterative packing.
 
     Example:
         >>> umsgpack.packb({u"compact": True, u"schema": 0})
@@ -688,61 +1166,550 @@ def _packb3(obj, **options):
     return fp.getvalue()
 
 #############################################################################
-# Unpacking
+# Packed Size
 #############################################################################
 
+# The size functions below mirror the encoding width decisions of the packing
+# functions above, without serializing.
 
-def _read_except(fp, n):
-    if n == 0:
-        return b""
 
-    data = fp.read(n)
-    if len(data) == 0:
-        raise InsufficientDataException()
+def _integer_size(obj):
+    if obj < 0:
+        if obj >= -32:
+            return 1
+        elif obj >= -2**(8 - 1):
+            return 2
+        elif obj >= -2**(16 - 1):
+            return 3
+        elif obj >= -2**(32 - 1):
+            return 5
+        elif obj >= -2**(64 - 1):
+            return 9
+        else:
+            raise UnsupportedTypeException("huge signed int")
+    else:
+        if obj < 128:
+            return 1
+        elif obj < 2**8:
+            return 2
+        elif obj < 2**16:
+            return 3
+        elif obj < 2**32:
+            return 5
+        elif obj < 2**64:
+            return 9
+        else:
+            raise UnsupportedTypeException("huge unsigned int")
 
-    while len(data) < n:
-        chunk = fp.read(n - len(data))
-        if len(chunk) == 0:
-            raise InsufficientDataException()
 
-        data += chunk
+def _float_size(obj, options):
+    if options.get("integral_float_as_int") and obj.is_integer() and -2**63 <= obj < 2**64 \
+            and (obj != 0 or math.copysign(1.0, obj) > 0):
+        return _integer_size(int(obj))
 
-    return data
+    float_precision = options.get('force_float_precision', "auto" if options.get("canonical") else _float_precision)
 
+    if float_precision == "double":
+        return 9
+    elif float_precision == "single":
+        return 5
+    elif float_precision == "auto":
+        return 5 if (obj != obj and options.get("canonical")) or _pack_single_lossless(obj) is not None else 9
+    else:
+        raise ValueError("invalid float precision")
 
-def _unpack_integer(code, fp, options):
-    if (ord(code) & 0xe0) == 0xe0:
-        return struct.unpack("b", code)[0]
-    elif code == b'\xd0':
-        return struct.unpack("b", _read_except(fp, 1))[0]
-    elif code == b'\xd1':
-        return struct.unpack(">h", _read_except(fp, 2))[0]
-    elif code == b'\xd2':
-        return struct.unpack(">i", _read_except(fp, 4))[0]
-    elif code == b'\xd3':
-        return struct.unpack(">q", _read_except(fp, 8))[0]
-    elif (ord(code) & 0x80) == 0x00:
-        return struct.unpack("B", code)[0]
-    elif code == b'\xcc':
-        return struct.unpack("B", _read_except(fp, 1))[0]
-    elif code == b'\xcd':
-        return struct.unpack(">H", _read_except(fp, 2))[0]
-    elif code == b'\xce':
-        return struct.unpack(">I", _read_except(fp, 4))[0]
-    elif code == b'\xcf':
-        return struct.unpack(">Q", _read_except(fp, 8))[0]
-    raise Exception("logic error, not int: 0x{:02x}".format(ord(code)))
 
+def _string_size(obj):
+    obj_len = len(obj.encode('utf-8'))
+    if obj_len < 32:
+        return 1 + obj_len
+    elif obj_len < 2**8:
+        return 2 + obj_len
+    elif obj_len < 2**16:
+        return 3 + obj_len
+    elif obj_len < 2**32:
+        return 5 + obj_len
+    else:
+        raise UnsupportedTypeException("huge string")
 
-def _unpack_reserved(code, fp, options):
-    if code == b'\xc1':
-        raise ReservedCodeException(
-            "encountered reserved code: 0x{:02x}".format(ord(code)))
-    raise Exception(
-        "logic error, not reserved code: 0x{:02x}".format(ord(code)))
 
+def _binary_size(obj):
+    obj_len = len(obj)
+    if obj_len < 2**8:
+        return 2 + obj_len
+    elif obj_len < 2**16:
+        return 3 + obj_len
+    elif obj_len < 2**32:
+        return 5 + obj_len
+    else:
+        raise UnsupportedTypeException("huge binary string")
 
-def _unpack_nil(code, fp, options):
+
+def _oldspec_raw_size(obj):
+    obj_len = len(obj)
+    if obj_len < 32:
+        return 1 + obj_len
+    elif obj_len < 2**16:
+        return 3 + obj_len
+    elif obj_len < 2**32:
+        return 5 + obj_len
+    else:
+        raise UnsupportedTypeException("huge raw string")
+
+
+def _ext_size(obj):
+    obj_len = len(obj.data)
+    if obj_len in (1, 2, 4, 8, 16):
+        return 2 + obj_len
+    elif obj_len < 2**8:
+        return 3 + obj_len
+    elif obj_len < 2**16:
+        return 4 + obj_len
+    elif obj_len < 2**32:
+        return 6 + obj_len
+    else:
+        raise UnsupportedTypeException("huge ext data")
+
+
+def _ext_timestamp_size(obj):
+    seconds, microseconds = _datetime_to_timestamp(obj)
+    return _timestamp_size(seconds, microseconds * 1000)
+
+
+def _timestamp_size(seconds, nanoseconds):
+    if nanoseconds == 0 and 0 <= seconds <= 2**32 - 1:
+        return 6
+    elif 0 <= seconds <= 2**34 - 1:
+        return 10
+    elif -2**63 <= abs(seconds) <= 2**63 - 1:
+        return 15
+    else:
+        raise UnsupportedTypeException("huge timestamp")
+
+
+def _container_header_size(obj_len, name):
+    if obj_len < 16:
+        return 1
+    elif obj_len < 2**16:
+        return 3
+    elif obj_len < 2**32:
+        return 5
+    else:
+        raise UnsupportedTypeException("huge {:s}".format(name))
+
+
+def _ext_superclass_size(obj, options):
+    ext_handlers = options.get("ext_handlers")
+
+    if ext_handlers:
+        # Linear search for superclass
+        t = next((t for t in ext_handlers.keys() if isinstance(obj, t)), None)
+        if t:
+            return _ext_size(ext_handlers[t](obj))
+    else:
+        ext_registry = options.get("ext_registry", _ext_registry)
+        t = ext_registry._resolve(obj.__class__)
+        if t is not None:
+            return _ext_size(ext_registry._pack(obj, t))
+
+    raise UnsupportedTypeException("unsupported type: {:s}".format(str(type(obj))))
+
+
+def _packed_size_object2(obj, stack, options):
+    ext_handlers = options.get("ext_handlers")
+    ext_registry = options.get("ext_registry", _ext_registry)
+
+    if obj is None:
+        return 1
+    elif ext_handlers and obj.__class__ in ext_handlers:
+        return _ext_size(ext_handlers[obj.__class__](obj))
+    elif obj.__class__ in ext_registry._class_to_type:
+        return _ext_size(ext_registry._pack(obj, obj.__class__))
+    elif isinstance(obj, bool):
+        return 1
+    elif isinstance(obj, (int, long)):  # noqa: F821
+        return _integer_size(obj)
+    elif isinstance(obj, float):
+        return _float_size(obj, options)
+    elif isinstance(obj, unicode):  # noqa: F821
+        if options.get("compatibility", compatibility):
+            return _oldspec_raw_size(bytes(obj))
+        return _string_size(obj)
+    elif isinstance(obj, str):
+        if options.get("compatibility", compatibility):
+            return _oldspec_raw_size(obj)
+        return _binary_size(obj)
+    elif isinstance(obj, (list, tuple)):
+        size = _container_header_size(len(obj), "array")
+        _pack_push(obj, iter(obj), stack, options)
+        return size
+    elif isinstance(obj, dict):
+        size = _container_header_size(len(obj), "map")
+        _pack_push(obj, itertools.chain.from_iterable(obj.items()), stack, options)
+        return size
+    elif isinstance(obj, Timestamp):
+        return _timestamp_size(obj.seconds, obj.nanoseconds)
+    elif isinstance(obj, Ext):
+        return _ext_size(obj)
+    elif isinstance(obj, _datetime_module().datetime):
+        return _ext_timestamp_size(obj)
+    else:
+        return _ext_superclass_size(obj, options)
+
+
+def _packed_size_object3(obj, stack, options):
+    ext_handlers = options.get("ext_handlers")
+    ext_registry = options.get("ext_registry", _ext_registry)
+
+    if obj is None:
+        return 1
+    elif ext_handlers and obj.__class__ in ext_handlers:
+        return _ext_size(ext_handlers[obj.__class__](obj))
+    elif obj.__class__ in ext_registry._class_to_type:
+        return _ext_size(ext_registry._pack(obj, obj.__class__))
+    elif isinstance(obj, bool):
+        return 1
+    elif isinstance(obj, int):
+        return _integer_size(obj)
+    elif isinstance(obj, float):
+        return _float_size(obj, options)
+    elif isinstance(obj, str):
+        if options.get("compatibility", compatibility):
+            return _oldspec_raw_size(obj.encode('utf-8'))
+        return _string_size(obj)
+    elif isinstance(obj, bytes):
+        if options.get("compatibility", compatibility):
+            return _oldspec_raw_size(obj)
+        return _binary_size(obj)
+    elif isinstance(obj, (list, tuple)):
+        size = _container_header_size(len(obj), "array")
+        _pack_push(obj, iter(obj), stack, options)
+        return size
+    elif isinstance(obj, dict):
+        size = _container_header_size(len(obj), "map")
+        _pack_push(obj, itertools.chain.from_iterable(obj.items()), stack, options)
+        return size
+    elif isinstance(obj, Timestamp):
+        return _timestamp_size(obj.seconds, obj.nanoseconds)
+    elif isinstance(obj, Ext):
+        return _ext_size(obj)
+    elif isinstance(obj, _datetime_module().datetime):
+        return _ext_timestamp_size(obj)
+    else:
+        return _ext_superclass_size(obj, options)
+
+
+def packed_size(obj, **options):
+    """
+    Compute the length of the serialized MessagePack bytes of a Python
+    object, without serializing it.
+
+    Nested arrays and maps are traversed with an explicit work stack, as in
+    iterative packing, so circular references are detected. Ext handlers and
+    Ext serializable classes are invoked to determine the length of their
+    data.
+
+    Args:
+        obj: a Python object
+
+    Keyword Args:
+        Packing options, see :func:`pack`.
+
+    Returns:
+        int: Length of serialized MessagePack bytes
+
+    Raises:
+        UnsupportedTypeException(PackException):
+            Object type not supported for packing.
+        CircularReferenceException(PackException):
+            Circular reference encountered.
+
+    Example:
+        >>> umsgpack.packed_size({u"compact": True, u"schema": 0})
+        18
+    """
+    stack = []
+    options = dict(options, _pack_active=set())
+
+    size = _packed_size_object(obj, stack, options)
+
+    while stack:
+        depth = len(stack)
+        for e in stack[-1][1]:
+            size += _packed_size_object(e, stack, options)
+            if len(stack) > depth:
+                # Descend into nested container
+                break
+        else:
+            options["_pack_active"].discard(stack.pop()[0])
+
+    return size
+
+
+def packb_chunks(obj, max_size, **options):
+    """
+    Serialize the elements of an array into a sequence of MessagePack arrays,
+    each at most `max_size` bytes long, and each independently decodable.
+
+    Elements are packed once, with the encoded size of the current array
+    tracked as they are added, and an array is emitted before the element
+    that would exceed `max_size`.
+
+    Args:
+        obj: a list, tuple, or other iterable of Python objects
+        max_size (int): maximum length of each serialized array in bytes
+
+    Keyword Args:
+        Packing options, see :func:`pack`.
+
+    Returns:
+        generator: generator of serialized MessagePack arrays, as bytes. An
+                   empty iterable yields no arrays.
+
+    Raises:
+        InsufficientSpaceException(PackException):
+            Serialized element does not fit into an array of `max_size` bytes.
+        UnsupportedTypeException(PackException):
+            Object type not supported for packing.
+
+    Example:
+        >>> for message in umsgpack.packb_chunks(records, 2**20):
+        ...     transport.send(message)
+        ...
+    """
+    element_fp = io.BytesIO()
+    elements = []
+    elements_size = 0
+
+    for e in obj:
+        element_fp.seek(0)
+        element_fp.truncate()
+        pack(e, element_fp, **options)
+        data = element_fp.getvalue()
+
+        if elements and _container_header_size(len(elements) + 1, "array") + elements_size + len(data) > max_size:
+            yield _packb_chunk(elements, options)
+            elements = []
+            elements_size = 0
+
+        if not elements and _container_header_size(1, "array") + len(data) > max_size:
+            raise InsufficientSpaceException(
+                "serialized element of {:d} bytes exceeds maximum size {:d}".format(len(data), max_size))
+
+        elements.append(data)
+        elements_size += len(data)
+
+    if elements:
+        yield _packb_chunk(elements, options)
+
+
+def _packb_chunk(elements, options):
+    fp = io.BytesIO()
+    _pack_array_header(len(elements), fp, options)
+    fp.write(b"".join(elements))
+    return fp.getvalue()
+
+
+class _BufferWriter(io.BytesIO):
+    # Stream staging writes for a writable buffer, copied into the buffer
+    # from an offset until the end of the buffer. Large payloads are copied
+    # into the buffer directly, without staging.
+
+    def __init__(self, view, offset):
+        io.BytesIO.__init__(self)
+        self.view = view
+        self.offset = offset
+
+    def write_direct(self, data):
+        self.commit()
+        self._copy(data)
+
+    def commit(self):
+        if self.tell():
+            self._copy(self.getvalue())
+            self.seek(0)
+            self.truncate()
+
+    def _copy(self, data):
+        end = self.offset + len(data)
+        if end > len(self.view):
+            raise InsufficientSpaceException()
+        self.view[self.offset:end] = data
+        self.offset = end
+
+
+def pack_into(obj, buffer, offset=0, **options):
+    """
+    Serialize a Python object into MessagePack bytes, written into a writable
+    buffer, e.g. a bytearray or mmap, at an offset.
+
+    Headers and small objects are staged and copied into the buffer together,
+    which costs the same as :func:`packb` and a copy. Only string, binary, and
+    ext payloads of 16 KiB or more are copied directly into the buffer,
+    without an intermediate copy.
+
+    If the serialized object does not fit into the remaining space of the
+    buffer, InsufficientSpaceException is raised with the required size, and
+    bytes past `offset` may have been overwritten. :func:`packed_size` may be
+    used to check the required size before packing.
+
+    Args:
+        obj: a Python object
+        buffer: a writable buffer-protocol object
+        offset (int): offset in bytes into the buffer (default 0)
+
+    Keyword Args:
+        Packing options, see :func:`pack`.
+
+    Returns:
+        int: Offset following the serialized MessagePack bytes
+
+    Raises:
+        InsufficientSpaceException(PackException):
+            Serialized object does not fit into the remaining space.
+        UnsupportedTypeException(PackException):
+            Object type not supported for packing.
+        TypeError:
+            Buffer is read-only.
+        ValueError:
+            Offset is out of range.
+
+    Example:
+        >>> buf = bytearray(32)
+        >>> umsgpack.pack_into({u"compact": True, u"schema": 0}, buf, 4)
+        22
+    """
+    try:
+        base = memoryview(buffer)
+    except TypeError:
+        # Python 2 mmap objects do not support memoryview, but support slice
+        # assignment
+        base = None
+
+    if hasattr(base, "cast"):
+        view = base.cast("B")
+    else:
+        view = buffer if base is None else base
+
+    if getattr(view, "readonly", False):
+        raise TypeError("buffer is read-only")
+    elif offset < 0 or offset > len(view):
+        raise ValueError("offset {:d} is out of range (0 to {:d})".format(offset, len(view)))
+
+    fp = _BufferWriter(view, offset)
+    try:
+        pack(obj, fp, **options)
+        fp.commit()
+    except InsufficientSpaceException:
+        raise InsufficientSpaceException(
+            "serialized object of {:d} bytes exceeds remaining space of {:d} bytes".format(
+                packed_size(obj, **options), len(view) - offset))
+    finally:
+        if hasattr(base, "release"):
+            # Release the exported buffer, e.g. so that an mmap can be closed
+            view.release()
+            base.release()
+
+    return fp.offset
+
+#############################################################################
+# Unpacking
+#############################################################################
+
+
+# Maximum size of a single read from a stream of unknown length, so that a
+# corrupt or malicious length cannot allocate more memory than the data
+# actually available
+_read_chunk_size = 2**20
+
+
+def _remaining_size(fp):
+    # Remaining length of an in-memory, regular file, or memory map stream,
+    # where seeking to the end is cheap, or None if unknown. Other seekable
+    # streams, e.g. of compressed files, may seek by reading.
+    if not isinstance(fp, _sized_stream_types):
+        mmap = sys.modules.get("mmap")
+        if mmap is None or not isinstance(fp, mmap.mmap):
+            return None
+
+    try:
+        position = fp.tell()
+        fp.seek(0, 2)
+        end = fp.tell()
+        fp.seek(position)
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+    return end - position
+
+
+def _read_except(fp, n):
+    if n == 0:
+        return b""
+
+    if n > _read_chunk_size:
+        remaining = _remaining_size(fp)
+        if remaining is None:
+            return _read_chunks(fp, n)
+        elif remaining < n:
+            raise InsufficientDataException()
+
+    data = fp.read(n)
+    if len(data) == 0:
+        raise InsufficientDataException()
+    elif len(data) < n:
+        data += _read_chunks(fp, n - len(data))
+
+    return data
+
+
+def _read_chunks(fp, n):
+    # Read in bounded chunks, for streams of unknown length
+    chunks = []
+    while n > 0:
+        chunk = fp.read(n if n <= _read_chunk_size else _read_chunk_size)
+        if len(chunk) == 0:
+            raise InsufficientDataException()
+
+        chunks.append(chunk)
+        n -= len(chunk)
+
+    return b"".join(chunks)
+
+
+def _unpack_integer(code, fp, options):
+    if (ord(code) & 0xe0) == 0xe0:
+        return struct.unpack("b", code)[0]
+    elif code == b'\xd0':
+        return struct.unpack("b", _read_except(fp, 1))[0]
+    elif code == b'\xd1':
+        return struct.unpack(">h", _read_except(fp, 2))[0]
+    elif code == b'\xd2':
+        return struct.unpack(">i", _read_except(fp, 4))[0]
+    elif code == b'\xd3':
+        return struct.unpack(">q", _read_except(fp, 8))[0]
+    elif (ord(code) & 0x80) == 0x00:
+        return struct.unpack("B", code)[0]
+    elif code == b'\xcc':
+        return struct.unpack("B", _read_except(fp, 1))[0]
+    elif code == b'\xcd':
+        return struct.unpack(">H", _read_except(fp, 2))[0]
+    elif code == b'\xce':
+        return struct.unpack(">I", _read_except(fp, 4))[0]
+    elif code == b'\xcf':
+        return struct.unpack(">Q", _read_except(fp, 8))[0]
+    raise Exception("logic error, not int: 0x{:02x}".format(ord(code)))
+
+
+def _unpack_reserved(code, fp, options):
+    if code == b'\xc1':
+        raise ReservedCodeException(
+            "encountered reserved code: 0x{:02x}".format(ord(code)))
+    raise Exception(
+        "logic error, not reserved code: 0x{:02x}".format(ord(code)))
+
+
+def _unpack_nil(code, fp, options):
     if code == b'\xc0':
         return None
     raise Exception("logic error, not nil: 0x{:02x}".format(ord(code)))
@@ -765,6 +1732,10 @@ def _unpack_float(code, fp, options):
 
 
 def _unpack_string(code, fp, options):
+    return _decode_string(_read_string(code, fp), options)
+
+
+def _read_string(code, fp):
     if (ord(code) & 0xe0) == 0xa0:
         length = ord(code) & ~0xe0
     elif code == b'\xd9':
@@ -776,12 +1747,24 @@ def _unpack_string(code, fp, options):
     else:
         raise Exception("logic error, not string: 0x{:02x}".format(ord(code)))
 
+    return _read_except(fp, length)
+
+
+def _unpack_fixstr(code, fp, options):
+    # Fast path for short strings, e.g. map keys
+    length = ord(code) & 0x1f
+    data = fp.read(length)
+    if len(data) < length:
+        data += _read_except(fp, length - len(data))
+
+    return _decode_string(data, options)
+
+
+def _decode_string(data, options):
     # Always return raw bytes in compatibility mode
-    global compatibility
-    if compatibility:
-        return _read_except(fp, length)
+    if options.get("compatibility", compatibility):
+        return data
 
-    data = _read_except(fp, length)
     try:
         return bytes.decode(data, 'utf-8')
     except UnicodeDecodeError:
@@ -829,20 +1812,18 @@ def _unpack_ext(code, fp, options):
     # Unpack with ext handler, if we have one
     ext_handlers = options.get("ext_handlers")
     if ext_handlers and ext_type in ext_handlers:
-        return ext_handlers[ext_type](Ext(ext_type, ext_data))
+        return ext_handlers[ext_type](Ext._from_unpacked(ext_type, ext_data))
 
     # Unpack with ext classes, if type is registered
-    if ext_type in _ext_type_to_class:
-        try:
-            return _ext_type_to_class[ext_type].unpackb(ext_data)
-        except AttributeError:
-            raise NotImplementedError("Ext serializable class {:s} is missing implementation of unpackb()".format(repr(_ext_type_to_class[ext_type])))
+    unpackb = options.get("ext_registry", _ext_registry)._type_to_unpackb.get(ext_type)
+    if unpackb is not None:
+        return unpackb(ext_data)
 
     # Timestamp extension
     if ext_type == -1:
         return _unpack_ext_timestamp(ext_data, options)
 
-    return Ext(ext_type, ext_data)
+    return Ext._from_unpacked(ext_type, ext_data)
 
 
 def _unpack_ext_timestamp(ext_data, options):
@@ -850,38 +1831,72 @@ def _unpack_ext_timestamp(ext_data, options):
     if obj_len == 4:
         # 32-bit timestamp
         seconds = struct.unpack(">I", ext_data)[0]
-        microseconds = 0
+        nanoseconds = 0
     elif obj_len == 8:
         # 64-bit timestamp
         value = struct.unpack(">Q", ext_data)[0]
         seconds = value & 0x3ffffffff
-        microseconds = (value >> 34) // 1000
+        nanoseconds = value >> 34
     elif obj_len == 12:
         # 96-bit timestamp
-        seconds = struct.unpack(">q", ext_data[4:12])[0]
-        microseconds = struct.unpack(">I", ext_data[0:4])[0] // 1000
+        nanoseconds, seconds = struct.unpack(">Iq", ext_data)
     else:
         raise UnsupportedTimestampException(
             "unsupported timestamp with data length {:d}".format(len(ext_data)))
 
-    return _epoch + datetime.timedelta(seconds=seconds,
-                                       microseconds=microseconds)
+    timestamp_format = options.get("timestamp_format", "datetime")
+    if timestamp_format == "datetime":
+        return _timestamp_to_datetime(seconds, nanoseconds // 1000)
 
+    if nanoseconds > 999999999:
+        raise UnsupportedTimestampException("timestamp nanoseconds out of range")
 
-def _unpack_array(code, fp, options):
+    if timestamp_format == "timestamp":
+        return Timestamp(seconds, nanoseconds)
+    elif timestamp_format == "tuple":
+        return (seconds, nanoseconds)
+    elif timestamp_format == "nanoseconds":
+        return seconds * 1000000000 + nanoseconds
+    else:
+        raise ValueError("invalid timestamp format")
+
+
+def _timestamp_to_datetime(seconds, microseconds):
+    datetime = _datetime_module()
+
+    if microseconds == 0:
+        # Exact for whole seconds, but limited to the platform's time_t
+        try:
+            return datetime.datetime.fromtimestamp(seconds, _utc_tzinfo)
+        except (OverflowError, ValueError, OSError):
+            pass
+
+    try:
+        return _epoch + datetime.timedelta(0, seconds, microseconds)
+    except OverflowError:
+        raise UnsupportedTimestampException("unpacked timestamp is out of range of datetime")
+
+
+def _unpack_array_header(code, fp, options):
     if (ord(code) & 0xf0) == 0x90:
-        length = (ord(code) & ~0xf0)
+        return (ord(code) & ~0xf0)
     elif code == b'\xdc':
-        length = struct.unpack(">H", _read_except(fp, 2))[0]
+        return struct.unpack(">H", _read_except(fp, 2))[0]
     elif code == b'\xdd':
-        length = struct.unpack(">I", _read_except(fp, 4))[0]
-    else:
-        raise Exception("logic error, not array: 0x{:02x}".format(ord(code)))
+        return struct.unpack(">I", _read_except(fp, 4))[0]
+    raise Exception("logic error, not array: 0x{:02x}".format(ord(code)))
+
+
+def _unpack_array(code, fp, options):
+    length = _unpack_array_header(code, fp, options)
 
     if options.get('use_tuple'):
-        return tuple((_unpack(fp, options) for i in xrange(length)))
+        obj = tuple((_unpack(fp, options) for i in xrange(length)))
+    else:
+        obj = [_unpack(fp, options) for i in xrange(length)]
 
-    return [_unpack(fp, options) for i in xrange(length)]
+    list_hook = options.get('list_hook')
+    return obj if list_hook is None else list_hook(obj)
 
 
 def _deep_list_to_tuple(obj):
@@ -890,30 +1905,57 @@ def _deep_list_to_tuple(obj):
     return obj
 
 
-def _unpack_map(code, fp, options):
+def _unpack_map_header(code, fp, options):
     if (ord(code) & 0xf0) == 0x80:
-        length = (ord(code) & ~0xf0)
+        return (ord(code) & ~0xf0)
     elif code == b'\xde':
-        length = struct.unpack(">H", _read_except(fp, 2))[0]
+        return struct.unpack(">H", _read_except(fp, 2))[0]
     elif code == b'\xdf':
-        length = struct.unpack(">I", _read_except(fp, 4))[0]
-    else:
-        raise Exception("logic error, not map: 0x{:02x}".format(ord(code)))
+        return struct.unpack(">I", _read_except(fp, 4))[0]
+    raise Exception("logic error, not map: 0x{:02x}".format(ord(code)))
 
-    d = {} if not options.get('use_ordered_dict') else collections.OrderedDict()
+
+def _unpack_map(code, fp, options):
+    length = _unpack_map_header(code, fp, options)
+
+    unpack_key = _unpack if not options.get('raw_keys') else _unpack_raw_key
+
+    object_pairs_hook = options.get('object_pairs_hook')
+    if object_pairs_hook is not None:
+        # Key-value pairs are passed through to the hook, so hashability and
+        # duplicate keys are left to the hook
+        pairs = []
+        for _ in xrange(length):
+            k = unpack_key(fp, options)
+            if isinstance(k, list):
+                k = _deep_list_to_tuple(k)
+            pairs.append((k, _unpack(fp, options)))
+        return object_pairs_hook(pairs)
+
+    d = {} if not options.get('use_ordered_dict') else _ordered_dict()
+    strict_map_keys = options.get('strict_map_keys', True)
     for _ in xrange(length):
         # Unpack key
-        k = _unpack(fp, options)
-
-        if isinstance(k, list):
+        k = unpack_key(fp, options)
+
+        if k.__class__ in _fast_key_types:
+            # Common string, bytes, and integer keys are always hashable
+            if strict_map_keys and k in d:
+                raise DuplicateKeyException(
+                    "encountered duplicate key: \"{:s}\" ({:s})".format(str(k), str(type(k))))
+        elif isinstance(k, list):
             # Attempt to convert list into a hashable tuple
             k = _deep_list_to_tuple(k)
-        elif not isinstance(k, Hashable):
-            raise UnhashableKeyException(
-                "encountered unhashable key: \"{:s}\" ({:s})".format(str(k), str(type(k))))
-        elif k in d:
-            raise DuplicateKeyException(
-                "encountered duplicate key: \"{:s}\" ({:s})".format(str(k), str(type(k))))
+        elif strict_map_keys:
+            # Unhashable keys fail the lookup
+            try:
+                duplicate = k in d
+            except TypeError:
+                raise UnhashableKeyException(
+                    "encountered unhashable key: \"{:s}\" ({:s})".format(str(k), str(type(k))))
+            if duplicate:
+                raise DuplicateKeyException(
+                    "encountered duplicate key: \"{:s}\" ({:s})".format(str(k), str(type(k))))
 
         # Unpack value
         v = _unpack(fp, options)
@@ -923,7 +1965,18 @@ def _unpack_map(code, fp, options):
         except TypeError:
             raise UnhashableKeyException(
                 "encountered unhashable key: \"{:s}\"".format(str(k)))
-    return d
+
+    object_hook = options.get('object_hook')
+    return d if object_hook is None else object_hook(d)
+
+
+def _unpack_raw_key(fp, options):
+    # Unpack a map key, leaving a string key undecoded
+    code = _read_except(fp, 1)
+    unpack_fn = _unpack_dispatch_table[code]
+    if unpack_fn is _unpack_fixstr or unpack_fn is _unpack_string:
+        return _read_string(code, fp)
+    return unpack_fn(code, fp, options)
 
 
 def _unpack(fp, options):
@@ -944,13 +1997,39 @@ def _unpack2(fp, **options):
         ext_handlers (dict): dictionary of Ext handlers, mapping integer Ext
                              type to a callable that unpacks an instance of
                              Ext into an object
+        ext_registry (ExtRegistry): registry of Ext serializable classes
+                                    (default registry of
+                                    :func:`ext_serializable`)
         use_ordered_dict (bool): unpack maps into OrderedDict, instead of dict
                                  (default False)
         use_tuple (bool): unpacks arrays into tuples, instead of lists (default
                           False)
+        object_hook (callable): callable that is passed each unpacked map, and
+                                returns the object to unpack it into
+        object_pairs_hook (callable): callable that is passed a list of the
+                                      (key, value) pairs of each map, and
+                                      returns the object to unpack it into,
+                                      instead of a dict (takes precedence over
+                                      object_hook)
+        list_hook (callable): callable that is passed each unpacked array, and
+                              returns the object to unpack it into
+        raw_keys (bool): unpack string map keys into bytes, without decoding
+                         (default False)
+        strict_map_keys (bool): check map keys for duplicates and
+                                hashability before unpacking their values,
+                                or False to skip the checks for trusted
+                                data, where the last value of a duplicate
+                                key wins (default True)
         allow_invalid_utf8 (bool): unpack invalid strings into instances of
                                    :class:`InvalidString`, for access to the
                                    bytes (default False)
+        timestamp_format (str): unpack timestamps into "datetime" objects,
+                                :class:`Timestamp` "timestamp" objects,
+                                (seconds, nanoseconds) "tuple" tuples, or
+                                integer "nanoseconds" since the epoch
+                                (default "datetime")
+        compatibility (bool): unpack the old specification "raw" type into
+                              bytes (default :data:`umsgpack.compatibility`)
 
     Returns:
         Python object
@@ -968,7 +2047,8 @@ def _unpack2(fp, **options):
             Unhashable key encountered during map unpacking.
             The serialized map cannot be deserialized into a Python dictionary.
         DuplicateKeyException(UnpackException):
-            Duplicate key encountered during map unpacking.
+            Duplicate key encountered during map unpacking, with
+            strict_map_keys.
 
     Example:
         >>> f = open('test.bin', 'rb')
@@ -989,13 +2069,39 @@ def _unpack3(fp, **options):
         ext_handlers (dict): dictionary of Ext handlers, mapping integer Ext
                              type to a callable that unpacks an instance of
                              Ext into an object
+        ext_registry (ExtRegistry): registry of Ext serializable classes
+                                    (default registry of
+                                    :func:`ext_serializable`)
         use_ordered_dict (bool): unpack maps into OrderedDict, instead of dict
                                  (default False)
         use_tuple (bool): unpacks arrays into tuples, instead of lists (default
                           False)
+        object_hook (callable): callable that is passed each unpacked map, and
+                                returns the object to unpack it into
+        object_pairs_hook (callable): callable that is passed a list of the
+                                      (key, value) pairs of each map, and
+                                      returns the object to unpack it into,
+                                      instead of a dict (takes precedence over
+                                      object_hook)
+        list_hook (callable): callable that is passed each unpacked array, and
+                              returns the object to unpack it into
+        raw_keys (bool): unpack string map keys into bytes, without decoding
+                         (default False)
+        strict_map_keys (bool): check map keys for duplicates and
+                                hashability before unpacking their values,
+                                or False to skip the checks for trusted
+                                data, where the last value of a duplicate
+                                key wins (default True)
         allow_invalid_utf8 (bool): unpack invalid strings into instances of
                                    :class:`InvalidString`, for access to the
                                    bytes (default False)
+        timestamp_format (str): unpack timestamps into "datetime" objects,
+                                :class:`Timestamp` "timestamp" objects,
+                                (seconds, nanoseconds) "tuple" tuples, or
+                                integer "nanoseconds" since the epoch
+                                (default "datetime")
+        compatibility (bool): unpack the old specification "raw" type into
+                              bytes (default :data:`umsgpack.compatibility`)
 
     Returns:
         Python object
@@ -1013,7 +2119,8 @@ def _unpack3(fp, **options):
             Unhashable key encountered during map unpacking.
             The serialized map cannot be deserialized into a Python dictionary.
         DuplicateKeyException(UnpackException):
-            Duplicate key encountered during map unpacking.
+            Duplicate key encountered during map unpacking, with
+            strict_map_keys.
 
     Example:
         >>> f = open('test.bin', 'rb')
@@ -1035,13 +2142,39 @@ def _unpackb2(s, **options):
         ext_handlers (dict): dictionary of Ext handlers, mapping integer Ext
                              type to a callable that unpacks an instance of
                              Ext into an object
+        ext_registry (ExtRegistry): registry of Ext serializable classes
+                                    (default registry of
+                                    :func:`ext_serializable`)
         use_ordered_dict (bool): unpack maps into OrderedDict, instead of dict
                                  (default False)
         use_tuple (bool): unpacks arrays into tuples, instead of lists (default
                           False)
+        object_hook (callable): callable that is passed each unpacked map, and
+                                returns the object to unpack it into
+        object_pairs_hook (callable): callable that is passed a list of the
+                                      (key, value) pairs of each map, and
+                                      returns the object to unpack it into,
+                                      instead of a dict (takes precedence over
+                                      object_hook)
+        list_hook (callable): callable that is passed each unpacked array, and
+                              returns the object to unpack it into
+        raw_keys (bool): unpack string map keys into bytes, without decoding
+                         (default False)
+        strict_map_keys (bool): check map keys for duplicates and
+                                hashability before unpacking their values,
+                                or False to skip the checks for trusted
+                                data, where the last value of a duplicate
+                                key wins (default True)
         allow_invalid_utf8 (bool): unpack invalid strings into instances of
                                    :class:`InvalidString`, for access to the
                                    bytes (default False)
+        timestamp_format (str): unpack timestamps into "datetime" objects,
+                                :class:`Timestamp` "timestamp" objects,
+                                (seconds, nanoseconds) "tuple" tuples, or
+                                integer "nanoseconds" since the epoch
+                                (default "datetime")
+        compatibility (bool): unpack the old specification "raw" type into
+                              bytes (default :data:`umsgpack.compatibility`)
 
     Returns:
         Python object
@@ -1061,7 +2194,8 @@ def _unpackb2(s, **options):
             Unhashable key encountered during map unpacking.
             The serialized map cannot be deserialized into a Python dictionary.
         DuplicateKeyException(UnpackException):
-            Duplicate key encountered during map unpacking.
+            Duplicate key encountered during map unpacking, with
+            strict_map_keys.
 
     Example:
         >>> umsgpack.unpackb(b'\\x82\\xa7compact\\xc3\\xa6schema\\x00')
@@ -1084,13 +2218,39 @@ def _unpackb3(s, **options):
         ext_handlers (dict): dictionary of Ext handlers, mapping integer Ext
                              type to a callable that unpacks an instance of
                              Ext into an object
+        ext_registry (ExtRegistry): registry of Ext serializable classes
+                                    (default registry of
+                                    :func:`ext_serializable`)
         use_ordered_dict (bool): unpack maps into OrderedDict, instead of dict
                                  (default False)
         use_tuple (bool): unpacks arrays into tuples, instead of lists (default
                           False)
+        object_hook (callable): callable that is passed each unpacked map, and
+                                returns the object to unpack it into
+        object_pairs_hook (callable): callable that is passed a list of the
+                                      (key, value) pairs of each map, and
+                                      returns the object to unpack it into,
+                                      instead of a dict (takes precedence over
+                                      object_hook)
+        list_hook (callable): callable that is passed each unpacked array, and
+                              returns the object to unpack it into
+        raw_keys (bool): unpack string map keys into bytes, without decoding
+                         (default False)
+        strict_map_keys (bool): check map keys for duplicates and
+                                hashability before unpacking their values,
+                                or False to skip the checks for trusted
+                                data, where the last value of a duplicate
+                                key wins (default True)
         allow_invalid_utf8 (bool): unpack invalid strings into instances of
                                    :class:`InvalidString`, for access to the
                                    bytes (default False)
+        timestamp_format (str): unpack timestamps into "datetime" objects,
+                                :class:`Timestamp` "timestamp" objects,
+                                (seconds, nanoseconds) "tuple" tuples, or
+                                integer "nanoseconds" since the epoch
+                                (default "datetime")
+        compatibility (bool): unpack the old specification "raw" type into
+                              bytes (default :data:`umsgpack.compatibility`)
 
     Returns:
         Python object
@@ -1110,7 +2270,8 @@ def _unpackb3(s, **options):
             Unhashable key encountered during map unpacking.
             The serialized map cannot be deserialized into a Python dictionary.
         DuplicateKeyException(UnpackException):
-            Duplicate key encountered during map unpacking.
+            Duplicate key encountered during map unpacking, with
+            strict_map_keys.
 
     Example:
         >>> umsgpack.unpackb(b'\\x82\\xa7compact\\xc3\\xa6schema\\x00')
@@ -1120,29 +2281,532 @@ def _unpackb3(s, **options):
         raise TypeError("packed data must be type 'bytes' or 'bytearray'")
     return _unpack(io.BytesIO(s), options)
 
+#############################################################################
+# String Cache
+#############################################################################
+
+
+class StringCache(object):
+    """
+    The StringCache class holds the serialized MessagePack bytes of short
+    strings, such as map keys, that are packed repeatedly. A cache is passed
+    to the packing functions, or to a Packer, with the `string_cache` option,
+    and may be shared across calls.
+
+    Strings are cached as they are packed, until the cache is full, after
+    which the cached strings are retained and other strings are packed
+    without caching.
+    """
+
+    def __init__(self, maxsize=1024, max_length=64, strings=()):
+        """
+        Construct a new StringCache object.
+
+        Keyword Args:
+            maxsize (int): maximum number of cached strings (default 1024)
+            max_length (int): maximum length of a cached string, in
+                              characters (default 64)
+            strings (iterable): strings to precompute, e.g. constant map keys
+
+        Example:
+            >>> cache = umsgpack.StringCache(strings=[u"ts", u"host", u"value"])
+            >>> for record in records:
+            ...     umsgpack.pack(record, f, string_cache=cache)
+            ...
+            >>> cache.hit_rate
+            0.6
+        """
+        self.maxsize = maxsize
+        self.max_length = max_length
+        self.hits = 0
+        self.misses = 0
+        self._packed = {}
+
+        for obj in strings:
+            if len(self._packed) < maxsize and len(obj) <= max_length:
+                self._packed[obj] = _encode_string(obj)
+
+    def __len__(self):
+        """
+        Number of cached strings.
+        """
+        return len(self._packed)
+
+    @property
+    def hit_rate(self):
+        """
+        Fraction of lookups of cacheable strings that were served from the
+        cache.
+        """
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def clear(self):
+        """
+        Remove all cached strings and reset the hit and miss counters.
+        """
+        self._packed.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+#############################################################################
+# Segment Writer
+#############################################################################
+
+# Maximum number of segments per scatter-gather write, the minimum IOV_MAX
+# of POSIX systems
+_iov_max = 1024
+
+
+def _join_segments2(segments):
+    # str.join() of Python 2 does not accept bytearray segments
+    return b"".join(bytes(s) if isinstance(s, bytearray) else s for s in segments)
+
+
+class SegmentWriter(object):
+    """
+    The SegmentWriter class is a .write()-supporting file-like object that
+    collects serialized MessagePack bytes as a list of segments, for output
+    with scatter-gather I/O and without joining them into a single bytes
+    object.
+
+    Writes shorter than `threshold` bytes, such as headers and small objects,
+    are coalesced into shared buffers. Longer writes, such as the payloads of
+    large strings, binary strings, and ext data, are kept by reference,
+    without copying, and must not be modified until the segments are
+    written out.
+    """
+
+    def __init__(self, threshold=_payload_write_size):
+        """
+        Construct a new SegmentWriter object.
+
+        Keyword Args:
+            threshold (int): minimum length of a write that is kept by
+                             reference as its own segment (default 16 KiB)
+
+        Example:
+            >>> writer = umsgpack.SegmentWriter()
+            >>> umsgpack.pack({u"name": u"model.bin", u"data": blob}, writer)
+            >>> writer.writeto(sock)
+        """
+        self.threshold = threshold
+        self._segments = []
+        self._buffer = None
+        self._size = 0
+
+    def write(self, data):
+        """
+        Append bytes to the segments.
+
+        Args:
+            data (bytes): bytes-like object
+
+        Returns:
+            int: number of bytes written
+        """
+        n = len(data)
+        if n < self.threshold:
+            if self._buffer is None:
+                self._buffer = bytearray()
+                self._segments.append(self._buffer)
+            self._buffer += data
+        else:
+            self._segments.append(data)
+            self._buffer = None
+        self._size += n
+        return n
+
+    def __len__(self):
+        """
+        Total length of the segments in bytes.
+        """
+        return self._size
+
+    def getsegments(self):
+        """
+        Get the segments written so far.
+
+        Returns:
+            list: list of bytes-like objects
+        """
+        return list(self._segments)
+
+    def getvalue(self):
+        """
+        Join the segments into a single bytes object.
+
+        Returns:
+            bytes: Serialized MessagePack bytes
+        """
+        return _join_segments(self._segments)
+
+    def writeto(self, fp):
+        """
+        Write the segments to a socket, with :meth:`socket.socket.sendmsg`, to
+        a file descriptor, with :func:`os.writev`, or to a
+        .writelines()-supporting file-like object, without joining them.
+
+        Args:
+            fp: a socket, a file descriptor, or a .writelines()-supporting
+                file-like object
+
+        Raises:
+            IOError:
+                Scatter-gather write made no progress.
+
+        Example:
+            >>> with open('artifact.msgpack', 'wb') as f:
+            ...     writer.writeto(f)
+            ...
+        """
+        if hasattr(fp, "sendmsg"):
+            self._writev(fp.sendmsg)
+        elif hasattr(fp, "sendall"):
+            for s in self._segments:
+                fp.sendall(s)
+        elif isinstance(fp, int):
+            import os
+            if hasattr(os, "writev"):
+                self._writev(lambda segments: os.writev(fp, segments))
+            else:
+                self._writev(lambda segments: os.write(fp, segments[0]))
+        else:
+            fp.writelines(self._segments)
+
+    def _writev(self, writev):
+        # Write segments with a scatter-gather write function, resuming
+        # after partial writes
+        segments = [memoryview(s) for s in self._segments if len(s)]
+        i = 0
+        while i < len(segments):
+            n = writev(segments[i:i + _iov_max])
+            if n == 0:
+                raise IOError("scatter-gather write made no progress")
+            while i < len(segments) and n >= len(segments[i]):
+                n -= len(segments[i])
+                i += 1
+            if n:
+                segments[i] = segments[i][n:]
+
+#############################################################################
+# Packer and Unpacker
+#############################################################################
+
+
+class Packer(object):
+    """
+    The Packer class packs objects to a stream with a fixed set of packing
+    options, and supports writing arrays and maps incrementally, element by
+    element, without materializing them in memory.
+    """
+
+    def __init__(self, fp, **options):
+        """
+        Construct a new Packer object.
+
+        Args:
+            fp: a .write()-supporting file-like object
+
+        Keyword Args:
+            Packing options, see :func:`pack`.
+
+        Example:
+            >>> f = open('test.bin', 'wb')
+            >>> packer = umsgpack.Packer(f)
+            >>> packer.begin_array(3)
+            >>> for i in range(3):
+            ...     packer.pack({u"id": i})
+            ...
+        """
+        self.fp = fp
+        self.options = options
+
+    def pack(self, obj):
+        """
+        Serialize a Python object into MessagePack bytes.
+
+        Args:
+            obj: a Python object
+
+        Raises:
+            UnsupportedTypeException(PackException):
+                Object type not supported for packing.
+        """
+        if self.options.get("iterative"):
+            _pack_iterative(obj, self.fp, self.options)
+        else:
+            _pack_object(obj, self.fp, self.options)
+
+    def packed_size(self, obj):
+        """
+        Compute the length of the serialized MessagePack bytes of a Python
+        object with this Packer's options, without serializing it, e.g. to
+        preallocate a buffer.
+
+        Args:
+            obj: a Python object
+
+        Returns:
+            int: Length of serialized MessagePack bytes
+
+        Raises:
+            UnsupportedTypeException(PackException):
+                Object type not supported for packing.
+            CircularReferenceException(PackException):
+                Circular reference encountered.
+        """
+        return packed_size(obj, **self.options)
+
+    def begin_array(self, length):
+        """
+        Write a MessagePack array header. The header must be followed by
+        exactly `length` packed elements.
+
+        Args:
+            length (int): number of array elements
+
+        Raises:
+            UnsupportedTypeException(PackException):
+                Array length too large for packing.
+        """
+        _pack_array_header(length, self.fp, self.options)
+
+    def begin_map(self, length):
+        """
+        Write a MessagePack map header. The header must be followed by
+        exactly `length` packed key and value pairs.
+
+        Args:
+            length (int): number of map key and value pairs
+
+        Raises:
+            UnsupportedTypeException(PackException):
+                Map length too large for packing.
+        """
+        _pack_map_header(length, self.fp, self.options)
+
+    def pack_array_from(self, iterable, length):
+        """
+        Serialize the elements of an iterable into a MessagePack array,
+        consuming and packing one element at a time.
+
+        Args:
+            iterable: an iterable of Python objects
+            length (int): number of elements yielded by the iterable
+
+        Raises:
+            UnsupportedTypeException(PackException):
+                Object type not supported for packing.
+            ValueError:
+                Iterable does not yield exactly `length` elements.
+        """
+        self.begin_array(length)
+
+        count = 0
+        for e in iterable:
+            if count == length:
+                raise ValueError("iterable yields more than {:d} elements".format(length))
+            self.pack(e)
+            count += 1
+
+        if count != length:
+            raise ValueError("iterable yields {:d} of {:d} elements".format(count, length))
+
+    def pack_map_from(self, items, length):
+        """
+        Serialize key and value pairs of an iterable into a MessagePack map,
+        consuming and packing one pair at a time.
+
+        Args:
+            items: an iterable of (key, value) tuples
+            length (int): number of pairs yielded by the iterable
+
+        Raises:
+            UnsupportedTypeException(PackException):
+                Object type not supported for packing.
+            ValueError:
+                Iterable does not yield exactly `length` pairs.
+        """
+        self.begin_map(length)
+
+        count = 0
+        for k, v in items:
+            if count == length:
+                raise ValueError("iterable yields more than {:d} pairs".format(length))
+            self.pack(k)
+            self.pack(v)
+            count += 1
+
+        if count != length:
+            raise ValueError("iterable yields {:d} of {:d} pairs".format(count, length))
+
+
+class Unpacker(object):
+    """
+    The Unpacker class unpacks objects from a stream with a fixed set of
+    unpacking options, and supports reading arrays and maps incrementally,
+    element by element.
+    """
+
+    def __init__(self, fp, **options):
+        """
+        Construct a new Unpacker object.
+
+        Args:
+            fp: a .read()-supporting file-like object
+
+        Keyword Args:
+            Unpacking options, see :func:`unpack`.
+
+        Example:
+            >>> f = open('test.bin', 'rb')
+            >>> unpacker = umsgpack.Unpacker(f)
+            >>> for _ in range(unpacker.read_array_header()):
+            ...     print(unpacker.unpack())
+            ...
+        """
+        self.fp = fp
+        self.options = options
+
+    def unpack(self):
+        """
+        Deserialize MessagePack bytes into a Python object.
+
+        Returns:
+            Python object
+
+        Raises:
+            UnpackException:
+                Error encountered during unpacking, see :func:`unpack`.
+        """
+        return _unpack(self.fp, self.options)
+
+    def read_array_header(self):
+        """
+        Read a MessagePack array header. The header is followed by the
+        returned number of elements, which may be unpacked individually.
+
+        Returns:
+            int: number of array elements
+
+        Raises:
+            InsufficientDataException(UnpackException):
+                Insufficient data to unpack the array header.
+            UnexpectedTypeException(UnpackException):
+                Next object is not an array.
+        """
+        code = _read_except(self.fp, 1)
+        if _unpack_dispatch_table[code] is not _unpack_array:
+            raise UnexpectedTypeException(
+                "expected array, encountered code: 0x{:02x}".format(ord(code)))
+        return _unpack_array_header(code, self.fp, self.options)
+
+    def read_map_header(self):
+        """
+        Read a MessagePack map header. The header is followed by the returned
+        number of key and value pairs, which may be unpacked individually.
+
+        Returns:
+            int: number of map key and value pairs
+
+        Raises:
+            InsufficientDataException(UnpackException):
+                Insufficient data to unpack the map header.
+            UnexpectedTypeException(UnpackException):
+                Next object is not a map.
+        """
+        code = _read_except(self.fp, 1)
+        if _unpack_dispatch_table[code] is not _unpack_map:
+            raise UnexpectedTypeException(
+                "expected map, encountered code: 0x{:02x}".format(ord(code)))
+        return _unpack_map_header(code, self.fp, self.options)
+
+
+def iter_array(fp, **options):
+    """
+    Deserialize a MessagePack array from a stream, yielding each element as
+    it is unpacked, rather than unpacking the whole array into a list.
+
+    Args:
+        fp: a .read()-supporting file-like object
+
+    Keyword Args:
+        Unpacking options, see :func:`unpack`.
+
+    Returns:
+        generator: generator of Python objects
+
+    Raises:
+        UnexpectedTypeException(UnpackException):
+            Serialized object is not an array.
+        UnpackException:
+            Error encountered during unpacking, see :func:`unpack`.
+
+    Example:
+        >>> f = open('records.bin', 'rb')
+        >>> for record in umsgpack.iter_array(f):
+        ...     process(record)
+        ...
+    """
+    unpacker = Unpacker(fp, **options)
+    for _ in xrange(unpacker.read_array_header()):
+        yield unpacker.unpack()
+
+
+def iter_map_items(fp, **options):
+    """
+    Deserialize a MessagePack map from a stream, yielding each key and value
+    pair as it is unpacked, rather than unpacking the whole map into a
+    dictionary.
+
+    Args:
+        fp: a .read()-supporting file-like object
+
+    Keyword Args:
+        Unpacking options, see :func:`unpack`.
+
+    Returns:
+        generator: generator of (key, value) tuples
+
+    Raises:
+        UnexpectedTypeException(UnpackException):
+            Serialized object is not a map.
+        UnpackException:
+            Error encountered during unpacking, see :func:`unpack`.
+
+    Example:
+        >>> f = open('index.bin', 'rb')
+        >>> for key, value in umsgpack.iter_map_items(f):
+        ...     process(key, value)
+        ...
+    """
+    unpacker = Unpacker(fp, **options)
+    unpack_key = _unpack if not options.get('raw_keys') else _unpack_raw_key
+    for _ in xrange(unpacker.read_map_header()):
+        k = unpack_key(fp, options)
+        if isinstance(k, list):
+            # Convert list into a tuple, as for map keys of unpacked maps
+            k = _deep_list_to_tuple(k)
+        yield (k, unpacker.unpack())
+
+
 #############################################################################
 # Module Initialization
 #############################################################################
 
+# datetime module, imported on first use of timestamp support
+_datetime = None
 
-def __init():
-    global pack
-    global packb
-    global unpack
-    global unpackb
-    global dump
-    global dumps
-    global load
-    global loads
-    global compatibility
+
+def _init_datetime():
+    global _datetime
     global _epoch
+    global _epoch_naive
     global _utc_tzinfo
-    global _float_precision
-    global _unpack_dispatch_table
-    global xrange
 
-    # Compatibility mode for handling strings/bytes with the old specification
-    compatibility = False
+    import datetime
 
     if sys.version_info[0] == 3:
         _utc_tzinfo = datetime.timezone.utc
@@ -1163,6 +2827,57 @@ def __init():
 
     # Calculate an aware epoch datetime
     _epoch = datetime.datetime(1970, 1, 1, tzinfo=_utc_tzinfo)
+    _epoch_naive = datetime.datetime(1970, 1, 1)
+
+    _datetime = datetime
+
+
+def _datetime_module():
+    if _datetime is None:
+        _init_datetime()
+    return _datetime
+
+
+def _ordered_dict():
+    # collections is imported on first use
+    import collections
+    return collections.OrderedDict()
+
+
+def __getattr__(name):
+    # Deferred timestamp support attributes
+    if name in ("_utc_tzinfo", "_epoch", "_epoch_naive"):
+        _init_datetime()
+        return globals()[name]
+    raise AttributeError("module {:s} has no attribute {:s}".format(repr(__name__), repr(name)))
+
+
+def __init():
+    global pack
+    global packb
+    global unpack
+    global unpackb
+    global dump
+    global dumps
+    global load
+    global loads
+    global compatibility
+    global _pack_object
+    global _packed_size_object
+    global _float_precision
+    global _unpack_dispatch_table
+    global _fast_key_types
+    global _sized_stream_types
+    global _join_segments
+    global xrange
+
+    # Compatibility mode for handling strings/bytes with the old specification
+    compatibility = False
+
+    # Set up timestamp support eagerly where module attributes cannot be
+    # deferred
+    if sys.version_info[0:2] < (3, 7):
+        _init_datetime()
 
     # Auto-detect system float precision
     if sys.float_info.mant_dig == 53:
@@ -1172,6 +2887,8 @@ def __init():
 
     # Map packb and unpackb to the appropriate version
     if sys.version_info[0] == 3:
+        _pack_object = _pack_object3
+        _packed_size_object = _packed_size_object3
         pack = _pack3
         packb = _packb3
         dump = _pack3
@@ -1181,7 +2898,12 @@ def __init():
         load = _unpack3
         loads = _unpackb3
         xrange = range
+        _fast_key_types = frozenset([str, bytes, int])
+        _sized_stream_types = (io.BytesIO, io.BufferedReader, io.BufferedRandom, io.FileIO)
+        _join_segments = b"".join
     else:
+        _pack_object = _pack_object2
+        _packed_size_object = _packed_size_object2
         pack = _pack2
         packb = _packb2
         dump = _pack2
@@ -1190,59 +2912,35 @@ def __init():
         unpackb = _unpackb2
         load = _unpack2
         loads = _unpackb2
+        _fast_key_types = frozenset([str, unicode, int, long])  # noqa: F821
+        _sized_stream_types = (io.BytesIO, io.BufferedReader, io.BufferedRandom, io.FileIO, file)  # noqa: F821
+        _join_segments = _join_segments2
 
-    # Build a dispatch table for fast lookup of unpacking function
-
+    # Build a dispatch table for fast lookup of unpacking function, from
+    # ranges of codes
     _unpack_dispatch_table = {}
-    # Fix uint
-    for code in range(0, 0x7f + 1):
-        _unpack_dispatch_table[struct.pack("B", code)] = _unpack_integer
-    # Fix map
-    for code in range(0x80, 0x8f + 1):
-        _unpack_dispatch_table[struct.pack("B", code)] = _unpack_map
-    # Fix array
-    for code in range(0x90, 0x9f + 1):
-        _unpack_dispatch_table[struct.pack("B", code)] = _unpack_array
-    # Fix str
-    for code in range(0xa0, 0xbf + 1):
-        _unpack_dispatch_table[struct.pack("B", code)] = _unpack_string
-    # Nil
-    _unpack_dispatch_table[b'\xc0'] = _unpack_nil
-    # Reserved
-    _unpack_dispatch_table[b'\xc1'] = _unpack_reserved
-    # Boolean
-    _unpack_dispatch_table[b'\xc2'] = _unpack_boolean
-    _unpack_dispatch_table[b'\xc3'] = _unpack_boolean
-    # Bin
-    for code in range(0xc4, 0xc6 + 1):
-        _unpack_dispatch_table[struct.pack("B", code)] = _unpack_binary
-    # Ext
-    for code in range(0xc7, 0xc9 + 1):
-        _unpack_dispatch_table[struct.pack("B", code)] = _unpack_ext
-    # Float
-    _unpack_dispatch_table[b'\xca'] = _unpack_float
-    _unpack_dispatch_table[b'\xcb'] = _unpack_float
-    # Uint
-    for code in range(0xcc, 0xcf + 1):
-        _unpack_dispatch_table[struct.pack("B", code)] = _unpack_integer
-    # Int
-    for code in range(0xd0, 0xd3 + 1):
-        _unpack_dispatch_table[struct.pack("B", code)] = _unpack_integer
-    # Fixext
-    for code in range(0xd4, 0xd8 + 1):
-        _unpack_dispatch_table[struct.pack("B", code)] = _unpack_ext
-    # String
-    for code in range(0xd9, 0xdb + 1):
-        _unpack_dispatch_table[struct.pack("B", code)] = _unpack_string
-    # Array
-    _unpack_dispatch_table[b'\xdc'] = _unpack_array
-    _unpack_dispatch_table[b'\xdd'] = _unpack_array
-    # Map
-    _unpack_dispatch_table[b'\xde'] = _unpack_map
-    _unpack_dispatch_table[b'\xdf'] = _unpack_map
-    # Negative fixint
-    for code in range(0xe0, 0xff + 1):
-        _unpack_dispatch_table[struct.pack("B", code)] = _unpack_integer
+    codes = bytes(bytearray(range(256)))
+    for (first, last, fn) in [
+        (0x00, 0x7f, _unpack_integer),     # Fix uint
+        (0x80, 0x8f, _unpack_map),         # Fix map
+        (0x90, 0x9f, _unpack_array),       # Fix array
+        (0xa0, 0xbf, _unpack_fixstr),      # Fix str
+        (0xc0, 0xc0, _unpack_nil),         # Nil
+        (0xc1, 0xc1, _unpack_reserved),    # Reserved
+        (0xc2, 0xc3, _unpack_boolean),     # Boolean
+        (0xc4, 0xc6, _unpack_binary),      # Bin
+        (0xc7, 0xc9, _unpack_ext),         # Ext
+        (0xca, 0xcb, _unpack_float),       # Float
+        (0xcc, 0xcf, _unpack_integer),     # Uint
+        (0xd0, 0xd3, _unpack_integer),     # Int
+        (0xd4, 0xd8, _unpack_ext),         # Fixext
+        (0xd9, 0xdb, _unpack_string),      # String
+        (0xdc, 0xdd, _unpack_array),       # Array
+        (0xde, 0xdf, _unpack_map),         # Map
+        (0xe0, 0xff, _unpack_integer),     # Negative fixint
+    ]:
+        for code in range(first, last + 1):
+            _unpack_dispatch_table[codes[code:code + 1]] = fn
 
 
 __init()
@@ -1,4 +1,5 @@
-from typing import Any
+import datetime
+from typing import Any, Iterable, Iterator
 
 __version__: str
 
@@ -8,6 +9,9 @@ def pack(obj, fp, **options) -> None: ...
 def packb(obj, **options) -> bytes: ...
 def dump(obj, fp, **options) -> None: ...
 def dumps(obj, **options) -> bytes: ...
+def packed_size(obj, **options) -> int: ...
+def pack_into(obj, buffer, offset: int = ..., **options) -> int: ...
+def packb_chunks(obj: Iterable[Any], max_size: int, **options) -> Iterator[bytes]: ...
 
 def unpackb(s: bytes | bytearray, **options) -> Any: ...
 def unpack(fp, **options) -> Any: ...
@@ -24,17 +28,80 @@ class Ext:
 
 class InvalidString(bytes): ...
 
+class Timestamp:
+    seconds: int
+    nanoseconds: int
+    def __init__(self, seconds: int, nanoseconds: int = ...) -> None: ...
+    @classmethod
+    def from_datetime(cls, dt: datetime.datetime) -> Timestamp: ...
+    @classmethod
+    def from_nanoseconds(cls, nanoseconds: int) -> Timestamp: ...
+    def to_datetime(self) -> datetime.datetime: ...
+    def to_nanoseconds(self) -> int: ...
+    def __eq__(self, other) -> bool: ...
+    def __ne__(self, other) -> bool: ...
+    def __hash__(self) -> int: ...
+
+class ExtRegistry:
+    def __init__(self) -> None: ...
+    def register(self, ext_type: int, cls: type | None = ...) -> Any: ...
+
 def ext_serializable(ext_type: int): ...
 
+class StringCache:
+    maxsize: int
+    max_length: int
+    hits: int
+    misses: int
+    def __init__(self, maxsize: int = ..., max_length: int = ..., strings: Iterable[str] = ...) -> None: ...
+    def __len__(self) -> int: ...
+    @property
+    def hit_rate(self) -> float: ...
+    def clear(self) -> None: ...
+
+class SegmentWriter:
+    threshold: int
+    def __init__(self, threshold: int = ...) -> None: ...
+    def write(self, data) -> int: ...
+    def __len__(self) -> int: ...
+    def getsegments(self) -> list[Any]: ...
+    def getvalue(self) -> bytes: ...
+    def writeto(self, fp) -> None: ...
+
+class Packer:
+    fp: Any
+    options: dict[str, Any]
+    def __init__(self, fp, **options) -> None: ...
+    def pack(self, obj) -> None: ...
+    def packed_size(self, obj) -> int: ...
+    def begin_array(self, length: int) -> None: ...
+    def begin_map(self, length: int) -> None: ...
+    def pack_array_from(self, iterable: Iterable[Any], length: int) -> None: ...
+    def pack_map_from(self, items: Iterable[tuple[Any, Any]], length: int) -> None: ...
+
+class Unpacker:
+    fp: Any
+    options: dict[str, Any]
+    def __init__(self, fp, **options) -> None: ...
+    def unpack(self) -> Any: ...
+    def read_array_header(self) -> int: ...
+    def read_map_header(self) -> int: ...
+
+def iter_array(fp, **options) -> Iterator[Any]: ...
+def iter_map_items(fp, **options) -> Iterator[tuple[Any, Any]]: ...
+
 class PackException(Exception): ...
 class UnpackException(Exception): ...
 class UnsupportedTypeException(PackException): ...
+class CircularReferenceException(PackException): ...
+class InsufficientSpaceException(PackException): ...
 class InsufficientDataException(UnpackException): ...
 class InvalidStringException(UnpackException): ...
 class UnsupportedTimestampException(UnpackException): ...
 class ReservedCodeException(UnpackException): ...
 class UnhashableKeyException(UnpackException): ...
 class DuplicateKeyException(UnpackException): ...
+class UnexpectedTypeException(UnpackException): ...
 KeyNotPrimitiveException = UnhashableKeyException
 KeyDuplicateException = DuplicateKeyException
 
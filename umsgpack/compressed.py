@@ -0,0 +1,311 @@
+# u-msgpack-python compressed block streams
+# https://github.com/vsergeev/u-msgpack-python
+#
+# MIT License, see umsgpack/__init__.py for license details.
+#
+"""
+Compressed block streams for u-msgpack-python.
+
+Packed objects are collected into blocks of approximately a configured size,
+and each block is compressed with a standard library codec and stored as a
+record of a framed container (see :mod:`umsgpack.framed`), so that blocks can
+be read with random access by block number. Blocks always begin at an object
+boundary. Readers decompress a whole block at a time, and feed the decoder from
+an in-memory block buffer.
+
+Block record:
+    MessagePack array of [codec name, uncompressed length, compressed bytes]
+"""
+import io
+import zlib
+
+import umsgpack
+import umsgpack.framed
+
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+# Codecs, mapping name to (compress(data, level), decompress(data))
+_codecs = {
+    "zlib": (lambda data, level: zlib.compress(data, 6 if level is None else level), zlib.decompress),
+}
+
+if bz2 is not None:
+    _codecs["bz2"] = (lambda data, level: bz2.compress(data, 9 if level is None else level), bz2.decompress)
+
+if lzma is not None:
+    _codecs["lzma"] = (lambda data, level: lzma.compress(data, preset=level), lzma.decompress)
+
+# Exceptions raised by codecs on invalid data
+_decompress_errors = (ValueError, IOError, EOFError, zlib.error) + ((lzma.LZMAError,) if lzma is not None else ())
+
+
+class CompressedWriter(object):
+    """
+    The CompressedWriter class packs objects into compressed blocks, written
+    to a stream as the records of a framed container. The last block, record
+    index, and footer are written when the writer is closed.
+    """
+
+    def __init__(self, fp, compression="zlib", block_size=2**20, level=None, **options):
+        """
+        Construct a new CompressedWriter object.
+
+        Args:
+            fp: a .write()-supporting file-like object
+
+        Keyword Args:
+            compression (str): codec, "zlib", "bz2", or "lzma" (default
+                               "zlib")
+            block_size (int): uncompressed size in bytes after which a block
+                              is compressed and written (default 1 MiB)
+            level (int): codec compression level (default codec default)
+            Packing options, see :func:`umsgpack.pack`.
+
+        Raises:
+            ValueError:
+                Unsupported compression codec.
+
+        Example:
+            >>> with umsgpack.compressed.CompressedWriter(open('log.umpz', 'wb'), compression="lzma") as writer:
+            ...     for record in records:
+            ...         writer.pack(record)
+            ...
+        """
+        if compression not in _codecs:
+            raise ValueError("unsupported compression: {:s}".format(repr(compression)))
+
+        self.fp = fp
+        self.compression = compression
+        self.block_size = block_size
+        self.level = level
+        self.options = options
+
+        self._framed = umsgpack.framed.FramedWriter(fp)
+        self._buffer = io.BytesIO()
+
+    @property
+    def closed(self):
+        return self._framed.closed
+
+    def pack(self, obj):
+        """
+        Serialize a Python object into the current block, and compress and
+        write the block if it has reached the block size.
+
+        Args:
+            obj: a Python object
+
+        Raises:
+            UnsupportedTypeException(PackException):
+                Object type not supported for packing.
+            ValueError:
+                Writer is closed.
+        """
+        if self.closed:
+            raise ValueError("write to closed compressed writer")
+
+        umsgpack.pack(obj, self._buffer, **self.options)
+        if self._buffer.tell() >= self.block_size:
+            self.flush()
+
+    def write(self, data):
+        """
+        Write serialized bytes into the current block, e.g. from a
+        :class:`umsgpack.Packer`. Blocks are only ended by :meth:`pack` and
+        :meth:`flush`, so that they begin at object boundaries.
+
+        Args:
+            data (bytes): serialized bytes
+
+        Raises:
+            ValueError:
+                Writer is closed.
+        """
+        if self.closed:
+            raise ValueError("write to closed compressed writer")
+
+        self._buffer.write(data)
+
+    def flush(self):
+        """
+        Compress and write the current block, if it is not empty.
+        """
+        data = self._buffer.getvalue()
+        if not data:
+            return
+
+        compressed = _codecs[self.compression][0](data, self.level)
+        # Block records are independent of the global compatibility mode
+        self._framed.write_packed(umsgpack.packb([self.compression, len(data), compressed], compatibility=False))
+
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+    def close(self):
+        """
+        Compress and write the last block, and write the block index and
+        footer. The underlying stream is not closed.
+        """
+        if self.closed:
+            return
+
+        self.flush()
+        self._framed.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CompressedReader(object):
+    """
+    The CompressedReader class reads objects from a seekable stream of
+    compressed blocks, decompressing one block at a time. It is also a
+    .read()-supporting file-like object of the uncompressed serialized bytes,
+    e.g. for :func:`umsgpack.unpack` or :class:`umsgpack.Unpacker`.
+    """
+
+    def __init__(self, fp, **options):
+        """
+        Construct a new CompressedReader object, and read the block index.
+
+        Args:
+            fp: a .read()-supporting, seekable file-like object, positioned
+                at the container header
+
+        Keyword Args:
+            Unpacking options, see :func:`umsgpack.unpack`.
+
+        Raises:
+            InvalidFrameException(UnpackException):
+                Stream is not a framed container.
+
+        Example:
+            >>> reader = umsgpack.compressed.CompressedReader(open('log.umpz', 'rb'))
+            >>> for record in reader:
+            ...     process(record)
+            ...
+        """
+        self.fp = fp
+        self.options = options
+
+        self._framed = umsgpack.framed.FramedReader(fp, compatibility=False)
+        self.block_count = len(self._framed)
+
+        self._block = io.BytesIO()
+        self._block_length = 0
+        self._next_block = 0
+
+    def read_block(self, index):
+        """
+        Read and decompress a block.
+
+        Args:
+            index (int): block number
+
+        Returns:
+            bytes: uncompressed serialized bytes of the block
+
+        Raises:
+            IndexError:
+                Block number out of range.
+            InvalidFrameException(UnpackException):
+                Invalid or corrupt block.
+        """
+        try:
+            compression, length, compressed = self._framed[index]
+            data = _codecs[compression][1](compressed)
+        except (TypeError, ValueError, KeyError, umsgpack.UnpackException) + _decompress_errors:
+            raise umsgpack.framed.InvalidFrameException("invalid compressed block {:d}".format(index))
+
+        if len(data) != length:
+            raise umsgpack.framed.InvalidFrameException("invalid compressed block {:d}".format(index))
+
+        return data
+
+    def seek_block(self, index):
+        """
+        Position the reader at the start of a block.
+
+        Args:
+            index (int): block number
+
+        Raises:
+            IndexError:
+                Block number out of range.
+        """
+        if not 0 <= index <= self.block_count:
+            raise IndexError("block number out of range")
+
+        self._block = io.BytesIO()
+        self._block_length = 0
+        self._next_block = index
+
+    def read(self, n=-1):
+        """
+        Read uncompressed serialized bytes, decompressing blocks as needed.
+
+        Args:
+            n (int): number of bytes, or -1 to read to the end
+
+        Returns:
+            bytes: up to `n` bytes, fewer at the end of the stream
+        """
+        data = self._block.read(n)
+        if len(data) == n:
+            return data
+
+        chunks = [data]
+        remaining = n - len(data)
+        while (n < 0 or remaining > 0) and self._next_block < self.block_count:
+            data = self.read_block(self._next_block)
+            self._block = io.BytesIO(data)
+            self._block_length = len(data)
+            self._next_block += 1
+
+            data = self._block.read(remaining if n >= 0 else -1)
+            chunks.append(data)
+            remaining -= len(data)
+
+        return b"".join(chunks)
+
+    def _at_end(self):
+        return self._next_block >= self.block_count and self._block.tell() == self._block_length
+
+    def unpack(self):
+        """
+        Deserialize the next object.
+
+        Returns:
+            Python object
+
+        Raises:
+            InsufficientDataException(UnpackException):
+                End of stream, or insufficient data to unpack the serialized
+                object.
+            UnpackException:
+                Error encountered during unpacking, see
+                :func:`umsgpack.unpack`.
+        """
+        return umsgpack.unpack(self, **self.options)
+
+    def __iter__(self):
+        """
+        Deserialize the remaining objects.
+
+        Returns:
+            generator: generator of Python objects
+        """
+        while not self._at_end():
+            yield umsgpack.unpack(self, **self.options)
@@ -0,0 +1,29 @@
+from typing import Any, Iterator
+
+class CompressedWriter:
+    fp: Any
+    compression: str
+    block_size: int
+    level: int | None
+    options: dict[str, Any]
+    def __init__(self, fp, compression: str = ..., block_size: int = ..., level: int | None = ...,
+                 **options) -> None: ...
+    @property
+    def closed(self) -> bool: ...
+    def pack(self, obj) -> None: ...
+    def write(self, data: bytes) -> None: ...
+    def flush(self) -> None: ...
+    def close(self) -> None: ...
+    def __enter__(self) -> CompressedWriter: ...
+    def __exit__(self, exc_type, exc_value, traceback) -> None: ...
+
+class CompressedReader:
+    fp: Any
+    options: dict[str, Any]
+    block_count: int
+    def __init__(self, fp, **options) -> None: ...
+    def read_block(self, index: int) -> bytes: ...
+    def seek_block(self, index: int) -> None: ...
+    def read(self, n: int = ...) -> bytes: ...
+    def unpack(self) -> Any: ...
+    def __iter__(self) -> Iterator[Any]: ...
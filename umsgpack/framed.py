@@ -0,0 +1,456 @@
+# u-msgpack-python framed container format
+# https://github.com/vsergeev/u-msgpack-python
+#
+# MIT License, see umsgpack/__init__.py for license details.
+#
+"""
+Framed container format for u-msgpack-python.
+
+A framed container stores a sequence of MessagePack records, each preceded by
+a length prefix, followed by a trailing index of record offsets. The index
+allows readers to seek to any record and split the records into independent
+ranges of work, without decoding the records before them.
+
+Layout:
+    header      b"UMPF\\x01"
+    records     4-byte big-endian record length, followed by record bytes
+    index       MessagePack array of record offsets, relative to the header
+    footer      8-byte big-endian index offset, followed by b"UMPI"
+"""
+import bisect
+import mmap
+import struct
+import sys
+
+import umsgpack
+
+_HEADER = b"UMPF\x01"
+_FOOTER_MAGIC = b"UMPI"
+_PREFIX = struct.Struct(">I")
+_FOOTER = struct.Struct(">Q4s")
+
+
+class InvalidFrameException(umsgpack.UnpackException):
+    "Invalid framed container encountered during unpacking."
+
+
+##############################################################################
+# Header-only Scanning
+##############################################################################
+
+# Skip table, indexed by MessagePack code, of (payload size, length field,
+# child count, length field child multiplier). The length field, if any, adds
+# its value to the payload size when the multiplier is zero, or its value
+# times the multiplier to the child count otherwise. Reserved codes are None.
+_skip_table = [None] * 256
+
+
+def __init():
+    for code in range(0x00, 0x7f + 1):
+        _skip_table[code] = (0, None, 0, 0)
+    for code in range(0x80, 0x8f + 1):
+        _skip_table[code] = (0, None, 2 * (code & 0x0f), 0)
+    for code in range(0x90, 0x9f + 1):
+        _skip_table[code] = (0, None, code & 0x0f, 0)
+    for code in range(0xa0, 0xbf + 1):
+        _skip_table[code] = (code & 0x1f, None, 0, 0)
+    for code in (0xc0, 0xc2, 0xc3):
+        _skip_table[code] = (0, None, 0, 0)
+    for code, fmt in zip((0xc4, 0xc5, 0xc6), ("B", ">H", ">I")):
+        _skip_table[code] = (0, struct.Struct(fmt), 0, 0)
+    for code, fmt in zip((0xc7, 0xc8, 0xc9), ("B", ">H", ">I")):
+        _skip_table[code] = (1, struct.Struct(fmt), 0, 0)
+    for code, size in zip(range(0xca, 0xd3 + 1), (4, 8, 1, 2, 4, 8, 1, 2, 4, 8)):
+        _skip_table[code] = (size, None, 0, 0)
+    for code, size in zip(range(0xd4, 0xd8 + 1), (2, 3, 5, 9, 17)):
+        _skip_table[code] = (size, None, 0, 0)
+    for code, fmt in zip((0xd9, 0xda, 0xdb), ("B", ">H", ">I")):
+        _skip_table[code] = (0, struct.Struct(fmt), 0, 0)
+    for code, fmt in zip((0xdc, 0xdd), (">H", ">I")):
+        _skip_table[code] = (0, struct.Struct(fmt), 0, 1)
+    for code, fmt in zip((0xde, 0xdf), (">H", ">I")):
+        _skip_table[code] = (0, struct.Struct(fmt), 0, 2)
+    for code in range(0xe0, 0xff + 1):
+        _skip_table[code] = (0, None, 0, 0)
+
+
+__init()
+
+_code_struct = struct.Struct("B")
+
+
+def _skip(buf, offset, end):
+    # Return the offset past the serialized object at offset, reading only
+    # codes and length fields
+    pending = 1
+    try:
+        while pending:
+            if offset >= end:
+                raise umsgpack.InsufficientDataException()
+
+            code = _code_struct.unpack_from(buf, offset)[0]
+            entry = _skip_table[code]
+            if entry is None:
+                raise umsgpack.ReservedCodeException(
+                    "encountered reserved code: 0x{:02x}".format(code))
+
+            payload, length_field, children, multiplier = entry
+            offset += 1
+
+            if length_field is not None:
+                length = length_field.unpack_from(buf, offset)[0]
+                offset += length_field.size
+                if multiplier:
+                    children += length * multiplier
+                else:
+                    payload += length
+
+            offset += payload
+            pending += children - 1
+    except struct.error:
+        raise umsgpack.InsufficientDataException()
+
+    if offset > end:
+        raise umsgpack.InsufficientDataException()
+
+    return offset
+
+
+def scan_records(buf, start=0, end=None):
+    """
+    Find the boundaries of concatenated MessagePack objects in a buffer,
+    reading only type codes and length fields, without unpacking the objects.
+
+    Args:
+        buf (bytes, bytearray, mmap): buffer of concatenated serialized
+                                      MessagePack objects
+        start (int): start offset in buffer (default 0)
+        end (int): end offset in buffer (default length of buffer)
+
+    Returns:
+        generator: generator of (start, end) offset tuples, one per object
+
+    Raises:
+        InsufficientDataException(UnpackException):
+            Last object in buffer is truncated.
+        ReservedCodeException(UnpackException):
+            Reserved code encountered during scanning.
+
+    Example:
+        >>> buf = umsgpack.packb([1, 2]) + umsgpack.packb({u"a": 3})
+        >>> list(umsgpack.framed.scan_records(buf))
+        [(0, 3), (3, 6)]
+    """
+    if end is None:
+        end = len(buf)
+
+    offset = start
+    while offset < end:
+        next_offset = _skip(buf, offset, end)
+        yield (offset, next_offset)
+        offset = next_offset
+
+
+##############################################################################
+# Framed Writer and Reader
+##############################################################################
+
+
+class FramedWriter(object):
+    """
+    The FramedWriter class writes MessagePack records to a stream in the
+    framed container format. The index and footer are written when the writer
+    is closed.
+    """
+
+    def __init__(self, fp, **options):
+        """
+        Construct a new FramedWriter object, and write the container header.
+
+        Args:
+            fp: a .write()-supporting file-like object
+
+        Keyword Args:
+            Packing options, see :func:`umsgpack.pack`.
+
+        Example:
+            >>> with umsgpack.framed.FramedWriter(open('log.umpf', 'wb')) as writer:
+            ...     for record in records:
+            ...         writer.pack(record)
+            ...
+        """
+        self.fp = fp
+        self.options = options
+        self.offsets = []
+        self.closed = False
+
+        self.fp.write(_HEADER)
+        self._offset = len(_HEADER)
+
+    def pack(self, obj):
+        """
+        Serialize a Python object into a MessagePack record.
+
+        Args:
+            obj: a Python object
+
+        Raises:
+            UnsupportedTypeException(PackException):
+                Object type not supported for packing.
+        """
+        self.write_packed(umsgpack.packb(obj, **self.options))
+
+    def write_packed(self, data):
+        """
+        Write already serialized bytes as a record.
+
+        Args:
+            data (bytes): serialized record bytes
+
+        Raises:
+            UnsupportedTypeException(PackException):
+                Record too large for framing.
+            ValueError:
+                Writer is closed.
+        """
+        if self.closed:
+            raise ValueError("write to closed framed writer")
+        elif len(data) > 2**32 - 1:
+            raise umsgpack.UnsupportedTypeException("huge record")
+
+        self.offsets.append(self._offset)
+        self.fp.write(_PREFIX.pack(len(data)))
+        self.fp.write(data)
+        self._offset += _PREFIX.size + len(data)
+
+    def close(self):
+        """
+        Write the record index and footer. The underlying stream is not
+        closed.
+        """
+        if self.closed:
+            return
+
+        self.fp.write(umsgpack.packb(self.offsets))
+        self.fp.write(_FOOTER.pack(self._offset, _FOOTER_MAGIC))
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class FramedReader(object):
+    """
+    The FramedReader class reads MessagePack records from a seekable stream
+    in the framed container format, with random access by record number.
+
+    If the container has no index, e.g. because its writer was not closed,
+    the index is rebuilt by scanning the record length prefixes, and a
+    trailing incomplete record is ignored.
+    """
+
+    def __init__(self, fp, **options):
+        """
+        Construct a new FramedReader object, and read the container index.
+
+        Args:
+            fp: a .read()-supporting, seekable file-like object, positioned
+                at the container header
+
+        Keyword Args:
+            Unpacking options, see :func:`umsgpack.unpack`.
+
+        Raises:
+            InvalidFrameException(UnpackException):
+                Stream is not a framed container.
+
+        Example:
+            >>> reader = umsgpack.framed.FramedReader(open('log.umpf', 'rb'))
+            >>> len(reader)
+            1000
+            >>> reader[500]
+            {'id': 500}
+        """
+        self.fp = fp
+        self.options = options
+
+        self._base = fp.tell()
+        if fp.read(len(_HEADER)) != _HEADER:
+            raise InvalidFrameException("invalid framed container header")
+
+        fp.seek(0, 2)
+        size = fp.tell() - self._base
+
+        self.offsets = None
+        if size >= len(_HEADER) + _FOOTER.size:
+            fp.seek(self._base + size - _FOOTER.size)
+            index_offset, magic = _FOOTER.unpack(fp.read(_FOOTER.size))
+            if magic == _FOOTER_MAGIC and len(_HEADER) <= index_offset <= size - _FOOTER.size:
+                fp.seek(self._base + index_offset)
+                self.offsets = umsgpack.unpackb(fp.read(size - _FOOTER.size - index_offset))
+                self._end = index_offset
+
+        if self.offsets is None:
+            self.offsets, self._end = self._scan(size)
+
+    def _scan(self, size):
+        # Rebuild the index from the record length prefixes
+        offsets = []
+        offset = len(_HEADER)
+        self.fp.seek(self._base + offset)
+        while offset + _PREFIX.size <= size:
+            length = _PREFIX.unpack(self.fp.read(_PREFIX.size))[0]
+            if offset + _PREFIX.size + length > size:
+                break
+            offsets.append(offset)
+            offset += _PREFIX.size + length
+            self.fp.seek(self._base + offset)
+        return offsets, offset
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def read_packed(self, index):
+        """
+        Read the serialized bytes of a record.
+
+        Args:
+            index (int): record number
+
+        Returns:
+            bytes: serialized record bytes
+
+        Raises:
+            IndexError:
+                Record number out of range.
+        """
+        self.fp.seek(self._base + self.offsets[index])
+        length = _PREFIX.unpack(umsgpack._read_except(self.fp, _PREFIX.size))[0]
+        return umsgpack._read_except(self.fp, length)
+
+    def __getitem__(self, index):
+        """
+        Read and deserialize a record.
+
+        Args:
+            index (int): record number
+
+        Returns:
+            Python object
+        """
+        return umsgpack.unpackb(self.read_packed(index), **self.options)
+
+    def iter_records(self, start=0, stop=None):
+        """
+        Read and deserialize a range of records sequentially.
+
+        Args:
+            start (int): first record number (default 0)
+            stop (int): record number to stop at (default number of records)
+
+        Returns:
+            generator: generator of Python objects
+        """
+        if stop is None:
+            stop = len(self.offsets)
+
+        if start < stop:
+            self.fp.seek(self._base + self.offsets[start])
+        for _ in range(start, stop):
+            length = _PREFIX.unpack(umsgpack._read_except(self.fp, _PREFIX.size))[0]
+            yield umsgpack.unpackb(umsgpack._read_except(self.fp, length), **self.options)
+
+    def __iter__(self):
+        return self.iter_records()
+
+    def split(self, n):
+        """
+        Split the records into at most `n` contiguous ranges of approximately
+        equal size in bytes, e.g. for distributing work across processes.
+
+        Args:
+            n (int): maximum number of ranges
+
+        Returns:
+            list: list of (start, stop) record number tuples
+        """
+        if not self.offsets:
+            return []
+
+        first, total = self.offsets[0], self._end - self.offsets[0]
+        bounds = [0]
+        for i in range(1, n):
+            bounds.append(bisect.bisect_left(self.offsets, first + (total * i) // n))
+        bounds.append(len(self.offsets))
+
+        return [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+
+##############################################################################
+# Framing Tool
+##############################################################################
+
+
+def frame_stream(src, dst, **options):
+    """
+    Convert a stream of concatenated MessagePack objects into the framed
+    container format, finding record boundaries with a header-only scan.
+
+    Args:
+        src: a .read()-supporting file-like object of concatenated serialized
+             MessagePack objects
+        dst: a .write()-supporting file-like object
+
+    Keyword Args:
+        Packing options for the record index, see :func:`umsgpack.pack`.
+
+    Returns:
+        int: number of records
+
+    Raises:
+        InsufficientDataException(UnpackException):
+            Last object in stream is truncated.
+        ReservedCodeException(UnpackException):
+            Reserved code encountered during scanning.
+
+    Example:
+        >>> umsgpack.framed.frame_stream(open('log.msgpack', 'rb'), open('log.umpf', 'wb'))
+        1000
+    """
+    try:
+        buf = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, IOError, OSError, ValueError):
+        buf = src.read()
+
+    try:
+        writer = FramedWriter(dst, **options)
+        for start, end in scan_records(buf):
+            writer.write_packed(buf[start:end])
+        writer.close()
+    finally:
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+
+    return len(writer.offsets)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        sys.stderr.write("Usage: python -m umsgpack.framed <input> <output>\n\n")
+        sys.stderr.write("Convert a file of concatenated MessagePack objects into a framed container.\n")
+        return 1
+
+    with open(argv[0], 'rb') as src:
+        with open(argv[1], 'wb') as dst:
+            count = frame_stream(src, dst)
+
+    sys.stdout.write("Framed {:d} records.\n".format(count))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
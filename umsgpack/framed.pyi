@@ -0,0 +1,34 @@
+from typing import Any, Iterator
+
+import umsgpack
+
+class InvalidFrameException(umsgpack.UnpackException): ...
+
+def scan_records(buf, start: int = ..., end: int | None = ...) -> Iterator[tuple[int, int]]: ...
+
+class FramedWriter:
+    fp: Any
+    options: dict[str, Any]
+    offsets: list[int]
+    closed: bool
+    def __init__(self, fp, **options) -> None: ...
+    def pack(self, obj) -> None: ...
+    def write_packed(self, data: bytes) -> None: ...
+    def close(self) -> None: ...
+    def __enter__(self) -> FramedWriter: ...
+    def __exit__(self, exc_type, exc_value, traceback) -> None: ...
+
+class FramedReader:
+    fp: Any
+    options: dict[str, Any]
+    offsets: list[int]
+    def __init__(self, fp, **options) -> None: ...
+    def __len__(self) -> int: ...
+    def read_packed(self, index: int) -> bytes: ...
+    def __getitem__(self, index: int) -> Any: ...
+    def iter_records(self, start: int = ..., stop: int | None = ...) -> Iterator[Any]: ...
+    def __iter__(self) -> Iterator[Any]: ...
+    def split(self, n: int) -> list[tuple[int, int]]: ...
+
+def frame_stream(src, dst, **options) -> int: ...
+def main(argv: list[str] | None = ...) -> int: ...
@@ -0,0 +1,249 @@
+# u-msgpack-python parallel packing and unpacking
+# https://github.com/vsergeev/u-msgpack-python
+#
+# MIT License, see umsgpack/__init__.py for license details.
+#
+"""
+Parallel packing and unpacking for u-msgpack-python.
+
+Large files of concatenated MessagePack records are split into shards of
+consecutive records, with boundaries found by a header-only scan or read from
+the index of a framed container, and the shards are unpacked by the unmodified
+decoder in a pool of worker processes, over shared memory maps of the file.
+
+Large top-level arrays and maps are split into chunks of elements, which are
+packed by the unmodified encoder in a pool of worker threads or processes, and
+joined behind a single header.
+
+Requires Python 3.
+"""
+import collections
+import concurrent.futures
+import io
+import mmap
+import os
+
+import umsgpack
+import umsgpack.framed
+
+
+def _is_framed(buf):
+    # A framed container has a header, and a footer with a valid index offset,
+    # as a plain stream may begin with the bytes of the header
+    size = len(buf)
+    if buf[:len(umsgpack.framed._HEADER)] != umsgpack.framed._HEADER or \
+            size < len(umsgpack.framed._HEADER) + umsgpack.framed._FOOTER.size:
+        return False
+
+    index_offset, magic = umsgpack.framed._FOOTER.unpack(buf[size - umsgpack.framed._FOOTER.size:])
+    return (magic == umsgpack.framed._FOOTER_MAGIC and
+            len(umsgpack.framed._HEADER) <= index_offset <= size - umsgpack.framed._FOOTER.size)
+
+
+def _iter_shards(path, buf, framed, shard_size):
+    # Yield (start, end, count) byte ranges of consecutive records
+    if framed:
+        with open(path, 'rb') as f:
+            reader = umsgpack.framed.FramedReader(f)
+        offsets, end = reader.offsets, reader._end
+        for start, stop in reader.split(max(1, end // shard_size)):
+            yield (offsets[start], offsets[stop] if stop < len(offsets) else end, stop - start)
+        return
+
+    shard_start, count = 0, 0
+    for _, record_end in umsgpack.framed.scan_records(buf):
+        count += 1
+        if record_end - shard_start >= shard_size:
+            yield (shard_start, record_end, count)
+            shard_start, count = record_end, 0
+
+    if count:
+        yield (shard_start, len(buf), count)
+
+
+def _unpack_shard(path, start, count, framed, options):
+    # Worker: unpack count records starting at byte offset start
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        buf.seek(start)
+        unpacker = umsgpack.Unpacker(buf, **options)
+        if framed:
+            objs = []
+            for _ in range(count):
+                buf.seek(umsgpack.framed._PREFIX.size, os.SEEK_CUR)
+                objs.append(unpacker.unpack())
+            return objs
+        return [unpacker.unpack() for _ in range(count)]
+    finally:
+        buf.close()
+
+
+def unpack_file(path, workers=None, ordered=True, framed=None, shard_size=2**24, **options):
+    """
+    Deserialize a file of concatenated MessagePack records, or a framed
+    container, in parallel across worker processes.
+
+    Record boundaries are found with a header-only scan of the file, or read
+    from the index of a framed container, and consecutive records are grouped
+    into shards of approximately `shard_size` bytes. Each shard is unpacked by
+    a worker process from its own memory map of the file. Unpacking options
+    are passed to the workers, and must be picklable.
+
+    Args:
+        path (str): path to file
+
+    Keyword Args:
+        workers (int): number of worker processes (default os.cpu_count())
+        ordered (bool): yield records in file order, rather than in order of
+                        shard completion (default True)
+        framed (bool): file is a framed container (default auto-detect from
+                       the container header and footer, so a container
+                       without an index requires True)
+        shard_size (int): approximate shard size in bytes (default 16 MiB)
+        Unpacking options, see :func:`umsgpack.unpack`.
+
+    Returns:
+        generator: generator of Python objects
+
+    Raises:
+        UnpackException:
+            Error encountered during scanning or unpacking, see
+            :func:`umsgpack.unpack`.
+
+    Example:
+        >>> for record in umsgpack.parallel.unpack_file('log.msgpack', workers=8):
+        ...     process(record)
+        ...
+    """
+    workers = workers or os.cpu_count() or 1
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        if framed is None:
+            framed = _is_framed(buf)
+
+        shards = _iter_shards(path, buf, framed, shard_size)
+
+        # Bound the number of shards in flight, to bound memory held by
+        # unconsumed results
+        window = 2 * workers
+
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            pending = collections.deque() if ordered else set()
+            try:
+                while True:
+                    while len(pending) < window:
+                        shard = next(shards, None)
+                        if shard is None:
+                            break
+                        start, _, count = shard
+                        future = executor.submit(_unpack_shard, path, start, count, framed, options)
+                        if ordered:
+                            pending.append(future)
+                        else:
+                            pending.add(future)
+
+                    if not pending:
+                        break
+
+                    if ordered:
+                        done = [pending.popleft()]
+                    else:
+                        done, pending = concurrent.futures.wait(
+                            pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                    for future in done:
+                        for obj in future.result():
+                            yield obj
+            finally:
+                for future in pending:
+                    future.cancel()
+    finally:
+        buf.close()
+
+
+def _pack_chunk(elements, is_map, options):
+    # Worker: pack the elements, or key-value pairs, of a chunk back to back
+    fp = io.BytesIO()
+    packer = umsgpack.Packer(fp, **options)
+    if is_map:
+        for k, v in elements:
+            packer.pack(k)
+            packer.pack(v)
+    else:
+        for e in elements:
+            packer.pack(e)
+    return fp.getvalue()
+
+
+def packb_parallel(obj, workers=None, use_processes=False, chunk_size=None, **options):
+    """
+    Serialize a Python object into MessagePack bytes, packing the elements of
+    a top-level array or map in parallel across worker threads or processes.
+
+    The elements, or key-value pairs, of the top-level list, tuple, or dict
+    are split into chunks of consecutive elements, each chunk is packed into
+    its own buffer by a worker, and the buffers are joined behind a single
+    array or map header. The result is identical to :func:`umsgpack.packb`.
+    Other objects are packed serially.
+
+    Threads only pack in parallel on free-threaded builds of CPython. With
+    `use_processes`, the elements and packing options must be picklable.
+
+    Args:
+        obj: a Python object
+
+    Keyword Args:
+        workers (int): number of workers (default os.cpu_count())
+        use_processes (bool): use a pool of worker processes, instead of
+                              threads (default False)
+        chunk_size (int): number of elements per chunk (default four chunks
+                          per worker)
+        Packing options, see :func:`umsgpack.packb`.
+
+    Returns:
+        bytes: Serialized MessagePack bytes
+
+    Raises:
+        UnsupportedTypeException(PackException):
+            Object type not supported for packing.
+
+    Example:
+        >>> records = [{u"id": i} for i in range(1000000)]
+        >>> data = umsgpack.parallel.packb_parallel(records, workers=8)
+    """
+    workers = workers or os.cpu_count() or 1
+
+    ext_handlers = options.get("ext_handlers")
+    if (workers == 1 or not isinstance(obj, (list, tuple, dict)) or
+            (isinstance(obj, dict) and options.get("canonical")) or
+            (ext_handlers and obj.__class__ in ext_handlers) or
+            obj.__class__ in options.get("ext_registry", umsgpack._ext_registry)._class_to_type):
+        return umsgpack.packb(obj, **options)
+
+    is_map = isinstance(obj, dict)
+    elements = list(obj.items()) if is_map else obj
+    chunk_size = chunk_size or max(1, -(-len(elements) // (4 * workers)))
+
+    fp = io.BytesIO()
+    header = umsgpack.Packer(fp, **options)
+    if is_map:
+        header.begin_map(len(elements))
+    else:
+        header.begin_array(len(elements))
+
+    if use_processes:
+        executor = concurrent.futures.ProcessPoolExecutor(workers)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+
+    with executor:
+        futures = [executor.submit(_pack_chunk, elements[i:i + chunk_size], is_map, options)
+                   for i in range(0, len(elements), chunk_size)]
+        return fp.getvalue() + b"".join(future.result() for future in futures)
@@ -0,0 +1,6 @@
+from typing import Any, Iterator
+
+def unpack_file(path: str, workers: int | None = ..., ordered: bool = ..., framed: bool | None = ...,
+                shard_size: int = ..., **options) -> Iterator[Any]: ...
+def packb_parallel(obj: Any, workers: int | None = ..., use_processes: bool = ..., chunk_size: int | None = ...,
+                   **options) -> bytes: ...
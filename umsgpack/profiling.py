@@ -0,0 +1,270 @@
+# u-msgpack-python allocation and memory profiling
+# https://github.com/vsergeev/u-msgpack-python
+#
+# MIT License, see umsgpack/__init__.py for license details.
+#
+"""
+Allocation and memory profiling for u-msgpack-python.
+
+A call is run under tracemalloc, and its elapsed time, peak traced memory, and
+the memory still allocated at its end are reported. Allocations are attributed
+to the MessagePack type of the innermost umsgpack function that made them.
+Packing and unpacking profiles additionally count the reads or writes, and the
+bytes copied, through the stream, by MessagePack type.
+
+tracemalloc records only allocations that are live when it is sampled, so
+temporary allocations appear in the peak, but not in the retained counts.
+
+Requires Python 3.
+"""
+import bisect
+import io
+import sys
+import time
+import tracemalloc
+
+import umsgpack
+
+# Depth of tracebacks recorded for each allocation
+_traceback_limit = 16
+
+# Helper functions that are attributed to their caller
+_helper_functions = frozenset(["_read_except", "_pack_push", "_write_payload"])
+
+# Function names, mapped to MessagePack type
+_function_names = {"_unpack": "type code"}
+
+# Function name substrings, mapped to MessagePack type, in order of precedence
+_function_types = [
+    ("timestamp", "timestamp"),
+    ("ext", "ext"),
+    ("fixstr", "string"),
+    ("string", "string"),
+    ("oldspec_raw", "string"),
+    ("binary", "binary"),
+    ("single_lossless", "float"),
+    ("float", "float"),
+    ("integer", "integer"),
+    ("boolean", "boolean"),
+    ("nil", "nil"),
+    ("array", "array"),
+    ("map", "map"),
+]
+
+
+def _function_type(name):
+    try:
+        return _function_names[name]
+    except KeyError:
+        pass
+
+    t = next((t for (s, t) in _function_types if s in name), "other")
+    _function_names[name] = t
+    return t
+
+
+def _function_table():
+    # Sorted (first line number, function name) of umsgpack functions
+    table = []
+    for obj in vars(umsgpack).values():
+        for fn in [obj] + (list(vars(obj).values()) if isinstance(obj, type) else []):
+            code = getattr(fn, "__code__", None)
+            if code is not None and code.co_filename == umsgpack.__file__:
+                table.append((code.co_firstlineno, code.co_name))
+    return sorted(table)
+
+
+class _CountingStream(object):
+    # Stream wrapper counting calls and bytes of reads and writes, by the type
+    # of the calling umsgpack function
+
+    def __init__(self, fp, counts):
+        self.fp = fp
+        self._counts = counts
+
+    def _count(self, n):
+        frame = sys._getframe(2)
+        while frame.f_code.co_name in _helper_functions and frame.f_back is not None:
+            frame = frame.f_back
+
+        counts = self._counts.setdefault(_function_type(frame.f_code.co_name), [0, 0])
+        counts[0] += 1
+        counts[1] += n
+
+    def write(self, data):
+        self._count(len(data))
+        return self.fp.write(data)
+
+    def read(self, n=-1):
+        data = self.fp.read(n)
+        self._count(len(data))
+        return data
+
+
+class Profile(object):
+    """
+    The Profile class holds the results of a profiled call.
+
+    Attributes:
+        name (str): name of the profiled call
+        result: return value of the profiled call
+        elapsed (float): elapsed time in seconds, under tracing
+        peak (int): peak traced memory in bytes during the call
+        retained (int): traced memory in bytes still allocated at the end of
+                        the call, e.g. the result
+        allocations (dict): retained allocations by MessagePack type, mapping
+                            type to [blocks, bytes]
+        io (dict): stream reads or writes by MessagePack type, mapping type to
+                   [calls, bytes], for packing and unpacking profiles
+    """
+
+    def __init__(self, name, result, elapsed, peak, retained, allocations, io):
+        self.name = name
+        self.result = result
+        self.elapsed = elapsed
+        self.peak = peak
+        self.retained = retained
+        self.allocations = allocations
+        self.io = io
+
+    def report(self):
+        """
+        Format the profile as a table.
+
+        Returns:
+            str: report
+        """
+        lines = ["{:s}: {:.3f} ms, peak {:d} bytes, retained {:d} bytes".format(
+                 self.name, self.elapsed * 1e3, self.peak, self.retained)]
+        lines.append("{:<12s} {:>14s} {:>14s} {:>12s} {:>12s}".format(
+                     "type", "alloc blocks", "alloc bytes", "io calls", "io bytes"))
+        for t in sorted(set(self.allocations) | set(self.io)):
+            blocks, size = self.allocations.get(t, (0, 0))
+            calls, copied = self.io.get(t, (0, 0))
+            lines.append("{:<12s} {:>14d} {:>14d} {:>12d} {:>12d}".format(t, blocks, size, calls, copied))
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.report()
+
+
+def _profile(name, fn, args, kwargs, io_counts):
+    if tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is already tracing")
+
+    functions = _function_table()
+    first_lines = [line for (line, _) in functions]
+
+    tracemalloc.start(_traceback_limit)
+    try:
+        start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        retained, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    allocations = {}
+    for trace in snapshot.traces:
+        # Innermost umsgpack function of the allocation. Tracebacks are
+        # ordered from the oldest frame from Python 3.7, and from the most
+        # recent frame before.
+        frames = reversed(trace.traceback) if sys.version_info >= (3, 7) else trace.traceback
+        t = None
+        for frame in frames:
+            if frame.filename != umsgpack.__file__:
+                continue
+            index = bisect.bisect_right(first_lines, frame.lineno) - 1
+            function = functions[index][1] if index >= 0 else ""
+            if function not in _helper_functions:
+                t = _function_type(function)
+                break
+
+        if t is not None:
+            counts = allocations.setdefault(t, [0, 0])
+            counts[0] += 1
+            counts[1] += trace.size
+
+    return Profile(name, result, elapsed, peak - start_memory, retained - start_memory, allocations, io_counts)
+
+
+def profile(fn, *args, **kwargs):
+    """
+    Profile a call of a function, e.g. :func:`umsgpack.packb` or
+    :func:`umsgpack.unpackb`, under tracemalloc.
+
+    Args:
+        fn (callable): function
+        args: positional arguments
+        kwargs: keyword arguments
+
+    Returns:
+        Profile: profile of the call
+
+    Raises:
+        RuntimeError:
+            tracemalloc is already tracing.
+
+    Example:
+        >>> print(umsgpack.profiling.profile(umsgpack.packb, records))
+    """
+    return _profile(getattr(fn, "__name__", repr(fn)), fn, args, kwargs, {})
+
+
+def profile_pack(obj, **options):
+    """
+    Profile packing a Python object with :func:`umsgpack.pack`, counting the
+    writes and bytes copied into the stream by MessagePack type.
+
+    Args:
+        obj: a Python object
+
+    Keyword Args:
+        Packing options, see :func:`umsgpack.pack`.
+
+    Returns:
+        Profile: profile of packing, with the serialized bytes as result
+
+    Raises:
+        RuntimeError:
+            tracemalloc is already tracing.
+        UnsupportedTypeException(PackException):
+            Object type not supported for packing.
+
+    Example:
+        >>> print(umsgpack.profiling.profile_pack(records))
+    """
+    counts = {}
+    fp = io.BytesIO()
+    p = _profile("pack", umsgpack.pack, (obj, _CountingStream(fp, counts)), options, counts)
+    p.result = fp.getvalue()
+    return p
+
+
+def profile_unpack(data, **options):
+    """
+    Profile unpacking MessagePack bytes with :func:`umsgpack.unpack`,
+    counting the reads and bytes copied from the stream by MessagePack type.
+
+    Args:
+        data (bytes): serialized MessagePack bytes
+
+    Keyword Args:
+        Unpacking options, see :func:`umsgpack.unpack`.
+
+    Returns:
+        Profile: profile of unpacking, with the unpacked object as result
+
+    Raises:
+        RuntimeError:
+            tracemalloc is already tracing.
+        UnpackException:
+            Error encountered during unpacking, see :func:`umsgpack.unpack`.
+
+    Example:
+        >>> print(umsgpack.profiling.profile_unpack(data))
+    """
+    counts = {}
+    return _profile("unpack", umsgpack.unpack, (_CountingStream(io.BytesIO(data), counts),), options, counts)
@@ -0,0 +1,17 @@
+from typing import Any, Callable
+
+class Profile:
+    name: str
+    result: Any
+    elapsed: float
+    peak: int
+    retained: int
+    allocations: dict[str, list[int]]
+    io: dict[str, list[int]]
+    def __init__(self, name: str, result: Any, elapsed: float, peak: int, retained: int,
+                 allocations: dict[str, list[int]], io: dict[str, list[int]]) -> None: ...
+    def report(self) -> str: ...
+
+def profile(fn: Callable[..., Any], *args, **kwargs) -> Profile: ...
+def profile_pack(obj, **options) -> Profile: ...
+def profile_unpack(data: bytes | bytearray, **options) -> Profile: ...